@@ -7,6 +7,8 @@ import sys
 import argparse
 import pandas as pd
 import csv
+import json
+import time
 import numpy as np
 import pickle
 from rdkit import Chem
@@ -18,12 +20,15 @@ script_dir = os.path.dirname(os.path.realpath(__file__))
 if __name__ == '__main__':
     sys.path.append(os.path.join(script_dir, '..'))
 
-from docking.docking import dock, set_path
+from docking.docking import dock, set_path, docking_version
+from docking.score_store import ScoreStore
+from docking.conformers import ConformerCache
+from docking.scheduler import DockingQueue, run_docking
 from data_processing.comp_metrics import cLogP, cQED
 
 
 def one_slurm(list_smiles, server, unique_id, name, target='drd3', parallel=True, exhaustiveness=16, mean=False,
-              load=False):
+              load=False, store=None):
     """
 
     :param list_smiles:
@@ -34,6 +39,7 @@ def one_slurm(list_smiles, server, unique_id, name, target='drd3', parallel=True
     :param exhaustiveness:
     :param mean:
     :param load:
+    :param store: ScoreStore of known docking scores, None to dock everything
     :return:
     """
     pythonsh, vina = set_path(server)
@@ -45,9 +51,9 @@ def one_slurm(list_smiles, server, unique_id, name, target='drd3', parallel=True
         csv.writer(csvfile).writerow(header)
 
     for smile in list_smiles:
-        score_smile = dock(smile, target='drd3', unique_id=unique_id, parallel=parallel, exhaustiveness=exhaustiveness,
+        score_smile = dock(smile, target=target, unique_id=unique_id, parallel=parallel, exhaustiveness=exhaustiveness,
                            mean=mean,
-                           pythonsh=pythonsh, vina=vina, load=load)
+                           pythonsh=pythonsh, vina=vina, load=load, store=store)
         # score_smile = 0
         with open(dump_path, 'a', newline='') as csvfile:
             list_to_write = [smile, score_smile]
@@ -134,11 +140,121 @@ def one_slurm_qsar(list_smiles, unique_id, name):
             csv.writer(csvfile).writerow(list_to_write)
 
 
-def main(proc_id, num_procs, server, exhaustiveness, name, oracle, target):
+def read_gamma(name):
+    """ Current CbAS threshold gamma of the run (maximized scale : minus the docking score), -1000 at the start """
+    try:
+        with open(os.path.join(script_dir, 'results', name, 'params_gentrain.json')) as f:
+            return json.load(f).get('gamma', -1000)
+    except FileNotFoundError:
+        return -1000
+
+
+def refine_selection(screen_scores, gamma, quantile=0.7, margin=2.):
+    """
+    Ligands to re-dock at full exhaustiveness after the low exhaustiveness screen : those that could reach gamma.
+    The next gamma is estimated as in trainer.process_samples, from the screening scores : max(gamma, quantile of
+    minus the scores). A ligand is refined if minus its screening score is within margin (kcal/mol) of this estimate.
+    The gaussian oracle of the trainer keeps samples down to ~1.6 kcal/mol under gamma, margin also covers the noise
+    of the screen. Failed dockings (score 0, or no score) are not refined, see screen_failures.
+    :return: list of smiles to refine, estimated gamma
+    """
+    docked = {s: -v for s, v in screen_scores.items() if v != 0}
+    if len(docked) == 0:
+        return [], gamma
+    gamma_est = max(gamma, float(np.quantile(list(docked.values()), quantile)))
+    return [s for s, v in docked.items() if v >= gamma_est - margin], gamma_est
+
+
+def screen_failures(smiles, screen_scores, screen_ex, failed_score=0):
+    """
+    Rows (smile, failed_score, screen_ex) of the ligands whose screen failed : they have no screening score in the
+    store and are not refined, they are written with the failure score like the failed ligands of run_docking
+    """
+    failed = [[s, failed_score, screen_ex] for s in dict.fromkeys(smiles) if s not in screen_scores]
+    if len(failed) > 0:
+        print(f'{len(failed)} ligands failed the screen at exhaustiveness {screen_ex}, scored {failed_score}')
+    return failed
+
+
+def log_savings(name, worker, screen, refine, screen_ex, exhaustiveness):
+    """
+    Docking cpu-hours saved by the screen for the ligands docked by this process : cost of docking them all at full
+    exhaustiveness, minus the cost of the screen and of the refinement. The full cost of one ligand is measured on the
+    refined ligands, or extrapolated from the screen if none was refined (vina time is linear in exhaustiveness).
+    screen, refine : Progress returned by run_docking for both steps
+    One row per docking process is appended to results/[name]/multi_fidelity.csv, summed up by trainer.gather_scores
+    """
+    if refine.docked > 0:
+        full_seconds = refine.seconds / refine.docked
+    elif screen.docked > 0:
+        full_seconds = screen.seconds / screen.docked * exhaustiveness / screen_ex
+    else:
+        full_seconds = 0
+    spent = (screen.seconds + refine.seconds) / 3600
+    saved = screen.docked * full_seconds / 3600 - spent
+    print(f'>>> Multi-fidelity docking : {screen.docked} ligands screened at exhaustiveness {screen_ex}, '
+          f'{refine.docked} refined at {exhaustiveness}, {spent:.2f} cpu-hours spent, ~{saved:.2f} cpu-hours saved')
+
+    log_path = os.path.join(script_dir, 'results', name, 'multi_fidelity.csv')
+    new_file = not os.path.exists(log_path)
+    with open(log_path, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(['worker', 'screened', 'refined', 'screen_ex', 'exhaustiveness', 'spent_hours',
+                             'saved_hours'])
+        writer.writerow([worker, screen.docked, refine.docked, screen_ex, exhaustiveness, spent, saved])
+
+
+def main(proc_id, num_procs, server, exhaustiveness, name, oracle, target, db=None, timeout=1200, retries=2,
+         screen_ex=None, quantile=0.7, margin=2.):
     # parse the docking task of the whole job array and split it
     dump_path = os.path.join(script_dir, 'results', name, 'docker_samples.p')
     list_smiles = pickle.load(open(dump_path, 'rb'))
 
+    if oracle == 'docking':
+        # No static split : all the tasks of the array claim the next ligand from a shared queue when they are free
+        queue_path = os.path.join(script_dir, 'results', name, 'docking_queue.db')
+        stale_after = timeout * (retries + 1) + 300
+        store = ScoreStore(db) if db is not None else ScoreStore()
+        # each task embeds the ligands it claims that are not in the conformer cache yet
+        dock_fn = partial(scheduled_dock, server=server, target=target, store=store, timeout=timeout,
+                          conformers=ConformerCache())
+        csv_path = os.path.join(script_dir, 'results', name, 'docking_small_results', f'{proc_id}.csv')
+        if not screen_ex:
+            run_docking(partial(dock_fn, exhaustiveness=exhaustiveness), csv_path,
+                        queue=DockingQueue(queue_path, list_smiles, stale_after=stale_after), worker_id=proc_id,
+                        retries=retries, fields={'exhaustiveness': exhaustiveness})
+            return
+
+        # Multi-fidelity : the whole array screens at screen_ex, waits for the last screened ligand, then refines
+        screen_queue = DockingQueue(queue_path, list_smiles, stale_after=stale_after, name=f'screen_{screen_ex}')
+        screen_fn = partial(dock_fn, exhaustiveness=screen_ex)
+        screen = run_docking(screen_fn, os.devnull, queue=screen_queue, worker_id=proc_id, retries=retries)
+        while screen_queue.remaining() > 0:
+            # ligands still docked by other tasks, handed out again if their task was killed
+            time.sleep(30)
+            late = run_docking(screen_fn, os.devnull, queue=screen_queue, worker_id=proc_id, retries=retries)
+            screen.docked, screen.seconds = screen.docked + late.docked, screen.seconds + late.seconds
+
+        # same selection in all tasks : the screening scores are read from the store
+        version = docking_version(set_path(server)[1], etkdg=True)
+        screen_scores = store.get_many(list_smiles, target, screen_ex, version)
+        refine, gamma_est = refine_selection(screen_scores, read_gamma(name), quantile=quantile, margin=margin)
+        if proc_id == 0:
+            print(f'{len(refine)}/{len(screen_scores)} ligands to refine (estimated gamma {gamma_est:.2f})')
+            refine_set = set(refine)
+            with open(csv_path, 'w', newline='') as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(['smile', 'score', 'exhaustiveness'])
+                writer.writerows([s, v, screen_ex] for s, v in screen_scores.items() if s not in refine_set)
+                writer.writerows(screen_failures(list_smiles, screen_scores, screen_ex))
+        refined = run_docking(partial(dock_fn, exhaustiveness=exhaustiveness), csv_path,
+                              queue=DockingQueue(queue_path, refine, stale_after=stale_after,
+                                                 name=f'refine_{exhaustiveness}'),
+                              worker_id=proc_id, retries=retries, fields={'exhaustiveness': exhaustiveness})
+        log_savings(name, proc_id, screen, refined, screen_ex, exhaustiveness)
+        return
+
     N = len(list_smiles)
     chunk_size, rab = N // num_procs, N % num_procs
     chunk_min, chunk_max = proc_id * chunk_size, min((proc_id + 1) * chunk_size, N)
@@ -155,28 +271,27 @@ def main(proc_id, num_procs, server, exhaustiveness, name, oracle, target):
     elif oracle in ['clogp', 'cqed']:  # composite logp or composite qed
         one_slurm_composite(list_data, proc_id, name, oracle)
 
-    # Do the docking and dump results
-    elif oracle == 'docking':
-        one_slurm(list_data,
-                  target=target,
-                  name=name,
-                  server=server,
-                  unique_id=proc_id,
-                  parallel=False,
-                  exhaustiveness=exhaustiveness,
-                  mean=True)
     else:
         raise ValueError(f'oracle {oracle} not implemented')
 
 
-def one_dock(smile, server, parallel=False, exhaustiveness=16, mean=False, load=False, target='drd3'):
+def one_dock(smile, server, parallel=False, exhaustiveness=16, mean=False, load=False, target='drd3', store=None):
     pythonsh, vina = set_path(server)
     score_smile = dock(smile, unique_id=smile, parallel=parallel, exhaustiveness=exhaustiveness, mean=mean,
-                       pythonsh=pythonsh, vina=vina, load=load, target=target)
+                       pythonsh=pythonsh, vina=vina, load=load, target=target, store=store)
 
     return score_smile
 
 
+def scheduled_dock(smile, unique_id, server, exhaustiveness=16, target='drd3', store=None, timeout=1200,
+                   conformers=None):
+    """ Mean docking score of one ligand for the docking scheduler, raises when docking fails """
+    pythonsh, vina = set_path(server)
+    return dock(smile, unique_id=unique_id, parallel=False, exhaustiveness=exhaustiveness, mean=True,
+                pythonsh=pythonsh, vina=vina, target=target, store=store, timeout=timeout, raise_errors=True,
+                conformers=conformers)
+
+
 def one_qed(smile):
     m = Chem.MolFromSmiles(smile)
     return 0 if m is None else QED.qed(m)
@@ -192,12 +307,62 @@ def one_fp(smile):
     return None
 
 
-def one_node_main(server, exhaustiveness, name, oracle, target='drd3'):
+def one_node_main(server, exhaustiveness, name, oracle, target='drd3', db=None, n_workers=20, timeout=1200, retries=2,
+                  screen_ex=None, quantile=0.7, margin=2., list_smiles=None, gamma=None):
+    """
+    Scores the samples of the iteration into results/[name]/docking_small_results/0.csv
+    screen_ex : multi-fidelity docking, all the samples are docked at exhaustiveness screen_ex first and only the ones
+    that could reach gamma (see refine_selection) are re-docked at full exhaustiveness. None : dock all at full.
+    list_smiles, gamma : samples and current gamma, default : read from results/[name]
+    """
     from multiprocessing import Pool
 
     # parse the docking task of the whole job array and split it
-    load_path = os.path.join(script_dir, 'results', name, 'docker_samples.p')
-    list_smiles = pickle.load(open(load_path, 'rb'))
+    if list_smiles is None:
+        load_path = os.path.join(script_dir, 'results', name, 'docker_samples.p')
+        list_smiles = pickle.load(open(load_path, 'rb'))
+    dump_path = os.path.join(script_dir, 'results', name, 'docking_small_results', '0.csv')
+
+    if oracle == 'docking':
+        # Molecules already docked with these settings, in this run or any previous one, are read from the store
+        store = ScoreStore(db) if db is not None else ScoreStore()
+        version = docking_version(set_path(server)[1], etkdg=True)
+        known = store.get_many(list_smiles, target, exhaustiveness, version)
+        to_dock = [s for s in dict.fromkeys(list_smiles) if s not in known]
+        print(f'{len(list_smiles) - len(to_dock)}/{len(list_smiles)} docking scores found in the store')
+        with open(dump_path, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['smile', 'score', 'exhaustiveness'])
+            writer.writerows([s, v, exhaustiveness] for s, v in known.items())
+        # 3D conformers of the new ligands, embedded over all workers before docking
+        conformers = ConformerCache()
+        for s, err in conformers.embed_batch(to_dock, n_jobs=n_workers).items():
+            print(f'Could not embed {s} : {err}')
+        # The other scores are appended as soon as each ligand is docked, free workers take the next ligand
+        dock_fn = partial(scheduled_dock, server=server, target=target, store=store, timeout=timeout,
+                          conformers=conformers)
+        if not screen_ex:
+            run_docking(partial(dock_fn, exhaustiveness=exhaustiveness), dump_path, smiles=to_dock,
+                        n_workers=n_workers, retries=retries, fields={'exhaustiveness': exhaustiveness})
+            return
+
+        # Multi-fidelity : screen all new ligands at screen_ex, keep the screening score of the ones that can't
+        # reach gamma and re-dock the others at full exhaustiveness
+        screen = run_docking(partial(dock_fn, exhaustiveness=screen_ex), os.devnull, smiles=to_dock,
+                             n_workers=n_workers, retries=retries)
+        screen_scores = store.get_many(to_dock, target, screen_ex, version)
+        gamma = read_gamma(name) if gamma is None else gamma
+        refine, gamma_est = refine_selection(screen_scores, gamma, quantile=quantile, margin=margin)
+        print(f'{len(refine)}/{len(screen_scores)} ligands to refine (estimated gamma {gamma_est:.2f})')
+        refine_set = set(refine)
+        with open(dump_path, 'a', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerows([s, v, screen_ex] for s, v in screen_scores.items() if s not in refine_set)
+            writer.writerows(screen_failures(to_dock, screen_scores, screen_ex))
+        refined = run_docking(partial(dock_fn, exhaustiveness=exhaustiveness), dump_path, smiles=refine,
+                              n_workers=n_workers, retries=retries, fields={'exhaustiveness': exhaustiveness})
+        log_savings(name, 0, screen, refined, screen_ex, exhaustiveness)
+        return
 
     p = Pool(20)
     # Just use qed
@@ -226,18 +391,9 @@ def one_node_main(server, exhaustiveness, name, oracle, target='drd3'):
         svm_model = pickle.load(
             open(os.path.join(script_dir, '..', 'results', 'saved_models', 'qsar_svm.pickle'), 'rb'))
         list_results = svm_model.predict_proba(input_array)[:, 1]
-    elif oracle == 'docking':
-        list_results = p.map(partial(one_dock,
-                                     server=server,
-                                     parallel=False,
-                                     exhaustiveness=exhaustiveness,
-                                     mean=True,
-                                     load=False,
-                                     target=target), list_smiles)
     else:
         raise ValueError(f'oracle {oracle} not implemented')
 
-    dump_path = os.path.join(script_dir, 'results', name, 'docking_small_results', '0.csv')
     df = pd.DataFrame.from_dict({'smile': list_smiles, 'score': list_results})
     df.to_csv(dump_path)
 
@@ -247,10 +403,18 @@ if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
     parser.add_argument("-s", "--server", default='mac', help="Server to run the docking on, for path and configs.")
-    parser.add_argument("-ex", "--exhaustiveness", default=64, help="exhaustiveness parameter for vina")
+    parser.add_argument("-ex", "--exhaustiveness", type=int, default=64, help="exhaustiveness parameter for vina")
     parser.add_argument("-n", "--name", default='search_vae', help="Name of the exp")
     parser.add_argument('--oracle', type=str)  # 'qed' or 'docking' or 'qsar'
     parser.add_argument('--target', type=str, default='drd3')
+    parser.add_argument('--db', type=str, default=None, help="docking score store, default docking/docking_scores.db")
+    parser.add_argument('--timeout', type=int, default=1200, help="time budget of one vina run, in seconds")
+    parser.add_argument('--retries', type=int, default=2, help="retries of a failed docking")
+    parser.add_argument('--screen_ex', type=int, default=0,
+                        help="multi-fidelity docking : exhaustiveness of the screen before refinement, 0 : off")
+    parser.add_argument('--quantile', type=float, default=0.7, help="quantile of the trainer, to estimate gamma")
+    parser.add_argument('--margin', type=float, default=2.,
+                        help="refine ligands screened within margin kcal/mol of the estimated gamma")
     args, _ = parser.parse_known_args()
 
     try:
@@ -268,4 +432,10 @@ if __name__ == '__main__':
          exhaustiveness=args.exhaustiveness,
          name=args.name,
          oracle=args.oracle,
-         target=args.target)
+         target=args.target,
+         db=args.db,
+         timeout=args.timeout,
+         retries=args.retries,
+         screen_ex=args.screen_ex,
+         quantile=args.quantile,
+         margin=args.margin)
@@ -0,0 +1,154 @@
+"""
+In-memory CbAS driver for one node : the prior model, the search model with its optimizer (GenTrain) and the
+featurization maps of its dataset stay loaded across iterations, and the samples go from the sampler to the docker
+and the trainer as python objects.
+
+The files of a job run (weights.pth, optim.pth, weights_[iteration].pth, samples.p, docker_samples.p,
+params_gentrain.json) are still written, in a background thread, as recovery checkpoints : a stopped run can be
+continued by the sampler / docker / trainer jobs (cbas/slurm_master.py) or by a new driver.
+
+python main_cbas.py --in_memory --oracle docking --server [computer_name] --name [name]
+"""
+import os
+import sys
+import json
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+if __name__ == '__main__':
+    sys.path.append(os.path.join(script_dir, '..'))
+
+from utils import Dumper
+from model import model_from_json
+from cbas.gen_train import GenTrain
+from cbas.sampler import draw_samples
+from cbas.docker import one_node_main
+from cbas.trainer import gather_scores, process_samples
+
+
+def _to_cpu(obj):
+    """ Copy of obj (nested dicts, lists and tuples) with its tensors cloned on cpu, safe to save while training """
+    if torch.is_tensor(obj):
+        return obj.detach().cpu().clone()
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+def _write(path, obj, fmt):
+    # written next to the target then renamed, a crash never leaves a truncated checkpoint
+    tmp_path = path + '.tmp'
+    if fmt == 'torch':
+        torch.save(obj, tmp_path)
+    elif fmt == 'json':
+        with open(tmp_path, 'w') as f:
+            print(json.dumps(obj, indent=4), file=f)
+    else:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(obj, f)
+    os.replace(tmp_path, path)
+
+
+class AsyncCheckpointer:
+    """
+    Writes checkpoints in a background thread, one at a time in submission order. The objects are copied to cpu
+    when submitted, so that the models can be trained while their previous state is written.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(1)
+        self.pending = []
+
+    def save(self, path, obj, fmt='torch'):
+        """ fmt : 'torch', 'pickle' or 'json' """
+        self.pending.append(self.executor.submit(_write, path, _to_cpu(obj), fmt))
+        # raise errors of the checkpoints already written
+        while self.pending and self.pending[0].done():
+            self.pending.pop(0).result()
+
+    def wait(self):
+        while self.pending:
+            self.pending.pop(0).result()
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
+
+
+class CbASDriver:
+    """
+    Runs the CbAS iterations of results/[name] in this process. The run must be set up (slurm_master.setup) : the
+    search model starts from results/[name]/weights.pth and the optimizer from optim.pth if it exists.
+    """
+
+    def __init__(self, prior_name, name):
+        self.name = name
+        self.savepath = os.path.join(script_dir, 'results', name)
+        self.json_path = os.path.join(self.savepath, 'params_gentrain.json')
+        self.params = Dumper().load(self.json_path)
+        self.gamma = self.params.pop('gamma')
+
+        self.prior_model = model_from_json(prior_name)
+        search_model = model_from_json(prior_name)
+        search_model.load(os.path.join(self.savepath, 'weights.pth'))
+        # optimizer, scheduler and featurization maps, built once
+        self.trainer = GenTrain(search_model, **self.params)
+        self.checkpoints = AsyncCheckpointer()
+
+    @property
+    def search_model(self):
+        return self.trainer.model
+
+    def sample(self, max_samples, diversity_picker=-1, w_min=-1, temperature=0., top_k=0, top_p=1., scripted=False):
+        samples, weights = draw_samples(self.prior_model, self.search_model, max_samples, diversity_picker, w_min,
+                                        temperature=temperature, top_k=top_k, top_p=top_p, scripted=scripted)
+        self.checkpoints.save(os.path.join(self.savepath, 'docker_samples.p'), samples, fmt='pickle')
+        self.checkpoints.save(os.path.join(self.savepath, 'samples.p'), (samples, weights), fmt='pickle')
+        return samples, weights
+
+    def score(self, samples, iteration, oracle, **docker_kwargs):
+        """ {smile: score} of the samples, scored by docker.one_node_main and gathered as in the trainer job """
+        one_node_main(name=self.name, oracle=oracle, list_smiles=samples, gamma=self.gamma, **docker_kwargs)
+        return gather_scores(iteration, self.name)
+
+    def train(self, iteration, score_dict, samples, weights, quantile, uncertainty, oracle):
+        samples, weights, self.gamma = process_samples(score_dict, samples, weights, uncertainty=uncertainty,
+                                                       quantile=quantile, oracle=oracle, prev_gamma=self.gamma)
+        self.trainer.step('smiles', samples, weights, dump=False)
+
+        state = self.search_model.state_dict()
+        self.checkpoints.save(self.json_path, dict(self.params, gamma=float(self.gamma)), fmt='json')
+        self.checkpoints.save(os.path.join(self.savepath, 'weights.pth'), state)
+        self.checkpoints.save(os.path.join(self.savepath, f'weights_{iteration}.pth'), state)
+        optim_state = {'optimizer_state_dict': self.trainer.optimizer.state_dict()}
+        if self.trainer.scheduler is not None:
+            optim_state['scheduler_state_dict'] = self.trainer.scheduler.state_dict()
+        self.checkpoints.save(os.path.join(self.savepath, 'optim.pth'), optim_state)
+
+    def close(self):
+        """ Waits for the last checkpoints """
+        self.checkpoints.close()
+
+
+def run_in_memory(args, n_workers=None):
+    """ Runs the iterations of main_cbas.py in this process, the run must be set up (slurm_master.setup) """
+    driver = CbASDriver(args.prior_name, args.name)
+    try:
+        for iteration in range(1, args.iters + 1):
+            samples, weights = driver.sample(args.max_samples, diversity_picker=args.diversity_picker,
+                                             w_min=args.cap_weights, temperature=args.temperature, top_k=args.top_k,
+                                             top_p=args.top_p, scripted=args.scripted)
+            score_dict = driver.score(samples, iteration, args.oracle, server=args.server, exhaustiveness=args.ex,
+                                      target=args.target, n_workers=n_workers or os.cpu_count(),
+                                      screen_ex=args.screen_ex, quantile=args.quantile, margin=args.fidelity_margin)
+            driver.train(iteration, score_dict, samples, weights, quantile=args.quantile,
+                         uncertainty=args.uncertainty, oracle=args.oracle)
+            print(f'finished iteration {iteration}')
+    finally:
+        driver.close()
+    return driver
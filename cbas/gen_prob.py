@@ -9,29 +9,33 @@ Proba to generate a sample given a model
 """
 
 import torch
-from torch import nn
 
 
-def GenProb(x, z, model):
+def GenProb(x, z, model, lengths=None):
     """
     Inputs :
         x : array indices. Shape batch_size * seq_len
         z : latent point 
-        model : vae (requires .decode function)
+        model : vae (requires .sequence_logprob function)
+        lengths : if given, only the first lengths[i] chars of row i are scored
+    Output : log p(x|z) under the model, shape batch_size
     """
-    with torch.no_grad():
-        out = model.decode(z)
-        sigma = nn.LogSoftmax(dim=1)  # shape is (N, num_chars_in_alphbabet, sequence_len)
-        logprob = sigma(out)
-
-        # logprob of x 
-        one_hot = torch.nn.functional.one_hot(x, model.voc_size)
-        one_hot = one_hot.transpose(2, 1).float()  # to shape N, n_chars, sequence_len
+    return GenProbs(x, z, [model], lengths)[0]
 
-        logprob = logprob * one_hot
-        logprob_x = torch.sum(logprob.reshape(z.shape[0], -1), dim=1)
 
-    return logprob_x.cpu()
+def GenProbs(x, z, models, lengths=None):
+    """
+    Scores the same samples under several models (typically prior and search model)
+    Inputs :
+        x : array indices. Shape batch_size * seq_len
+        z : latent point
+        models : list of vaes, sharing the same alphabet
+        lengths : if given, only the first lengths[i] chars of row i are scored (see Model.decoded_lengths)
+    Output : list of log p(x|z) tensors (shape batch_size), one per model
+    """
+    with torch.no_grad():
+        logprobs = [model.sequence_logprob(z, x, lengths).cpu() for model in models]
+    return logprobs
 
 
 if __name__ == '__main__':
@@ -49,11 +53,9 @@ if __name__ == '__main__':
 
     z = model.sample_z_prior(n_mols=12)
 
-    true_dec = model.decode(z)
-    _, true_dec = torch.max(true_dec, dim=1)
+    true_dec = model.decode_indices(z)
 
-    l_true = GenProb(true_dec, z, model)
-    l = GenProb(x, z, model)
+    l_true, l = GenProbs(true_dec, z, [model, model])[0], GenProb(x, z, model)
 
     print('logprob of the true decoded x |z ', l_true.cpu().detach())
     print('logprob of a randomly sampled x |z ', l.cpu().detach())
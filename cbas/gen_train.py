@@ -71,10 +71,11 @@ class GenTrain():
         self.dataset = SimpleDataset(maps_path=map_path, vocab='selfies', alphabet=self.json_alphabet_name,
                                      debug=self.debug)
 
-    def step(self, input_type, x, w):
+    def step(self, input_type, x, w, dump=True):
         """ 
         Trains the model for n_epochs on samples x, weighted by w 
         input type : 'selfies' or 'smiles', for dataloader (validity checks and format conversions are different)
+        dump : save the weights and optimizer state at the end, False when the caller saves them (cbas/driver.py)
         """
 
         if input_type == 'smiles':
@@ -130,10 +131,12 @@ class GenTrain():
                     print(smiles[:5])
 
         # Update weights at 'save_model_weights' : 
-        print(f'Finished training after {total_steps} optimizer steps. Saving search model weights')
-        self.model.cpu()
-        self.dump()
-        self.model.to(self.device)
+        print(f'Finished training after {total_steps} optimizer steps.')
+        if dump:
+            print('Saving search model weights')
+            self.model.cpu()
+            self.dump()
+            self.model.to(self.device)
 
     def dump(self):
         """
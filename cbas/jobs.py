@@ -0,0 +1,155 @@
+"""
+Job backends of the CbAS pipeline : the sampler, docker and trainer jobs of each iteration are submitted as shell
+scripts, each job after the previous one (dependency afterany, as with sbatch --depend=afterany).
+
+- SlurmBackend : sbatch on a cluster, the master exits and SLURM runs the jobs
+- LocalBackend : stand-in for sbatch on one machine, job arrays are split in tasks that share a pool of process slots
+
+Both read the #SBATCH directives of the scripts, so the same scripts run on the cluster and on one machine.
+"""
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+
+
+def read_directives(script):
+    """ {option: value} of the #SBATCH --option=value (or --option value) lines of a job script """
+    directives = {}
+    with open(script) as f:
+        for line in f:
+            match = re.match(r'#SBATCH\s+--([\w-]+)(?:[=\s]\s*(\S+))?', line)
+            if match is not None:
+                directives[match.group(1)] = match.group(2)
+    return directives
+
+
+def array_indices(spec):
+    """ Task indices of an --array spec : '0-199', '1,3,5-7', '0-15:4', '0-199%20' (the limit is ignored) """
+    indices = []
+    for part in spec.split('%')[0].split(','):
+        bounds, _, step = part.partition(':')
+        first, _, last = bounds.partition('-')
+        indices.extend(range(int(first), int(last or first) + 1, int(step or 1)))
+    return indices
+
+
+class SlurmBackend:
+    """ sbatch : job ids are parsed from 'Submitted batch job [id]' """
+
+    def submit(self, script, args=(), depend=()):
+        cmd = ['sbatch']
+        if depend:
+            cmd.append(f'--depend=afterany:{":".join(depend)}')
+        out = subprocess.run(cmd + [script] + [str(a) for a in args], stdout=subprocess.PIPE).stdout.decode('utf-8')
+        return out.split()[3]
+
+    def wait(self, job_ids=None):
+        """ Jobs run on the cluster once the master has exited """
+        return {}
+
+    def report(self):
+        return ''
+
+
+class LocalJob:
+    def __init__(self, job_id, script, args, depend):
+        self.id = job_id
+        self.script = script
+        self.args = [str(a) for a in args]
+        self.depend = list(depend)
+        self.directives = read_directives(script)
+        self.name = self.directives.get('job-name') or os.path.basename(script)
+        array = self.directives.get('array')
+        self.tasks = array_indices(array) if array is not None else [None]
+        self.returncodes = []
+        self.submitted = time.perf_counter()
+        self.start = self.end = None
+        self.finished = threading.Event()
+
+
+class LocalBackend:
+    """
+    sbatch on one machine. Each job waits for the jobs it depends on to be finished (failed or not, as afterany),
+    then its tasks (one per index of --array, else one) are run with sh on a pool of n_slots process slots, shared
+    by all jobs. Tasks get the SLURM_* environment variables of an array task, and their stdout / stderr go to the
+    --output / --error paths of the script (%A, %a, %j and %x are replaced).
+    """
+
+    def __init__(self, n_slots=None, cwd=script_dir):
+        self.n_slots = n_slots or os.cpu_count()
+        self.cwd = cwd
+        self.pool = ThreadPoolExecutor(self.n_slots)  # each thread runs one task process at a time
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, script, args=(), depend=()):
+        with self.lock:
+            job_id = str(len(self.jobs) + 1)
+            job = LocalJob(job_id, script, args, depend)
+            self.jobs[job_id] = job
+        threading.Thread(target=self._run_job, args=(job,), daemon=True).start()
+        return job_id
+
+    def _run_job(self, job):
+        for dep in job.depend:
+            self.jobs[dep].finished.wait()
+        job.start = time.perf_counter()
+        futures = [self.pool.submit(self._run_task, job, task) for task in job.tasks]
+        job.returncodes = [f.result() for f in futures]
+        job.end = time.perf_counter()
+        job.finished.set()
+
+    def _log_path(self, job, pattern, task):
+        # %j : id of the task itself, job_task for array tasks
+        path = pattern.replace('%A', job.id).replace('%a', str(task)).replace('%x', job.name)
+        path = path.replace('%j', job.id if task is None else f'{job.id}_{task}')
+        path = os.path.join(self.cwd, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _run_task(self, job, task):
+        # python in the scripts is the interpreter of the master
+        env = dict(os.environ, SLURM_JOB_ID=job.id, SLURM_JOB_NAME=job.name,
+                   PATH=os.path.dirname(sys.executable) + os.pathsep + os.environ.get('PATH', ''))
+        if task is not None:
+            env.update(SLURM_ARRAY_JOB_ID=job.id, SLURM_ARRAY_TASK_ID=str(task),
+                       SLURM_ARRAY_TASK_COUNT=str(len(job.tasks)), SLURM_ARRAY_TASK_MIN=str(min(job.tasks)),
+                       SLURM_ARRAY_TASK_MAX=str(max(job.tasks)))
+        out_path = self._log_path(job, job.directives.get('output') or 'slurm-%j.out', task)
+        err_path = self._log_path(job, job.directives['error'], task) if job.directives.get('error') else out_path
+        with open(out_path, 'w') as out, open(err_path, 'a' if err_path == out_path else 'w') as err:
+            return subprocess.run(['sh', job.script] + job.args, cwd=self.cwd, env=env, stdout=out,
+                                  stderr=err).returncode
+
+    def wait(self, job_ids=None):
+        """ Waits for the jobs (default : all submitted jobs), returns {job id: return codes of its tasks} """
+        job_ids = list(self.jobs) if job_ids is None else job_ids
+        for job_id in job_ids:
+            self.jobs[job_id].finished.wait()
+        return {job_id: self.jobs[job_id].returncodes for job_id in job_ids}
+
+    def report(self):
+        """ Queued and running time of each finished job, to benchmark the pipeline """
+        lines = [f'{"job":>5} {"name":<10} {"tasks":>6} {"failed":>6} {"queued (s)":>11} {"run (s)":>9}']
+        for job in self.jobs.values():
+            if not job.finished.is_set():
+                continue
+            failed = sum(code != 0 for code in job.returncodes)
+            lines.append(f'{job.id:>5} {job.name:<10} {len(job.tasks):>6} {failed:>6} '
+                         f'{job.start - job.submitted:>11.1f} {job.end - job.start:>9.1f}')
+        return '\n'.join(lines)
+
+
+def get_backend(name, n_slots=None):
+    """ 'slurm' or 'local' """
+    if name == 'slurm':
+        return SlurmBackend()
+    if name == 'local':
+        return LocalBackend(n_slots)
+    raise ValueError(f'job backend {name} not implemented')
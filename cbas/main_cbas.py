@@ -1,8 +1,8 @@
 """
 
-Same as slurm master but directly packaged as a python script to be run from one node
-Params to be blended/changed :
-
+Same as slurm master but directly packaged as a python script to be run from one node :
+the same sampler / docker / trainer jobs and on-disk layout, run by the local job backend (cbas/jobs.py)
+With --in_memory, the iterations run in this process instead, with the models kept loaded (cbas/driver.py)
 
 """
 import os
@@ -14,12 +14,7 @@ sys.path.append(os.path.join(script_dir, '..'))
 import argparse
 import torch
 
-from utils import Dumper, soft_mkdir
-from model import model_from_json
-
-from cbas.sampler import main as sampler_main
-from cbas.docker import one_node_main as docker_main
-from cbas.trainer import main as trainer_main
+from cbas.slurm_master import setup, run_local
 
 if __name__ == '__main__':
 
@@ -30,6 +25,8 @@ if __name__ == '__main__':
     parser.add_argument('-n', '--name', type=str, default='cbas_run')  # the name of the experiment
     parser.add_argument('--iters', type=int, default=20)  # Number of iterations
     parser.add_argument('--oracle', type=str, default='qed')  # 'qed' or 'docking' or 'qsar' or 'clogp' or 'cqed'
+    parser.add_argument('--slots', type=int, default=0)  # Number of jobs run in parallel. 0 : cpu count
+    parser.add_argument('--in_memory', action='store_true')  # run all iterations in this process, models kept loaded
 
     # SAMPLER
     parser.add_argument('--max_samples', type=int, default=1000)  # Nbr of samples at each iter
@@ -37,11 +34,17 @@ if __name__ == '__main__':
     # if diversity_picker == -1, default behaviour of cbas: finetuning on all samples 
     
     parser.add_argument('--cap_weights', type=float, default = -1)  # min value to cap weights. Ignored if set to -1.
+    parser.add_argument('--temperature', type=float, default=0.)  # char sampling temperature. 0 : greedy decoding
+    parser.add_argument('--top_k', type=int, default=0)  # sample among the top_k most likely chars. 0 : no truncation
+    parser.add_argument('--top_p', type=float, default=1.)  # nucleus sampling threshold. 1 : no truncation
+    parser.add_argument('--scripted', action='store_true')  # greedy decoding with the TorchScript sampler
 
     # DOCKER
     parser.add_argument('--server', type=str, default='pasteur', help='server to run on') # server : 'rup', 'mac', 'pasteur', 'cedar'
     parser.add_argument('--target', type=str, default='drd3', help='target to dock')
     parser.add_argument('--ex', type=int, default=16)  # Nbr of samples at each iter
+    parser.add_argument('--screen_ex', type=int, default=0)  # multi-fidelity : exhaustiveness of the screen. 0 : off
+    parser.add_argument('--fidelity_margin', type=float, default=2.)  # refine screened ligands up to margin under gamma
 
     # TRAINER
     parser.add_argument('--quantile', type=float, default=0.7)  # quantile of scores accepted
@@ -63,61 +66,11 @@ if __name__ == '__main__':
 
     assert args.oracle in ['qed','clogp','cqed', 'docking', 'qsar'] 
 
+    if args.in_memory:
+        from cbas.driver import run_in_memory
 
-    def setup():
-        pass
-        soft_mkdir(os.path.join(script_dir, 'results'))
-        soft_mkdir(os.path.join(script_dir, 'results', args.name))
-        soft_mkdir(os.path.join(script_dir, 'results', args.name, 'docking_results'))
-        soft_mkdir(os.path.join(script_dir, 'results', args.name, 'docking_small_results'))
-
-
-    setup()
-    savepath = os.path.join(script_dir, 'results', args.name)
-    soft_mkdir(savepath)
-
-    # Save experiment parameters
-    dumper = Dumper(dumping_path=os.path.join(savepath, 'experiment.json'), dic=args.__dict__)
-    dumper.dump()
-
-    params_gentrain = {'savepath': savepath,
-                       'epochs': args.epochs,
-                       'device': device,
-                       'lr': args.learning_rate,
-                       'clip_grad': args.clip_grad_norm,
-                       'beta': args.beta,
-                       'processes': args.procs,
-                       'optimizer': args.opti,
-                       'scheduler': args.sched,
-                       'alphabet_name': args.alphabet,
-                       'gamma': -1000,
-                       'DEBUG': True}
-    dumper = Dumper(dumping_path=os.path.join(savepath, 'params_gentrain.json'), dic=params_gentrain)
-    dumper.dump()
-
-    prior_model_init = model_from_json(args.prior_name)
-    torch.save(prior_model_init.state_dict(), os.path.join(savepath, "weights.pth"))
-
-    for iteration in range(1, args.iters + 1):
-        # SAMPLING
-        sampler_main(prior_name=args.prior_name,
-                     name=args.name,
-                     max_samples=args.max_samples,
-                     diversity_picker = args.diversity_picker,
-                     oracle=args.oracle, 
-                     w_min = args.cap_weights)
-
-        # DOCKING
-        docker_main(server=args.server,
-                    exhaustiveness=args.ex,
-                    name=args.name,
-                    oracle=args.oracle,
-                    target=args.target)
-
-        # AGGREGATION AND TRAINING
-        trainer_main(prior_name=args.prior_name,
-                     name=args.name,
-                     iteration=iteration,
-                     quantile=args.quantile,
-                     uncertainty=args.uncertainty,
-                     oracle=args.oracle)
+        setup(args, alphabet_name=args.alphabet, device=device)
+        run_in_memory(args, n_workers=args.slots or None)
+    else:
+        # sampler -> docker (job array over all cpus) -> trainer jobs of each iteration, run on this machine
+        run_local(args, alphabet_name=args.alphabet, n_slots=args.slots or None, device=device)
@@ -15,9 +15,11 @@ script_dir = os.path.dirname(os.path.realpath(__file__))
 if __name__ == '__main__':
     sys.path.append(os.path.join(script_dir, '..'))
 
-from cbas.gen_prob import GenProb
+from cbas.gen_prob import GenProbs
 from utils import *
+from selfies import decoder_indices, LRUCache
 from model import model_from_json
+from scripted_sampler import script_sampler
 from data_processing.sascorer import calculateScore
 
 # import torch
@@ -25,7 +27,11 @@ from data_processing.sascorer import calculateScore
 # np.random.seed(42)
 # torch.manual_seed(42)
 
-def get_samples(prior_model, search_model, max, w_min):
+# Decoded token rows, kept across iterations when get_samples is called several times by the same process
+DECODE_CACHE = LRUCache(maxsize=200000)
+
+
+def get_samples(prior_model, search_model, max, w_min, temperature=0., top_k=0, top_p=1., scripted=False):
     """
     Take initial samples from a prior model. Computes importance sampling weights
     This will try to produce new ones up until a certain limit of tries is reached
@@ -33,6 +39,10 @@ def get_samples(prior_model, search_model, max, w_min):
     :param search_model:
     :param max:
     :param w_min: minimum value to cap weights p(x;prior)/p(x;search model)
+    :param temperature: if > 0, chars are sampled instead of greedily decoded (see Model.decode_indices)
+    :param top_k: top-k truncation of the char sampling distribution
+    :param top_p: nucleus truncation of the char sampling distribution
+    :param scripted: greedy decoding with the TorchScript sampler
     :return:
     """
 
@@ -48,6 +58,10 @@ def get_samples(prior_model, search_model, max, w_min):
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
     search_model.to(device)
     prior_model.to(device)
+    sampler = None
+    if scripted and temperature <= 0:
+        search_model.eval()
+        sampler = script_sampler(search_model)
 
     # print(search_model)
     # print(prior_model)
@@ -63,12 +77,23 @@ def get_samples(prior_model, search_model, max, w_min):
 
         # Get raw samples
         samples_z = search_model.sample_z_prior(n_mols=batch_size)
-        gen_seq = search_model.decode(samples_z)
-        _, sample_indices = torch.max(gen_seq, dim=1)
-
         # Compute weights while we have indices and store them: p(x|z, theta)/p(x|z, phi)
-        prior_prob = GenProb(sample_indices, samples_z, prior_model)
-        search_prob = GenProb(sample_indices, samples_z, search_model)
+        if temperature > 0:
+            # The search proba is the one of the distribution the chars were actually drawn from, over the chars
+            # decoded before the row finished. The prior proba is computed over the same chars.
+            sample_indices, search_prob = search_model.decode_indices(samples_z, stop_on_pad=True,
+                                                                      return_logprobs=True,
+                                                                      temperature=temperature,
+                                                                      top_k=top_k, top_p=top_p)
+            lengths = search_model.decoded_lengths(sample_indices)
+            prior_prob = GenProbs(sample_indices, samples_z, [prior_model], lengths)[0]
+        else:
+            if sampler is not None:
+                with torch.no_grad():
+                    sample_indices = sampler(samples_z)
+            else:
+                sample_indices = search_model.decode_indices(samples_z, stop_on_pad=True)
+            prior_prob, search_prob = GenProbs(sample_indices, samples_z, [prior_model, search_model])
         batch_weights = torch.exp(prior_prob - search_prob)
         # print(prior_prob)
         # print(search_prob)
@@ -81,9 +106,10 @@ def get_samples(prior_model, search_model, max, w_min):
         new_ones = 0
         filtered_sa = 0
         filtered_qed = 0
-        batch_selfies = search_model.indices_to_smiles(sample_indices)
-        for i, s in enumerate(batch_selfies):
-            new_selfie = decoder(s)
+        # Identical token sequences are decoded and parsed once, with the weight of their first occurrence
+        unique_indices, first_positions, _ = unique_rows(sample_indices)
+        batch_smiles = decoder_indices(unique_indices, search_model.index_to_char, cache=DECODE_CACHE)
+        for i, new_selfie in zip(first_positions, batch_smiles):
             m = Chem.MolFromSmiles(new_selfie)
             if m is None:
                 continue
@@ -110,16 +136,15 @@ def get_samples(prior_model, search_model, max, w_min):
     return sample_selfies, weights
 
 
-def main(prior_name, name, max_samples, diversity_picker, oracle, w_min):
-    prior_model = model_from_json(prior_name)
-
-    # We start by creating another prior instance, then replace it with the actual weights
-    # name = search_vae
-    search_model = model_from_json(prior_name)
-    model_weights_path = os.path.join(script_dir, 'results', name, 'weights.pth')
-    search_model.load(model_weights_path)
-
-    samples, weights = get_samples(prior_model, search_model, max=max_samples, w_min=w_min)
+def draw_samples(prior_model, search_model, max_samples, diversity_picker, w_min, temperature=0., top_k=0, top_p=1.,
+                 scripted=False):
+    """
+    Samples of the search model and their importance weights, subsampled with the diversity picker if
+    0 < diversity_picker < max_samples
+    :return: list of smiles, list of weights
+    """
+    samples, weights = get_samples(prior_model, search_model, max=max_samples, w_min=w_min,
+                                   temperature=temperature, top_k=top_k, top_p=top_p, scripted=scripted)
 
     # if diversity picker < max_samples, we subsample with rdkit picker : 
     if 0 < diversity_picker < max_samples:
@@ -134,42 +159,29 @@ def main(prior_name, name, max_samples, diversity_picker, oracle, w_min):
         idces = list(pickIndices)
         samples = [samples[i] for i in idces]
         weights = [weights[i] for i in idces]
+    return samples, weights
 
-    # Since we don't maintain a dict for qed, we just give everything to the docker
-    if oracle != 'docking' or True:
-        dump_path = os.path.join(script_dir, 'results', name, 'docker_samples.p')
-        pickle.dump(samples, open(dump_path, 'wb'))
-
-        # Dump for the trainer
-        dump_path = os.path.join(script_dir, 'results', name, 'samples.p')
-        pickle.dump((samples, weights), open(dump_path, 'wb'))
-
-    else:
-        # Memoization, we split the list into already docked ones and dump a simili-docking csv
-        whole_path = os.path.join(script_dir, '..', 'data', 'drd3_scores.pickle')
-        docking_whole_results = pickle.load(open(whole_path, 'rb'))
-        filtered_smiles = list()
-        already_smiles = list()
-        already_scores = list()
-        for i, smile in enumerate(samples):
-            if smile in docking_whole_results:
-                already_smiles.append(smile)
-                already_scores.append(docking_whole_results[smile])
-            else:
-                filtered_smiles.append(smile)
 
-        # Dump simili-docking
-        dump_path = os.path.join(script_dir, 'results', name, 'docking_small_results', 'simili.csv')
-        df = pd.DataFrame.from_dict({'smile': already_smiles, 'score': already_scores})
-        df.to_csv(dump_path)
+def main(prior_name, name, max_samples, diversity_picker, oracle, w_min, temperature=0., top_k=0, top_p=1.,
+         scripted=False):
+    prior_model = model_from_json(prior_name)
+
+    # We start by creating another prior instance, then replace it with the actual weights
+    # name = search_vae
+    search_model = model_from_json(prior_name)
+    model_weights_path = os.path.join(script_dir, 'results', name, 'weights.pth')
+    search_model.load(model_weights_path)
+
+    samples, weights = draw_samples(prior_model, search_model, max_samples, diversity_picker, w_min,
+                                    temperature=temperature, top_k=top_k, top_p=top_p, scripted=scripted)
 
-        # Dump for the docker
-        dump_path = os.path.join(script_dir, 'results', name, 'docker_samples.p')
-        pickle.dump(filtered_smiles, open(dump_path, 'wb'))
+    # Everything goes to the docker, scores already known are read from the docking score store
+    dump_path = os.path.join(script_dir, 'results', name, 'docker_samples.p')
+    pickle.dump(samples, open(dump_path, 'wb'))
 
-        # Dump for the trainer
-        dump_path = os.path.join(script_dir, 'results', name, 'samples.p')
-        pickle.dump((samples, weights), open(dump_path, 'wb'))
+    # Dump for the trainer
+    dump_path = os.path.join(script_dir, 'results', name, 'samples.p')
+    pickle.dump((samples, weights), open(dump_path, 'wb'))
 
 
 if __name__ == '__main__':
@@ -184,6 +196,10 @@ if __name__ == '__main__':
                         default=-1)  # diverse samples subset size. if negative, all selected
     parser.add_argument('--oracle', type=str)  # 'qed' or 'docking' or 'qsar'
     parser.add_argument('--cap_weights', type=float, default=-1)  # min value to cap weights. Ignored if set to -1.
+    parser.add_argument('--temperature', type=float, default=0.)  # char sampling temperature. 0 : greedy decoding
+    parser.add_argument('--top_k', type=int, default=0)  # sample among the top_k most likely chars. 0 : no truncation
+    parser.add_argument('--top_p', type=float, default=1.)  # nucleus sampling threshold. 1 : no truncation
+    parser.add_argument('--scripted', action='store_true')  # greedy decoding with the TorchScript sampler
     # =======
 
     args, _ = parser.parse_known_args()
@@ -193,4 +209,8 @@ if __name__ == '__main__':
          max_samples=args.max_samples,
          diversity_picker=args.diversity_picker,
          oracle=args.oracle,
-         w_min=args.cap_weights)
+         w_min=args.cap_weights,
+         temperature=args.temperature,
+         top_k=args.top_k,
+         top_p=args.top_p,
+         scripted=args.scripted)
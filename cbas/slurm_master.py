@@ -2,8 +2,8 @@
 
 Slurm Master
 
-Params to be blended/changed :
-
+Submits the sampler -> docker -> trainer jobs of all iterations to a job backend (cbas/jobs.py) :
+sbatch on a cluster (--backend slurm), or a local stand-in that runs the same jobs on one machine (--backend local)
 
 """
 import os
@@ -13,11 +13,125 @@ script_dir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(script_dir, '..'))
 
 import argparse
-import subprocess
 import torch
 
 from utils import Dumper, soft_mkdir
 from model import model_from_json
+from cbas.jobs import get_backend
+
+
+def setup(args, alphabet_name, device='cpu'):
+    """ results/[name] directories, experiment parameters, params_gentrain.json and initial search model weights """
+    soft_mkdir(os.path.join(script_dir, 'results'))
+    soft_mkdir(os.path.join(script_dir, 'results', args.name))
+    soft_mkdir(os.path.join(script_dir, 'results', args.name, 'docking_results'))
+    soft_mkdir(os.path.join(script_dir, 'results', args.name, 'docking_small_results'))
+    savepath = os.path.join(script_dir, 'results', args.name)
+
+    # Save experiment parameters
+    dumper = Dumper(dumping_path=os.path.join(savepath, 'experiment.json'), dic=args.__dict__)
+    dumper.dump()
+
+    params_gentrain = {'savepath': savepath,
+                       'epochs': args.epochs,
+                       'device': device,
+                       'lr': args.learning_rate,
+                       'clip_grad': args.clip_grad_norm,
+                       'beta': args.beta,
+                       'processes': args.procs,
+                       'optimizer': args.opti,
+                       'scheduler': args.sched,
+                       'alphabet_name': alphabet_name,
+                       'gamma': -1000,
+                       'DEBUG': True}
+    dumper = Dumper(dumping_path=os.path.join(savepath, 'params_gentrain.json'), dic=params_gentrain)
+    dumper.dump()
+
+    prior_model_init = model_from_json(args.prior_name)
+    print(prior_model_init)
+    torch.save(prior_model_init.state_dict(), os.path.join(savepath, "weights.pth"))
+    return savepath
+
+
+def dump_sh(dirname=script_dir, n_docker_tasks=200, cluster=True, log_dir='out_slurm'):
+    """
+    Writes the sh scripts of the sampler, docker and trainer jobs to dirname. The scripts pass their arguments on
+    to the python entry points. cluster : SLURM resources for CEDAR, else scripts for the LocalBackend
+    """
+
+    def header(f, job_name, time, resources=(), log_name='%A'):
+        f.write('#!/bin/sh\n')
+        if cluster:
+            f.write('#SBATCH --account=def-jeromew\n')
+            f.write(f'#SBATCH --time={time}\n')
+        f.write(f'#SBATCH --job-name={job_name}\n')
+        f.write(f'#SBATCH --output={log_dir}/{job_name}_{log_name}.out\n')
+        f.write(f'#SBATCH --error={log_dir}/{job_name}_{log_name}.err\n')
+        if cluster:
+            for line in resources:
+                f.write(f'#SBATCH {line}\n')
+
+    # Sampler
+    with open(os.path.join(dirname, 'slurm_sampler.sh'), 'w') as f:
+        header(f, 'sampler', '01:00:00', ['--gres=gpu:1', '--mem=4000M'])  # gpu request, memory (per node)
+        f.write('python sampler.py "$@"\n')
+
+    # Docker : one task per cpu, the tasks claim the ligands from a shared queue
+    with open(os.path.join(dirname, 'slurm_docker.sh'), 'w') as f:
+        header(f, 'docker', '02:00:00', ['--cpus-per-task=1'], log_name='%A_%a')
+        f.write(f'#SBATCH --array=0-{n_docker_tasks - 1}\n')
+        f.write('python docker.py $SLURM_ARRAY_TASK_ID $SLURM_ARRAY_TASK_COUNT "$@"\n')
+
+    # Trainer
+    with open(os.path.join(dirname, 'slurm_trainer.sh'), 'w') as f:
+        header(f, 'trainer', '00:40:00', ['--gres=gpu:1', '--mem=4000M'])  # gpu request, memory (per node)
+        f.write('python trainer.py "$@"\n')
+
+
+def launch(args, backend, jobs_dir=script_dir):
+    """ Submits the jobs of all iterations, returns the list of (sampler, docker, trainer) job ids """
+    job_ids = []
+    id_train = None
+    for iteration in range(1, args.iters + 1):
+        # SAMPLING
+        sampler_args = ['--prior_name', args.prior_name, '--name', args.name, '--max_samples', args.max_samples,
+                        '--oracle', args.oracle, '--cap_weights', args.cap_weights,
+                        '--diversity_picker', args.diversity_picker, '--temperature', args.temperature,
+                        '--top_k', args.top_k, '--top_p', args.top_p] + (['--scripted'] if args.scripted else [])
+        id_sample = backend.submit(os.path.join(jobs_dir, 'slurm_sampler.sh'), sampler_args,
+                                   depend=[id_train] if id_train is not None else [])
+
+        # DOCKING
+        docker_args = ['--server', args.server, '--exhaustiveness', args.ex, '--name', args.name,
+                       '--oracle', args.oracle, '--target', args.target, '--screen_ex', args.screen_ex,
+                       '--quantile', args.quantile, '--margin', args.fidelity_margin]
+        id_dock = backend.submit(os.path.join(jobs_dir, 'slurm_docker.sh'), docker_args, depend=[id_sample])
+
+        # AGGREGATION AND TRAINING
+        trainer_args = ['--prior_name', args.prior_name, '--name', args.name, '--iteration', iteration,
+                        '--quantile', args.quantile, '--uncertainty', args.uncertainty, '--oracle', args.oracle]
+        id_train = backend.submit(os.path.join(jobs_dir, 'slurm_trainer.sh'), trainer_args, depend=[id_dock])
+
+        job_ids.append((id_sample, id_dock, id_train))
+        print(f'launched iteration {iteration}')
+    return job_ids
+
+
+def run_local(args, alphabet_name, n_slots=None, device='cpu'):
+    """ Runs the whole pipeline on this machine with the LocalBackend, with the on-disk layout of a SLURM run """
+    backend = get_backend('local', n_slots)
+    savepath = setup(args, alphabet_name, device)
+    jobs_dir = os.path.join(savepath, 'jobs')
+    soft_mkdir(jobs_dir)
+    dump_sh(jobs_dir, n_docker_tasks=backend.n_slots, cluster=False, log_dir=os.path.join(savepath, 'logs'))
+    launch(args, backend, jobs_dir)
+    codes = backend.wait()
+    print(backend.report())
+    failed = [job_id for job_id, job_codes in codes.items() if any(code != 0 for code in job_codes)]
+    if failed:
+        print(f'Failed jobs : {failed}, see {os.path.join(savepath, "logs")}')
+    return backend
+
 
 if __name__ == '__main__':
 
@@ -26,15 +140,24 @@ if __name__ == '__main__':
     parser.add_argument('-n', '--name', type=str, default='search_vae')  # the name of the experiment
     parser.add_argument('--iters', type=int, default=2)  # Number of iterations
     parser.add_argument('--oracle', type=str, default='qed')  # 'qed' or 'docking' or 'qsar'
+    parser.add_argument('--backend', type=str, default='slurm')  # 'slurm' : sbatch, 'local' : run on this machine
+    parser.add_argument('--slots', type=int, default=0)  # local backend : number of parallel processes. 0 : cpu count
 
     # SAMPLER
     parser.add_argument('--max_samples', type=int, default=3000)  # Nbr of samples at each iter
+    parser.add_argument('--diversity_picker', type=int, default=-1)  # Select a number of diverse samples in max_samples.
     parser.add_argument('--cap_weights', type=float, default=-1)  # clamping value to use
+    parser.add_argument('--temperature', type=float, default=0.)  # char sampling temperature. 0 : greedy decoding
+    parser.add_argument('--top_k', type=int, default=0)  # sample among the top_k most likely chars. 0 : no truncation
+    parser.add_argument('--top_p', type=float, default=1.)  # nucleus sampling threshold. 1 : no truncation
+    parser.add_argument('--scripted', action='store_true')  # greedy decoding with the TorchScript sampler
 
     # DOCKER
     parser.add_argument('--server', type=str, default='pasteur', help='server to run on')
     parser.add_argument('--target', type=str, default='drd3', help='target to dock')
     parser.add_argument('--ex', type=int, default=16)  # Nbr of samples at each iter
+    parser.add_argument('--screen_ex', type=int, default=0)  # multi-fidelity : exhaustiveness of the screen. 0 : off
+    parser.add_argument('--fidelity_margin', type=float, default=2.)  # refine screened ligands up to margin under gamma
 
     # TRAINER
     parser.add_argument('--quantile', type=float, default=0.6)  # quantile of scores accepted
@@ -56,112 +179,10 @@ if __name__ == '__main__':
 
     assert args.oracle in ['qed', 'docking', 'qsar']
 
-
-    def setup():
-        pass
-        soft_mkdir(os.path.join(script_dir, 'results'))
-        soft_mkdir(os.path.join(script_dir, 'results', args.name))
-        soft_mkdir(os.path.join(script_dir, 'results', args.name, 'docking_results'))
-        soft_mkdir(os.path.join(script_dir, 'results', args.name, 'docking_small_results'))
-
-
-    setup()
-    savepath = os.path.join(script_dir, 'results', args.name)
-    soft_mkdir(savepath)
-    
-    def dump_sh():
-        """ Writes slurm sh scripts for CEDAR that will be called to launch slurm processes """
-        # Sampler 
-        with open(os.path.join(script_dir, 'slurm_sampler.sh'), 'w') as f :
-            f.write('#!/bin/sh\n')
-            f.write('#SBATCH --account=def-jeromew\n')
-            f.write('#SBATCH --time=01:00:00\n')
-            f.write('#SBATCH --job-name=sampler\n') 
-            f.write('#SBATCH --output=out_slurm/sampler_%A.out\n')
-            f.write('#SBATCH --error=out_slurm/sampler_%A.err\n')
-            f.write('#SBATCH --gres=gpu:1\n') # gpu request
-            f.write('#SBATCH --mem=4000M\n')  # memory (per node))
-            f.write('python sampler.py --prior_name $1 --name $2 --max_samples $3 --oracle $4 --cap_weights $5\n')
-            
-        # Docker 
-        with open(os.path.join(script_dir, 'slurm_docker.sh'), 'w') as f :
-            f.write('#!/bin/sh\n')
-            f.write('#SBATCH --account=def-jeromew\n')
-            f.write('#SBATCH --time=02:00:00\n')
-            f.write('#SBATCH --job-name=docker\n') 
-            f.write('#SBATCH --output=out_slurm/docker_%A.out\n')
-            f.write('#SBATCH --error=out_slurm/docker_%A.err\n')
-            f.write('#SBATCH --cpus-per-task=1\n')
-            f.write('#SBATCH --array=0-199\n')
-            f.write('python docker.py $SLURM_ARRAY_TASK_ID 200 --server $1 --exhaustiveness $2 --name $3 --oracle $4'
-                    '--target $5')
-        
-        # Trainer
-        with open(os.path.join(script_dir, 'slurm_trainer.sh'), 'w') as f :
-            f.write('#!/bin/sh\n')
-            f.write('#SBATCH --account=def-jeromew\n')
-            f.write('#SBATCH --time=00:40:00\n')
-            f.write('#SBATCH --job-name=trainer\n') 
-            f.write('#SBATCH --output=out_slurm/trainer_%A.out\n')
-            f.write('#SBATCH --error=out_slurm/trainer_%A.err\n')
-            f.write('#SBATCH --gres=gpu:1\n') # gpu request  
-            f.write('#SBATCH --mem=4000M\n')  # memory (per node))
-            f.write('python trainer.py --prior_name $1 --name $2 --iteration $3 --quantile $4 --uncertainty $5 --oracle $6')
-        
-    if args.server == 'cedar':
-        dump_sh()
-
-
-    # Save experiment parameters
-    dumper = Dumper(dumping_path=os.path.join(savepath, 'experiment.json'), dic=args.__dict__)
-    dumper.dump()
-
-    params_gentrain = {'savepath': savepath,
-                       'epochs': args.epochs,
-                       'device': device,
-                       'lr': args.learning_rate,
-                       'clip_grad': args.clip_grad_norm,
-                       'beta': args.beta,
-                       'processes': args.procs,
-                       'optimizer': args.opti,
-                       'scheduler': args.sched,
-                       'alphabet_name': args.alphabet_name,
-                       'gamma': -1000,
-                       'DEBUG': True}
-    dumper = Dumper(dumping_path=os.path.join(savepath, 'params_gentrain.json'), dic=params_gentrain)
-    dumper.dump()
-
-    prior_model_init = model_from_json(args.prior_name)
-    print(prior_model_init)
-    torch.save(prior_model_init.state_dict(), os.path.join(savepath, "weights.pth"))
-    id_train = None
-
-    for iteration in range(1, args.iters + 1):
-        # SAMPLING
-        slurm_sampler_path = os.path.join(script_dir, 'slurm_sampler.sh')
-        if id_train is None:
-            cmd = f'sbatch {slurm_sampler_path}'
-        else:
-            cmd = f'sbatch --depend=afterany:{id_train} {slurm_sampler_path}'
-        extra_args = f' {args.prior_name} {args.name} {args.max_samples} {args.oracle} {args.cap_weights}'
-        cmd = cmd + extra_args
-        a = subprocess.run(cmd.split(), stdout=subprocess.PIPE).stdout.decode('utf-8')
-        id_sample = a.split()[3]
-
-        # DOCKING
-        slurm_docker_path = os.path.join(script_dir, 'slurm_docker.sh')
-        cmd = f'sbatch --depend=afterany:{id_sample} {slurm_docker_path}'
-        extra_args = f' {args.server} {args.ex} {args.name} {args.oracle} {args.target}'
-        cmd = cmd + extra_args
-        a = subprocess.run(cmd.split(), stdout=subprocess.PIPE).stdout.decode('utf-8')
-        id_dock = a.split()[3]
-
-        # AGGREGATION AND TRAINING
-        slurm_trainer_path = os.path.join(script_dir, 'slurm_trainer.sh')
-        cmd = f'sbatch --depend=afterany:{id_dock} {slurm_trainer_path}'
-        extra_args = f' {args.prior_name} {args.name} {iteration} {args.quantile} {args.uncertainty} {args.oracle}'
-        cmd = cmd + extra_args
-        a = subprocess.run(cmd.split(), stdout=subprocess.PIPE).stdout.decode('utf-8')
-        id_train = a.split()[3]
-
-        print(f'launched iteration {iteration}')
+    if args.backend == 'local':
+        run_local(args, args.alphabet_name, n_slots=args.slots or None, device=device)
+    else:
+        if args.server == 'cedar':
+            dump_sh()
+        setup(args, args.alphabet_name, device)
+        launch(args, get_backend(args.backend))
@@ -11,6 +11,6 @@ module load cudnn/v7.6.5.32/cuda-10.1
 source ~/anaconda3/etc/profile.d/conda.sh
 conda activate optimol
 
-python sampler.py --prior_name $1 --name $2 --max_samples $3 --oracle $4 --cap_weights $5
+python sampler.py "$@"
 
 
@@ -32,9 +32,21 @@ def gather_scores(iteration, name):
     merged = pd.concat(dfs)
     # remove zero scored molecules : 
     merged = merged[merged['score']!=0]
+    # multi-fidelity docking : keep the score at the highest exhaustiveness of each molecule
+    if 'exhaustiveness' in merged.columns:
+        merged = merged.sort_values('exhaustiveness', kind='stable').drop_duplicates('smile', keep='last')
     dump_path = os.path.join(script_dir, 'results', name, 'docking_results', f'{iteration}.csv')
     merged.to_csv(dump_path)
 
+    # docking time saved by the multi-fidelity screen (cbas/docker.py), one row per docking process
+    fidelity_path = os.path.join(script_dir, 'results', name, 'multi_fidelity.csv')
+    if os.path.exists(fidelity_path):
+        log = pd.read_csv(fidelity_path)
+        print(f'Multi-fidelity docking : {log["refined"].sum()}/{log["screened"].sum()} ligands refined, '
+              f'{log["spent_hours"].sum():.2f} docking cpu-hours spent, ~{log["saved_hours"].sum():.2f} saved')
+        soft_mkdir(os.path.join(script_dir, 'results', name, 'multi_fidelity'))
+        shutil.move(fidelity_path, os.path.join(script_dir, 'results', name, 'multi_fidelity', f'{iteration}.csv'))
+
     def empty_folder(folder_path):
         for file_object in os.listdir(folder_path):
             file_object_path = os.path.join(folder_path, file_object)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the selfies decoder : table-driven derivation vs the string rewriting derivation
+(selfies.decoder(table_driven=False)). Checks that both give identical smiles on every molecule and reports
+molecules decoded per second, for the derivation alone and for the whole decoder (derivation + ring insertion).
+Run from repo root.
+
+usage :
+python data_processing/bench_selfies_decoder.py -i data/moses_test.csv
+
+If the csv has no 'selfies' column, selfies are computed from the 'smiles' column first.
+"""
+import os
+import sys
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+if __name__ == "__main__":
+    sys.path.append(os.path.join(script_dir, '..'))
+
+import argparse
+import time
+
+import pandas as pd
+
+from selfies import encoder, decoder, _selfies_to_smiles
+
+
+def decode_all(selfies_list, table_driven):
+    """ Decodes selfies_list, returns the list of smiles and the wall time """
+    start = time.perf_counter()
+    smiles = [decoder(s, PrintErrorMessage=False, table_driven=table_driven) for s in selfies_list]
+    return smiles, time.perf_counter() - start
+
+
+def derive_all(selfies_list, table_driven):
+    """ Runs the grammar derivation only (no ring insertion) on selfies_list, returns the wall time """
+    start = time.perf_counter()
+    for s in selfies_list:
+        try:
+            _selfies_to_smiles(s, table_driven=table_driven)
+        except ValueError:
+            pass
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', help="csv with a 'selfies' or 'smiles' column",
+                        default=os.path.join(script_dir, '../data/moses_test.csv'))
+    parser.add_argument('-N', '--n_mols', type=int, default=-1, help="number of molecules, -1 for all")
+    args, _ = parser.parse_known_args()
+
+    df = pd.read_csv(args.input, nrows=None if args.n_mols < 0 else args.n_mols)
+    if 'selfies' in df.columns:
+        selfies_list = list(df['selfies'])
+    else:
+        print('>>> No selfies column, encoding smiles')
+        selfies_list = [encoder(s, PrintErrorMessage=False) for s in df['smiles']]
+    selfies_list = [s for s in selfies_list if s != -1]
+
+    reference, t_reference = decode_all(selfies_list, table_driven=False)
+    table, t_table = decode_all(selfies_list, table_driven=True)
+
+    n = len(selfies_list)
+    n_identical = sum(a == b for a, b in zip(reference, table))
+    print(f'>>> {n} molecules, {n_identical} identical smiles ({100 * n_identical / n:.2f}%)')
+    print(f"{'':<18}{'derivation (mol/s)':>20}{'decoder (mol/s)':>20}")
+    d_reference, d_table = derive_all(selfies_list, False), derive_all(selfies_list, True)
+    print(f"{'string rewriting':<18}{n / d_reference:>20.1f}{n / t_reference:>20.1f}")
+    print(f"{'table driven':<18}{n / d_table:>20.1f}{n / t_table:>20.1f}")
+    print(f"{'speedup':<18}{d_reference / d_table:>19.2f}x{t_reference / t_table:>19.2f}x")
@@ -9,21 +9,18 @@ Compute selfies for all smiles in csv
 import pandas as pd
 import argparse
 from tqdm import tqdm
-from multiprocessing import Pool
 from rdkit import Chem
 from rdkit.Chem import AllChem
 import os
 import sys
-from ordered_set import OrderedSet
-
-import json
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
 if __name__ == '__main__':
     sys.path.append(os.path.join(script_dir, '..'))
 
 from data_processing.neutralize import NeutraliseCharges
-from selfies import encoder, decoder
+from data_processing.selfies_tokenizer import AlphabetScanner, selfies_length
+from selfies import encoder, encode_batch
 
 
 def clean_smiles(s):
@@ -39,10 +36,20 @@ def process_one(s):
     clean_smile = clean_smiles(s)
 
     individual_selfie = encoder(clean_smile)
-    s_len = len(individual_selfie) - len(individual_selfie.replace('[', ''))
+    s_len = selfies_length(individual_selfie)
     return clean_smile, individual_selfie, len(clean_smile), s_len
 
 
+def process_batch(smiles):
+    """ Same as process_one for a list of smiles, selfies are encoded over the persistent pool of encode_batch """
+    smiles_list = [clean_smiles(s) for s in smiles]
+    selfies_list, errors = encode_batch(smiles_list, return_errors=True)
+    for s, err in zip(smiles_list, errors):
+        if err is not None:
+            print(f'Could not encode {s} : {err}')
+    return smiles_list, selfies_list, [len(s) for s in smiles_list], [selfies_length(s) if s != -1 else 0 for s in selfies_list]
+
+
 def add_selfies(path='data/moses_train.csv', alphabet='my_alphabet.json', serial=False, smi=False):
     if not smi:
         train = pd.read_csv(path, index_col=0)
@@ -67,9 +74,7 @@ def add_selfies(path='data/moses_train.csv', alphabet='my_alphabet.json', serial
             max_selfies_len.append(selfie_len)
 
     else:
-        pool = Pool()
-        res_lists = pool.map(process_one, smiles)
-        smiles_list, selfies_list, max_smiles_len, max_selfies_len = map(list, zip(*res_lists))
+        smiles_list, selfies_list, max_smiles_len, max_selfies_len = process_batch(smiles)
 
     # print(time.perf_counter()-time1)
 
@@ -85,30 +90,15 @@ def add_selfies(path='data/moses_train.csv', alphabet='my_alphabet.json', serial
 
     # Alphabets and longest smiles / selfies collection 
 
-    smiles_alphabet = list(OrderedSet(''.join(smiles_list)))
-    largest_smiles_len = len(max(smiles_list, key=len))
-    selfies_len = []
-
     print(f'--> Building alphabets for {len(smiles_list)} smiles and selfies in dataset...')
-    for individual_selfie in selfies_list:
-        selfies_len.append(len(individual_selfie) - len(individual_selfie.replace('[', '')))  # len of SELFIES
-    selfies_alphabet_pre = list(OrderedSet(''.join(selfies_list)[1:-1].split('][')))
-    selfies_alphabet = []
-    for selfies_element in selfies_alphabet_pre:
-        selfies_alphabet.append('[' + selfies_element + ']')
-    largest_selfies_len = max(selfies_len)
+    scanner = AlphabetScanner()
+    scanner.update(smiles_list, selfies_list)
 
     print('Finished parsing smiles and selfies alphabet. Saving to json file custom_alphabets.json')
-    print('Longest selfies : ', largest_selfies_len)
-    print('Longest smiles : ', largest_smiles_len)
-
-    d = {'selfies_alphabet': selfies_alphabet,
-         'largest_selfies_len': largest_selfies_len,
-         'smiles_alphabet': smiles_alphabet,
-         'largest_smiles_len': largest_smiles_len}
+    print('Longest selfies : ', scanner.largest_selfies_len)
+    print('Longest smiles : ', scanner.largest_smiles_len)
 
-    with open(os.path.join(script_dir, '..', 'map_files', alphabet), 'w') as outfile:
-        json.dump(d, outfile)
+    scanner.save(os.path.join(script_dir, '..', 'map_files', alphabet))
     print('Saved alphabet to ', alphabet)
 
     print('Saved selfies as a column in csv. Ready to train with selfies.')
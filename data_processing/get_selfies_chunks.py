@@ -10,26 +10,20 @@ Same as get selfies but with chunks. Annotates a bunch of csv in a dir with thei
 """
 import pandas as pd
 import argparse
-from multiprocessing import Pool
 import os
 import sys
-from ordered_set import OrderedSet
 from tqdm import tqdm
-import json
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
 if __name__ == '__main__':
     sys.path.append(os.path.join(script_dir, '..'))
 
-from data_processing.get_selfies import process_one
+from data_processing.get_selfies import process_one, process_batch
+from data_processing.selfies_tokenizer import AlphabetScanner
 
 
 def add_selfies(dir_path='data/fabritiis/input_data/', alphabet='fabritiis.json', serial=False, save_path=None):
-    largest_smiles_len = 0
-    largest_selfies_len = 0
-
-    smiles_alphabet = OrderedSet()
-    selfies_alphabet = OrderedSet()
+    scanner = AlphabetScanner()
 
     if save_path is None:
         save_path = dir_path
@@ -53,9 +47,7 @@ def add_selfies(dir_path='data/fabritiis/input_data/', alphabet='fabritiis.json'
                 selfies_lengths.append(selfie_len)
 
         else:
-            pool = Pool()
-            res_lists = pool.map(process_one, smiles)
-            smiles_list, selfies_list, smiles_lengths, selfies_lengths = map(list, zip(*res_lists))
+            smiles_list, selfies_list, smiles_lengths, selfies_lengths = process_batch(smiles)
 
         # print(time.perf_counter()-time1)
 
@@ -63,84 +55,18 @@ def add_selfies(dir_path='data/fabritiis/input_data/', alphabet='fabritiis.json'
         savepath = os.path.join(save_path, file)
         df.to_csv(savepath)
 
-        largest_smiles_len = max(max(smiles_lengths), largest_smiles_len)
-        largest_selfies_len = max(max(selfies_lengths), largest_selfies_len)
-
-        # Alphabets and longest smiles / selfies collection, this is approx 1 minute per chunk
-
-        # This is character based parsing
-        local_smiles_alphabet = OrderedSet(''.join(smiles_list))
-
-        # This is selfies parsing
-        selfies_alphabet_pre = OrderedSet(''.join(selfies_list)[1:-1].split(']['))
-        local_selfies_alphabet = []
-        for selfies_element in selfies_alphabet_pre:
-            local_selfies_alphabet.append('[' + selfies_element + ']')
-
-        # Merge local alphabets
-        smiles_alphabet |= local_smiles_alphabet
-        selfies_alphabet |= local_selfies_alphabet
+        # Alphabets and longest smiles / selfies collection
+        scanner.update(smiles_list, selfies_list)
 
-    smiles_alphabet = list(smiles_alphabet)
-    selfies_alphabet = list(selfies_alphabet)
-
-    d = {'selfies_alphabet': selfies_alphabet,
-         'largest_selfies_len': largest_selfies_len,
-         'smiles_alphabet': smiles_alphabet,
-         'largest_smiles_len': largest_smiles_len}
-
-    with open(os.path.join(script_dir, '..', 'map_files', alphabet), 'w') as outfile:
-        json.dump(d, outfile)
+    scanner.save(os.path.join(script_dir, '..', 'map_files', alphabet))
 
 
 def get_alphabet(dir_path='data/fabritiis/input_data/', alphabet='fabritiis.json'):
-    largest_smiles_len = 0
-    largest_selfies_len = 0
-
-    smiles_alphabet = OrderedSet()
-    selfies_alphabet = OrderedSet()
-
+    """ Alphabets of csv files that already have a selfies column, read by chunks """
+    scanner = AlphabetScanner()
     for file in tqdm(os.listdir(dir_path)):
-        load_path = os.path.join(dir_path, file)
-        df = pd.read_csv(load_path)
-        smiles_list = df['smiles']
-        selfies_list = df['selfies']
-
-        max_chunk_smiles_len = len(max(smiles_list, key=len))
-        max_chunk_selfies_len = 0
-        for individual_selfie in selfies_list:
-            individual_selfie_len = len(individual_selfie) - len(individual_selfie.replace('[', ''))
-            if individual_selfie_len > max_chunk_selfies_len:
-                max_chunk_selfies_len = individual_selfie_len
-
-        largest_smiles_len = max(max_chunk_smiles_len, largest_smiles_len)
-        largest_selfies_len = max(max_chunk_selfies_len, largest_selfies_len)
-
-        # Alphabets and longest smiles / selfies collection, this is approx 1 minute per chunk
-
-        # This is character based parsing
-        local_smiles_alphabet = OrderedSet(''.join(smiles_list))
-
-        # This is selfies parsing
-        selfies_alphabet_pre = OrderedSet(''.join(selfies_list)[1:-1].split(']['))
-        local_selfies_alphabet = []
-        for selfies_element in selfies_alphabet_pre:
-            local_selfies_alphabet.append('[' + selfies_element + ']')
-
-        # Merge local alphabets
-        smiles_alphabet |= local_smiles_alphabet
-        selfies_alphabet |= local_selfies_alphabet
-
-    smiles_alphabet = list(smiles_alphabet)
-    selfies_alphabet = list(selfies_alphabet)
-
-    d = {'selfies_alphabet': selfies_alphabet,
-         'largest_selfies_len': largest_selfies_len,
-         'smiles_alphabet': smiles_alphabet,
-         'largest_smiles_len': largest_smiles_len}
-
-    with open(os.path.join(script_dir, '..', 'map_files', alphabet), 'w') as outfile:
-        json.dump(d, outfile)
+        scanner.scan_csv(os.path.join(dir_path, file))
+    scanner.save(os.path.join(script_dir, '..', 'map_files', alphabet))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Precomputes featurized graphs, padded smiles / selfies index arrays, props and targets for all molecules of a csv
+and writes them to binary shards (see dataloaders/graph_shards.py), to train without per item parsing :
+
+python data_processing/prepare_shards.py -i data/moses_train.csv -o data/moses_train_shards
+python train.py --shards data/moses_train_shards
+
+Molecules that the dataset would ignore (invalid smiles, one-hot errors, selfies too long) are skipped.
+"""
+import os
+import sys
+import argparse
+from multiprocessing import Pool
+
+import numpy as np
+from tqdm import tqdm
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+if __name__ == '__main__':
+    sys.path.append(os.path.join(script_dir, '..'))
+
+from dataloaders.molDataset import molDataset
+from dataloaders.graph_shards import write_shard
+
+dataset = None  # molDataset shared with the pool workers
+
+
+def featurize_one(idx):
+    item = dataset.featurize(idx)
+    if item is None:
+        return None
+    src, dst, edge_types, h, a, props, targets = item
+    if len(dataset.props) == 0:
+        props = np.zeros(0, dtype=np.float32)
+    if len(dataset.targets) == 0:
+        targets = np.zeros(0, dtype=np.float32)
+    return src, dst, edge_types, h, a, props, targets
+
+
+def prepare(csv_path, out_dir, vocab, alphabet_name, props, targets, n_mols=-1, shard_size=100000, procs=None,
+            redo_selfies=False):
+    global dataset
+    dataset = molDataset(csv_path=csv_path,
+                         maps_path=os.path.join(script_dir, '..', 'map_files'),
+                         vocab=vocab,
+                         build_alphabet=False,
+                         alphabet_name=alphabet_name,
+                         props=props,
+                         targets=targets,
+                         n_mols=n_mols,
+                         compute_selfies=redo_selfies)
+    meta = {'csv_path': csv_path, 'vocab': vocab, 'alphabet_name': alphabet_name, 'alphabet': dataset.alphabet,
+            'max_len': dataset.max_len, 'props': props, 'targets': targets}
+
+    n_chunks = (len(dataset) - 1) // shard_size + 1
+    kept, n_shards = 0, 0
+    with Pool(procs) as pool:  # workers are forked after the dataset is loaded
+        for i in range(n_chunks):
+            start, end = i * shard_size, min((i + 1) * shard_size, len(dataset))
+            items = [it for it in tqdm(pool.imap(featurize_one, range(start, end), chunksize=256), total=end - start)
+                     if it is not None]
+            # chunks where all molecules were skipped write no shard
+            if write_shard(items, os.path.join(out_dir, f'shard_{n_shards:04d}'), meta):
+                n_shards += 1
+            kept += len(items)
+            print(f'>>> Chunk {i + 1}/{n_chunks} : {len(items)}/{end - start} molecules')
+    print(f'>>> Wrote {kept}/{len(dataset)} molecules to {n_shards} shards in {out_dir}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--csv', help="path to csv with dataset (smiles, selfies, props columns)", type=str,
+                        default='data/moses_train.csv')
+    parser.add_argument('-o', '--out_dir', help="output directory for the shards", type=str,
+                        default='data/moses_train_shards')
+    parser.add_argument('--decode', type=str, default='selfies')  # language used : 'smiles' or 'selfies'
+    parser.add_argument('--alphabet_name', type=str, default='moses_alphabets.json')  # in map_files dir
+    parser.add_argument('--props', nargs='*', default=['QED', 'logP', 'molWt'])  # props columns to store
+    parser.add_argument('--targets', nargs='*', default=[])  # affinity columns to store
+    parser.add_argument('--cutoff', type=int, default=-1)  # Max number of molecules. -1 for all in csv
+    parser.add_argument('--shard_size', type=int, default=100000)  # molecules per shard
+    parser.add_argument('--procs', type=int, default=None)  # Number of processes. Default : all cpus
+    parser.add_argument('--redo_selfies', action='store_true')  # recompute selfies from smiles
+    # ======================
+    args, _ = parser.parse_known_args()
+
+    prepare(csv_path=args.csv,
+            out_dir=args.out_dir,
+            vocab=args.decode,
+            alphabet_name=args.alphabet_name,
+            props=args.props,
+            targets=args.targets,
+            n_mols=args.cutoff,
+            shard_size=args.shard_size,
+            procs=args.procs,
+            redo_selfies=args.redo_selfies)
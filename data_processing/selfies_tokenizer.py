@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+SELFIES tokenization, bulk integer encoding and streaming alphabet scan.
+
+A whole column of selfies is encoded at once, with array operations on the bytes of the concatenated strings, then
+scattered into the padded matrix. No python loop over molecules or tokens :
+- tokens are delimited by the positions of the brackets : each token starts at a '[' and ends at its first ']' or at
+  the end of its row. Rows that are not exactly a sequence of such tokens are rejected.
+- token hashes are polynomial hashes of their bytes, sum(byte_k * base ** k) in wrapping uint64 arithmetic, with a
+  random odd base. All tokens are hashed from one prefix sum over the bytes, rescaled by the inverse powers of the base.
+- hashes are mapped to alphabet indices by a lookup table indexed by hash modulo the smallest table size where the
+  alphabet has no collisions. A token whose slot is empty, or holds a symbol with a different full 64-bit hash, is not
+  in the alphabet and its row is rejected (length -1).
+
+AlphabetScanner builds the alphabets json (map_files/) chunk by chunk, so files of any size are scanned in constant
+memory :
+
+python data_processing/selfies_tokenizer.py -i data/moses_train.csv --alphabet my_alphabets.json
+
+"""
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+import pandas as pd
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+if __name__ == '__main__':
+    sys.path.append(os.path.join(script_dir, '..'))
+
+OPEN, CLOSE = ord('['), ord(']')
+
+
+def tokenize(selfies):
+    """ List of the bracketed tokens of a selfies string """
+    if len(selfies) == 0:
+        return []
+    return ['[' + t + ']' for t in selfies[1:-1].split('][')]
+
+
+def selfies_length(selfies):
+    """ Number of tokens of a selfies string """
+    return selfies.count('[')
+
+
+class SelfiesTokenizer:
+    """
+    Selfies <-> alphabet indices, with sequences padded to max_len with pad_char.
+    """
+
+    def __init__(self, alphabet, max_len, pad_char='[epsilon]', seed=0):
+        self.alphabet = list(alphabet)
+        self.max_len = max_len
+        self.char_to_index = dict((c, i) for i, c in enumerate(self.alphabet))
+        if pad_char not in self.char_to_index:
+            raise ValueError(f'Padding char {pad_char} not in selfies alphabet')
+        self.pad_index = self.char_to_index[pad_char]
+
+        # Token hash : polynomial hash of the bytes, in wrapping uint64 arithmetic (odd base, invertible mod 2**64)
+        self.base = np.uint64(2 * np.random.RandomState(seed).randint(1, 2 ** 62, dtype=np.int64) + 1)
+        base = int(self.base)
+        inv = base
+        for _ in range(6):  # Newton iterations for the inverse mod 2**64
+            inv = inv * (2 - base * inv) % 2 ** 64
+        self.inv_base = np.uint64(inv)
+        self.powers, self.inv_powers = np.ones(1, dtype=np.uint64), np.ones(1, dtype=np.uint64)
+
+        self.max_token_len = max(len(c.encode()) for c in self.alphabet)
+        hashes = np.array([self._hash(np.frombuffer(c.encode(), dtype=np.uint8), np.zeros(1, dtype=np.int64),
+                                      np.full(1, len(c.encode()), dtype=np.int64))[0] for c in self.alphabet],
+                          dtype=np.uint64)
+        if len(np.unique(hashes)) < len(hashes):
+            raise ValueError('Duplicate tokens in selfies alphabet')
+        self.hashes = hashes
+        # Lookup table of the alphabet indices by hash modulo the smallest size without collisions
+        self.table_size = len(hashes)
+        while len(np.unique(hashes % np.uint64(self.table_size))) < len(hashes):
+            self.table_size += 1
+        self.table = np.full(self.table_size, -1, dtype=np.int64)
+        self.table[hashes % np.uint64(self.table_size)] = np.arange(len(hashes))
+
+    def _hash(self, data, starts, stops):
+        """
+        Hashes of the tokens data[starts[i]:stops[i]] of byte array data. Token hash is sum(byte_k * base ** k),
+        computed for all tokens from one cumulative sum of byte_p * base ** p, rescaled by base ** -start.
+        """
+        if len(starts) == 0:
+            return np.zeros(0, dtype=np.uint64)
+        if len(self.powers) < len(data):  # cached powers of the base and of its inverse
+            n = max(len(data), 2 * len(self.powers))
+            self.powers = np.cumprod(np.full(n, self.base, dtype=np.uint64)) * self.inv_base
+            self.inv_powers = np.cumprod(np.full(n, self.inv_base, dtype=np.uint64)) * self.base
+        sums = np.concatenate((np.zeros(1, dtype=np.uint64), np.cumsum(data * self.powers[:len(data)])))
+        return (sums[stops] - sums[starts]) * self.inv_powers[starts]
+
+    def unknown_tokens(self, selfies):
+        """ Tokens of a selfies string that are not in the alphabet """
+        return [t for t in tokenize(selfies) if t not in self.char_to_index]
+
+    def encode_one(self, selfies):
+        """ Padded index array of one selfies string, None if it is longer than max_len or has unknown tokens """
+        indices, lengths = self.encode([selfies])
+        if lengths[0] < 0:
+            return None
+        return indices[0]
+
+    def encode(self, selfies, dtype=np.int32, chunk_size=5000):
+        """
+        Encodes a sequence of selfies strings (list, array or pandas Series).
+        Returns the (n * max_len) matrix of indices, padded with pad_index, and the (n) array of selfies lengths.
+        Length is -1 (and the row only padding) for selfies longer than max_len, with tokens not in the alphabet or
+        with chars outside of brackets.
+        """
+        selfies = list(selfies)
+        n = len(selfies)
+        indices = np.full((n, self.max_len), self.pad_index, dtype=dtype)
+        lengths = np.zeros(n, dtype=np.int64)
+        for start in range(0, n, chunk_size):
+            end = min(start + chunk_size, n)
+            lengths[start:end] = self._encode_chunk(selfies[start:end], indices[start:end])
+        return indices, lengths
+
+    def _encode_chunk(self, selfies, out):
+        n = len(selfies)
+        data = np.frombuffer(''.join(selfies).encode(), dtype=np.uint8)
+        row_bytes = np.fromiter(map(len, selfies), dtype=np.int64, count=n)
+        if len(data) != row_bytes.sum():  # non ascii chars : can't be in the alphabet
+            row_bytes = np.array([len(s.encode()) for s in selfies], dtype=np.int64)
+
+        starts = np.flatnonzero(data == OPEN)
+        ends = np.flatnonzero(data == CLOSE)
+        lengths = np.diff(np.searchsorted(starts, np.cumsum(row_bytes)), prepend=0)  # number of '[' in each row
+        rows = np.repeat(np.arange(n), lengths)
+
+        # Tokens end at their first ']', or at the end of their row
+        row_ends = np.cumsum(row_bytes)
+        stops = np.append(ends, len(data) - 1)[np.searchsorted(ends, starts)] + 1
+        stops = np.minimum(stops, row_ends[rows])
+        token_len = stops - starts
+
+        # Rows must be exactly a sequence of [...] tokens
+        well_formed = (data[stops - 1] == CLOSE) & (stops <= np.append(starts[1:], len(data)))
+        token_bytes = np.where(well_formed, token_len, 0)
+        valid = np.bincount(rows, weights=token_bytes, minlength=n) == row_bytes
+        valid &= lengths <= self.max_len
+
+        hashes = self._hash(data, starts, stops)
+        codes = self.table[hashes % np.uint64(self.table_size)]
+        known = (self.hashes[codes] == hashes) & (codes >= 0) & (token_len <= self.max_token_len)
+        valid[rows[~known]] = False
+
+        positions = np.arange(len(starts)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        keep = valid[rows]
+        out[rows[keep], positions[keep]] = codes[keep]
+        return np.where(valid, lengths, -1)
+
+    def decode(self, indices):
+        """ Index rows -> selfies strings, without padding chars """
+        return [''.join(self.alphabet[i] for i in row if i != self.pad_index) for row in np.asarray(indices)]
+
+
+class AlphabetScanner:
+    """
+    Smiles (characters) and selfies (tokens) alphabets and longest sequences of a dataset, updated chunk by chunk.
+    Alphabets are in order of first occurrence, like the alphabets of map_files/.
+    """
+
+    def __init__(self):
+        self.smiles_alphabet = {}  # ordered dicts used as ordered sets
+        self.selfies_alphabet = {}
+        self.largest_smiles_len = 0
+        self.largest_selfies_len = 0
+        self.n = 0
+
+    def update(self, smiles=None, selfies=None):
+        """ Adds a chunk of smiles and / or selfies strings """
+        if smiles is not None and len(smiles) > 0:
+            smiles = list(smiles)
+            self.smiles_alphabet.update(dict.fromkeys(''.join(smiles)))
+            self.largest_smiles_len = max(self.largest_smiles_len, max(map(len, smiles)))
+            self.n += len(smiles)
+        if selfies is not None and len(selfies) > 0:
+            selfies = list(selfies)
+            self.selfies_alphabet.update(dict.fromkeys(tokenize(''.join(selfies))))
+            self.largest_selfies_len = max(self.largest_selfies_len, max(s.count('[') for s in selfies))
+            if smiles is None:
+                self.n += len(selfies)
+
+    def scan_csv(self, path, chunksize=100000, smiles_col='smiles', selfies_col='selfies'):
+        """ Reads the smiles and selfies columns of a csv by chunks (the columns that are absent are skipped) """
+        columns = pd.read_csv(path, nrows=0).columns
+        usecols = [c for c in (smiles_col, selfies_col) if c in columns]
+        for chunk in pd.read_csv(path, usecols=usecols, chunksize=chunksize):
+            self.update(smiles=chunk[smiles_col] if smiles_col in usecols else None,
+                        selfies=chunk[selfies_col] if selfies_col in usecols else None)
+        return self
+
+    def to_dict(self):
+        """ Alphabets dict, as saved in map_files/ json files """
+        return {'selfies_alphabet': list(self.selfies_alphabet),
+                'largest_selfies_len': self.largest_selfies_len,
+                'smiles_alphabet': list(self.smiles_alphabet),
+                'largest_smiles_len': self.largest_smiles_len}
+
+    def save(self, path):
+        with open(path, 'w') as outfile:
+            json.dump(self.to_dict(), outfile)
+
+
+def get_alphabets(smiles, selfies):
+    """ Returns selfies alphabet, longest selfies, smiles alphabet and longest smiles of in-memory columns """
+    scanner = AlphabetScanner()
+    scanner.update(smiles, selfies)
+    d = scanner.to_dict()
+    return d['selfies_alphabet'], d['largest_selfies_len'], d['smiles_alphabet'], d['largest_smiles_len']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--csv', nargs='+', help="csv files or directories of csv files (smiles, selfies)",
+                        default=['data/moses_train.csv'])
+    parser.add_argument('--alphabet', help="Name for alphabet json file saved in map_files", type=str,
+                        default='my_alphabets.json')
+    parser.add_argument('--chunksize', type=int, default=100000)  # rows read at once
+    # ======================
+    args, _ = parser.parse_known_args()
+
+    scanner = AlphabetScanner()
+    for path in args.csv:
+        files = sorted(os.path.join(path, f) for f in os.listdir(path)) if os.path.isdir(path) else [path]
+        for f in files:
+            scanner.scan_csv(f, chunksize=args.chunksize)
+            print(f'>>> Scanned {f}')
+
+    save_path = os.path.join(script_dir, '..', 'map_files', args.alphabet)
+    scanner.save(save_path)
+    print(f'Scanned {scanner.n} molecules. Longest selfies : {scanner.largest_selfies_len}, '
+          f'longest smiles : {scanner.largest_smiles_len}')
+    print('Saved alphabet to ', save_path)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Binary shards of featurized molecules, written once by data_processing/prepare_shards.py and memory-mapped by
+molDataset at training time (no smiles parsing, selfies encoding or graph featurization per item).
+
+A shard is a directory with :
+    meta.json : number of molecules, vocab, alphabet, max_len, props and targets columns
+    node_feats.npy (total_nodes * emb_size) float32, node_offsets.npy (n + 1) int64
+    src.npy, dst.npy, edge_types.npy (total_edges) int64, edge_offsets.npy (n + 1) int64
+    sequences.npy (n * max_len) int64 : padded smiles / selfies char indices
+    props.npy (n * n_props) float32, targets.npy (n * n_targets) float32 or int64 (binned)
+
+"""
+
+import os
+import json
+import glob
+
+import numpy as np
+
+ARRAYS = ['node_feats', 'node_offsets', 'src', 'dst', 'edge_types', 'edge_offsets', 'sequences', 'props', 'targets']
+
+
+def write_shard(items, shard_dir, meta):
+    """
+    Writes a shard from a list of featurized molecules :
+    items = [(src, dst, edge_types, node_feats, sequence, props, targets), ...], as returned by molDataset.featurize
+    meta : dict of dataset parameters saved to meta.json (the number of molecules is added)
+    Returns False, without writing anything, for an empty list : empty shards are never listed by list_shards.
+    """
+    if len(items) == 0:
+        return False
+    os.makedirs(shard_dir, exist_ok=True)
+    src, dst, edge_types, node_feats, sequences, props, targets = map(list, zip(*items))
+
+    n_nodes = [h.shape[0] for h in node_feats]
+    n_edges = [e.shape[0] for e in edge_types]
+    arrays = {'node_feats': np.concatenate(node_feats).astype(np.float32),
+              'node_offsets': np.concatenate(([0], np.cumsum(n_nodes))).astype(np.int64),
+              'src': np.concatenate(src).astype(np.int64),
+              'dst': np.concatenate(dst).astype(np.int64),
+              'edge_types': np.concatenate(edge_types).astype(np.int64),
+              'edge_offsets': np.concatenate(([0], np.cumsum(n_edges))).astype(np.int64),
+              'sequences': np.stack(sequences).astype(np.int64),
+              'props': np.array(props, dtype=np.float32).reshape(len(items), -1),
+              'targets': np.array(targets).reshape(len(items), -1)}
+    for name, a in arrays.items():
+        np.save(os.path.join(shard_dir, f'{name}.npy'), a)
+
+    meta = dict(meta, n=len(items))
+    with open(os.path.join(shard_dir, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return True
+
+
+def list_shards(path):
+    """ Shard directories under path (or path itself if it is a shard), sorted """
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        return [path]
+    shards = sorted(os.path.dirname(p) for p in glob.glob(os.path.join(path, '*', 'meta.json')))
+    if len(shards) == 0:
+        raise ValueError(f'No graph shards found in {path}. Run data_processing/prepare_shards.py first')
+    return shards
+
+
+class GraphShards:
+    """
+    Read access to a list of shards. Arrays are memory-mapped the first time an item is read, so that dataloader
+    workers share the pages of the files instead of each holding a copy of the dataset.
+    """
+
+    def __init__(self, shard_dirs):
+        self.shard_dirs = list(shard_dirs)
+        self.metas = []
+        for d in self.shard_dirs:
+            with open(os.path.join(d, 'meta.json')) as f:
+                self.metas.append(json.load(f))
+        self.meta = self.metas[0]
+        self.offsets = np.cumsum([0] + [m['n'] for m in self.metas])
+        self._arrays = None
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _open(self):
+        self._arrays = [{name: np.load(os.path.join(d, f'{name}.npy'), mmap_mode='r') for name in ARRAYS}
+                        for d in self.shard_dirs]
+
+    def arrays(self):
+        """ Memory-mapped arrays of each shard """
+        if self._arrays is None:
+            self._open()
+        return self._arrays
+
+    def get(self, idx):
+        """ Returns src, dst, edge_types, node_feats, sequence, props, targets of molecule idx (copies) """
+        if self._arrays is None:
+            self._open()
+        s = int(np.searchsorted(self.offsets, idx, side='right')) - 1
+        a, i = self._arrays[s], idx - self.offsets[s]
+        n0, n1 = a['node_offsets'][i:i + 2]
+        e0, e1 = a['edge_offsets'][i:i + 2]
+        return (np.array(a['src'][e0:e1]), np.array(a['dst'][e0:e1]), np.array(a['edge_types'][e0:e1]),
+                np.array(a['node_feats'][n0:n1]), np.array(a['sequences'][i]), np.array(a['props'][i]),
+                np.array(a['targets'][i]))
@@ -22,13 +22,13 @@ import numpy as np
 
 import pickle
 import json
-import networkx as nx
 from selfies import encoder, decoder
-from ordered_set import OrderedSet
 from rdkit import Chem
 
-from torch.utils.data import Dataset, DataLoader, Subset
-from data_processing.rdkit_to_nx import smiles_to_nx
+from torch.utils.data import Dataset, DataLoader, Subset, Sampler
+from data_processing.rdkit_to_dgl import GraphFeaturizer, arrays_to_dgl
+from data_processing.selfies_tokenizer import SelfiesTokenizer, get_alphabets, selfies_length
+from dataloaders.graph_shards import GraphShards, list_shards
 
 
 def collate_block(samples):
@@ -49,6 +49,15 @@ def collate_block(samples):
     return batched_graph, smiles, p_labels, a_labels
 
 
+def padded_lengths(sequences, pad_index):
+    """
+    Position after the last non padding char of each row of a (n * max_len) array of indices, as utils.trim_padding
+    (padding chars read as ring lengths or branch sizes count). 0 for rows of padding only.
+    """
+    not_pad = sequences != pad_index
+    return np.where(not_pad.any(axis=1), sequences.shape[1] - np.argmax(not_pad[:, ::-1], axis=1), 0)
+
+
 def oh_tensor(category, n): 
     # One-hot float tensor construction
     t = torch.zeros(n, dtype=torch.float)
@@ -56,6 +65,37 @@ def oh_tensor(category, n):
     return t
 
 
+class BucketBatchSampler(Sampler):
+    """
+    Batches of molecules of similar sequence lengths, so that training batches can be decoded only up to their
+    longest sequence. Indices are shuffled, split in pools of pool_batches batches, sorted by length within each
+    pool and cut into batches. The order of the batches is shuffled at each epoch.
+    """
+
+    def __init__(self, lengths, batch_size, pool_batches=100, drop_last=True):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.pool_size = batch_size * pool_batches
+        self.drop_last = drop_last
+
+    def __iter__(self):
+        indices = np.random.permutation(len(self.lengths))
+        batches = []
+        for start in range(0, len(indices), self.pool_size):
+            pool = indices[start:start + self.pool_size]
+            pool = pool[np.argsort(self.lengths[pool], kind='stable')]
+            batches += [pool[i:i + self.batch_size] for i in range(0, len(pool), self.batch_size)]
+        if self.drop_last:
+            batches = [b for b in batches if len(b) == self.batch_size]
+        for i in np.random.permutation(len(batches)):
+            yield batches[i].tolist()
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.lengths) // self.batch_size
+        return (len(self.lengths) + self.batch_size - 1) // self.batch_size
+
+
 class molDataset(Dataset):
     """ 
     pytorch Dataset for training on small molecules graphs + smiles 
@@ -70,13 +110,19 @@ class molDataset(Dataset):
                  targets,
                  n_mols=-1,
                  graph_only=False, 
-                 compute_selfies = False):
+                 compute_selfies = False,
+                 shards_path=None):
         
         self.graph_only=graph_only
         self.compute_selfies = compute_selfies 
+        self.shards = None  # precomputed graph shards, see pass_shards
+        self.sequences = None  # selfies column encoded at once, see encode_sequences
         
-        # 0/ two options: empty loader or csv path given 
-        if csv_path is None:
+        # 0/ three options: empty loader, csv path or graph shards given 
+        if shards_path is not None:
+            self.df = None
+            self.n = 0
+        elif csv_path is None:
             print("Empty dataset initialized. Use pass_dataset or pass_dataset_path to add molecules.")
             self.df = None
             self.n = 0
@@ -113,6 +159,7 @@ class molDataset(Dataset):
         self.num_charges, self.num_chir = len(self.charges_map), len(self.chi_map)
         print('> Loaded edge and atoms types to one-hot mappings')
         self.emb_size = 16  # node embedding size = number of node features 
+        self.featurizer = GraphFeaturizer(self.edge_map, self.at_map, self.chi_map, self.charges_map)
 
         # 3/ =========== SMILES and SELFIES handling : ================== 
         
@@ -150,28 +197,61 @@ class molDataset(Dataset):
         self.char_to_index = dict((c, i) for i, c in enumerate(self.alphabet))
         self.index_to_char = dict((i, c) for i, c in enumerate(self.alphabet))
         self.n_chars = len(self.alphabet)
+        self.tokenizer = SelfiesTokenizer(self.alphabet, self.max_len) if self.language == 'selfies' else None
 
         print(f"> Loaded alphabet. Using {self.language}. Max sequence length allowed is {self.max_len}")
 
+        if shards_path is not None:
+            self.pass_shards(shards_path, graph_only=graph_only)
+        elif self.df is not None:
+            self.sequences = self.encode_sequences(self.df)
+
+    def pass_shards(self, path, graph_only=False):
+        """
+        Reads molecules from graph shards written by data_processing/prepare_shards.py instead of a dataframe.
+        path : a shard directory, a directory of shards or a list of shard directories
+        """
+        shard_dirs = path if isinstance(path, (list, tuple)) else list_shards(path)
+        shards = GraphShards(shard_dirs)
+        meta = shards.meta
+        if meta['vocab'] != self.language or meta['max_len'] != self.max_len or meta['alphabet'] != self.alphabet:
+            raise ValueError(f"Graph shards were prepared with {meta['vocab']} alphabet {meta['alphabet_name']}, "
+                             f"incompatible with this dataset's alphabet")
+        if not graph_only and (meta['props'] != list(self.props) or meta['targets'] != list(self.targets)):
+            raise ValueError(f"Graph shards contain props {meta['props']} and targets {meta['targets']}, "
+                             f"expected {list(self.props)} and {list(self.targets)}")
+        self.shards = shards
+        self.df = None
+        self.sequences = None
+        self.n = len(shards)
+        self.graph_only = graph_only
+        print(f'> Reading {self.n} molecules from {len(shard_dirs)} graph shards')
+
 
     def pass_dataset_path(self, path, graph_only = True):
         # Pass a new dataset to the loader, without changing other parameters 
+        self.shards = None
         self.df = pd.read_csv(path)
         self.n = self.df.shape[0]
         self.graph_only=graph_only
+        self.sequences = self.encode_sequences(self.df)
         #print('New dataset columns:', self.df.columns)
 
     def pass_dataset(self, df, graph_only = True):
+        self.shards = None
         self.df = df
         self.n = df.shape[0]
         self.graph_only=graph_only
+        self.sequences = self.encode_sequences(self.df)
         #print('New dataset columns:', self.df.columns)
 
     def pass_smiles_list(self, smiles):
         # pass smiles list to the model; a dataframe with unique column 'can' will be created 
+        self.shards = None
         self.df = pd.DataFrame.from_dict({'smiles': smiles})
         self.n = self.df.shape[0]
         self.graph_only=True
+        self.sequences = None
         #print('New dataset contains only smiles // no props or affinities')
 
     def __len__(self):
@@ -187,22 +267,9 @@ class molDataset(Dataset):
             - smiles alphabet (character based)
             - longest smiles string
         """
-        smiles_list = np.asanyarray(self.df.smiles)
-        
-        selfies_list = np.asanyarray(self.df.selfies)
-        
-        smiles_alphabet=list(OrderedSet(''.join(smiles_list)))
-        largest_smiles_len=len(max(smiles_list, key=len))
-        selfies_len=[]
-        
-        print(f'--> Building alphabets for {smiles_list.shape[0]} smiles and selfies in dataset...')
-        for individual_selfie in selfies_list:
-            selfies_len.append(len(individual_selfie)-len(individual_selfie.replace('[',''))) # len of SELFIES
-        selfies_alphabet_pre=list(OrderedSet(''.join(selfies_list)[1:-1].split('][')))
-        selfies_alphabet=[]
-        for selfies_element in selfies_alphabet_pre:
-            selfies_alphabet.append('['+selfies_element+']')        
-        largest_selfies_len=max(selfies_len)
+        print(f'--> Building alphabets for {self.df.shape[0]} smiles and selfies in dataset...')
+        selfies_alphabet, largest_selfies_len, smiles_alphabet, largest_smiles_len = get_alphabets(self.df.smiles,
+                                                                                                  self.df.selfies)
         
         print('Finished parsing smiles and selfies alphabet. Saving to json file custom_alphabets.json')
         print('Longest selfies : ',  largest_selfies_len)
@@ -223,44 +290,70 @@ class molDataset(Dataset):
         """
         Go from a single selfies string to a list of integers
         """
-        # integer encode input smile
-        len_of_molecule=len(molecule)-len(molecule.replace('[',''))
-        
-        if len_of_molecule >= self.max_len:
-            valid_flag = 0
-            return 0, valid_flag
-            
-        for _ in range(self.max_len - len_of_molecule): # selfies padding 
-            molecule+='[epsilon]'
-    
-        selfies_char_list_pre=molecule[1:-1].split('][')
-        selfies_char_list=[]
-        for selfies_element in selfies_char_list_pre:
-            selfies_char_list.append('['+selfies_element+']')   
-    
-        try:
-            integer_encoded = [self.char_to_index[char] for char in selfies_char_list]
-            a = np.array(integer_encoded)
-            valid_flag = 1 
-        except:
-            a = 0
-            for char in selfies_char_list :
-                if char not in self.char_to_index :
-                    print(char)
-            valid_flag = 0  # no one hot encoding possible : ignoring molecule 
-                
-        return a, valid_flag
-
-    def __getitem__(self, idx):
-        # Returns tuple 
+        a = self.tokenizer.encode_one(molecule)
+        if a is None or selfies_length(molecule) >= self.max_len:
+            for char in self.tokenizer.unknown_tokens(molecule):
+                print(char)
+            return 0, 0  # no one hot encoding possible : ignoring molecule
+        return a.astype(np.int64), 1
+
+    def encode_sequences(self, df):
+        """
+        Encodes the whole selfies column of df at once. Returns the (n * max_len) int32 array of indices, with rows of
+        -1 for the selfies that can't be encoded (too long or not in alphabet), or None if the sequences are not read
+        from the dataframe (graph only, smiles, or selfies recomputed from smiles).
+        """
+        if self.graph_only or self.language != 'selfies' or self.compute_selfies or 'selfies' not in df.columns:
+            return None
+        sequences, lengths = self.tokenizer.encode(df.selfies)
+        sequences[(lengths < 0) | (lengths >= self.max_len)] = -1
+        return sequences
+
+    def sequence_lengths(self):
+        """ Length (number of chars) of the smiles / selfies of each molecule, used for length bucketing """
+        if self.shards is not None:
+            seqs = [np.asarray(a['sequences']) for a in self.shards.arrays()]
+            seqs = np.concatenate(seqs)
+            return padded_lengths(seqs, self.char_to_index['[epsilon]'] if self.language == 'selfies' else 0)
+        if self.sequences is not None:
+            return padded_lengths(self.sequences, self.tokenizer.pad_index)
+        if self.language == 'selfies' and 'selfies' in self.df.columns and not self.compute_selfies:
+            return self.df.selfies.str.count(r'\[').values
+        return self.df.smiles.str.len().values  # approximation for selfies computed on the fly
+
+    def featurize(self, idx, graph_only=False):
+        """
+        Parses and featurizes row idx of the dataframe. Returns None if the molecule is ignored, else
+        (src, dst, edge_types, node_feats, sequence, props, targets), see GraphFeaturizer.mol_to_arrays for the graph
+        arrays. sequence, props and targets are 0 if graph_only.
+        """
         # Smiles has to be in first column of the csv !!
+        sequence = self.sequences[idx] if self.sequences is not None else None
+        return self.featurize_row(self.df.iloc[idx,:], graph_only=graph_only, sequence=sequence)
 
-        row = self.df.iloc[idx,:]
-        
+    def featurize_row(self, row, graph_only=False, sequence=None):
+        """
+        Same as featurize, for a dataframe row (pandas Series).
+        sequence : row of encode_sequences for this molecule, if the selfies column was encoded beforehand
+        """
         smiles = row.smiles # needed anyway to build graph 
         m=Chem.MolFromSmiles(smiles)
-        
-        if self.compute_selfies:
+        if m is None:
+            return None
+
+        # 1 - Graph building (before kekulization, which changes aromatic bond types)
+        try:
+            graph = self.featurizer.mol_to_arrays(m)
+        except KeyError as e:
+            print('!!!! One-hot error for input ', smiles, e, ' ignored')
+            return None
+
+        if graph_only: # give only the graph (to encode in latent space)
+            return graph + (0, 0, 0)
+
+        if sequence is not None:
+            selfie = None
+        elif self.compute_selfies:
             Chem.Kekulize(m)
             k = Chem.MolToSmiles(m, isomericSmiles=False, kekuleSmiles = True) # kekuleSmiles
             selfie = encoder(k)
@@ -272,67 +365,21 @@ class molDataset(Dataset):
             
         else:
             selfie = row.selfies
-        
-        # 1 - Graph building
-        if m!=None:
-            graph = smiles_to_nx(smiles)
-        else:
-            return None, 0,0,0
-
-        one_hot = {edge: torch.tensor(self.edge_map[label]) for edge, label in
-                   (nx.get_edge_attributes(graph, 'bond_type')).items()}
-        nx.set_edge_attributes(graph, name='one_hot', values=one_hot)
-
-        try:
-            at_type = {a: oh_tensor(self.at_map[label], self.num_atom_types) for a, label in
-                       (nx.get_node_attributes(graph, 'atomic_num')).items()}
-            nx.set_node_attributes(graph, name='atomic_num', values=at_type)
-        except KeyError:
-            print('!!!! Atom type to one-hot error for input ', smiles, ' ignored')
-            return None, 0,0,0
-
-        at_charge = {a: oh_tensor(self.charges_map[label], self.num_charges) for a, label in
-                     (nx.get_node_attributes(graph, 'formal_charge')).items()}
-        nx.set_node_attributes(graph, name='formal_charge', values=at_charge)
-        
-        try:
-            hydrogens = {a: torch.tensor(self.chi_map[label], dtype=torch.float) for a, label in
-                       (nx.get_node_attributes(graph, 'num_explicit_hs')).items()}
-            nx.set_node_attributes(graph, name='num_explicit_hs', values=hydrogens)
-        except KeyError:
-            print('!!!! Number of explicit hydrogens to one-hot error for input ', smiles, ' ignored')
-            return None, 0,0,0
-        
-        aromatic = {a: torch.tensor(self.chi_map[label], dtype=torch.float) for a, label in
-                   (nx.get_node_attributes(graph, 'is_aromatic')).items()}
-        nx.set_node_attributes(graph, name='is_aromatic', values=aromatic)
-
-        at_chir = {a: torch.tensor(self.chi_map[label], dtype=torch.float) for a, label in
-                   (nx.get_node_attributes(graph, 'chiral_tag')).items()}
-        nx.set_node_attributes(graph, name='chiral_tag', values=at_chir)
-
-        # to dgl 
-        g_dgl = dgl.DGLGraph()
-        node_features = ['atomic_num', 'formal_charge', 'num_explicit_hs', 'is_aromatic', 'chiral_tag']
-        g_dgl.from_networkx(nx_graph=graph,
-                            node_attrs=node_features,
-                            edge_attrs=['one_hot']) 
-        
-        N=g_dgl.number_of_nodes()
-
-        g_dgl.ndata['h'] = torch.cat([g_dgl.ndata[f].view(N,-1) for f in node_features], dim=1)
-        
-        if self.graph_only: # give only the graph (to encode in latent space)
-            return g_dgl, 0,0,0
 
         # 2 - Smiles / selfies to integer indices array
         
-        if self.language == 'selfies':
+        if self.language == 'selfies' and sequence is not None:
+            if sequence[0] < 0: # no one hot encoding for this selfie, ignore
+                print('!!! Selfie to one-hot failed with current alphabet')
+                return None
+            a = sequence.astype(np.int64)
+
+        elif self.language == 'selfies':
             
             a, valid_flag = self.selfies_to_hot(selfie)
             if valid_flag ==0 : # no one hot encoding for this selfie, ignore 
                 print('!!! Selfie to one-hot failed with current alphabet')
-                return None, 0,0,0
+                return None
             
         else:
             a = np.zeros(self.max_len)
@@ -352,6 +399,25 @@ class molDataset(Dataset):
 
         targets = np.nan_to_num(targets) # if nan somewhere, change to 0.
             
+        return graph + (a, props, targets)
+
+    def __getitem__(self, idx):
+        # Returns tuple 
+        if self.shards is not None:  # precomputed, no parsing
+            src, dst, edge_types, h, a, props, targets = self.shards.get(idx)
+            if len(self.props) == 0:
+                props = 0
+            if len(self.targets) == 0:
+                targets = 0
+        else:
+            item = self.featurize(idx, graph_only=self.graph_only)
+            if item is None:
+                return None, 0,0,0
+            src, dst, edge_types, h, a, props, targets = item
+
+        g_dgl = arrays_to_dgl(src, dst, edge_types, h)
+        if self.graph_only: # give only the graph (to encode in latent space)
+            return g_dgl, 0,0,0
 
         return g_dgl, a, props, targets
 
@@ -370,11 +436,15 @@ class Loader():
                  num_workers=12,
                  graph_only=False, # Only load molecular graph (to get latent embeddings)
                  test_only=False,
-                 redo_selfies = False):
+                 redo_selfies = False,
+                 shards_path=None,
+                 bucket_by_length=False):
         """
         Wrapper for test loader, train loader 
         Uncomment to add validation loader 
         if test_only: puts all molecules in csv in the test loader. Returns empty train and valid loaders
+        if shards_path: reads precomputed graph shards (data_processing/prepare_shards.py) instead of csv_path
+        if bucket_by_length: train batches group molecules of similar sequence lengths (BucketBatchSampler)
 
         """
 
@@ -390,11 +460,13 @@ class Loader():
                                   alphabet_name=alphabet_name,
                                   n_mols=n_mols,
                                   graph_only=graph_only, 
-                                  compute_selfies = redo_selfies)
+                                  compute_selfies = redo_selfies,
+                                  shards_path=shards_path)
 
         self.num_edge_types, self.num_atom_types = self.dataset.num_edge_types, self.dataset.num_atom_types
         self.num_charges = self.dataset.num_charges
         self.test_only = test_only
+        self.bucket_by_length = bucket_by_length
 
     def get_maps(self):
         # Returns dataset mapping of edge and node features 
@@ -430,7 +502,11 @@ class Loader():
         test_set = Subset(self.dataset, test_indices)
         #print(f"Dataset contains {n} samples (train subset: {len(train_set)}, Test subset:{len(test_set)}) ")
 
-        if not self.test_only:
+        if not self.test_only and self.bucket_by_length:
+            lengths = self.dataset.sequence_lengths()[train_indices]
+            train_loader = DataLoader(dataset=train_set, batch_sampler=BucketBatchSampler(lengths, self.batch_size),
+                                      num_workers=self.num_workers, collate_fn=collate_block)
+        elif not self.test_only:
             train_loader = DataLoader(dataset=train_set, shuffle=True, batch_size=self.batch_size,
                                       num_workers=self.num_workers, collate_fn=collate_block, drop_last=True)
 
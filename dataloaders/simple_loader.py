@@ -23,12 +23,11 @@ from rdkit import Chem
 
 import pickle
 import json
-import networkx as nx
 from selfies import encoder, decoder
-from ordered_set import OrderedSet
 
 from torch.utils.data import Dataset, DataLoader
-from data_processing.rdkit_to_nx import smiles_to_nx
+from data_processing.rdkit_to_dgl import GraphFeaturizer
+from data_processing.selfies_tokenizer import SelfiesTokenizer, get_alphabets
 
 
 def collate_block(samples):
@@ -81,6 +80,7 @@ class SimpleDataset(Dataset):
         self.num_charges, self.num_chir = len(self.charges_map), len(self.chi_map)
         print('> Loaded edge and atoms types to one-hot mappings')
         self.emb_size = 16  # node embedding size = number of node features 
+        self.featurizer = GraphFeaturizer(self.edge_map, self.at_map, self.chi_map, self.charges_map)
 
         # 3/ =========== SMILES and SELFIES handling : ================== 
 
@@ -105,6 +105,8 @@ class SimpleDataset(Dataset):
         self.char_to_index = dict((c, i) for i, c in enumerate(self.alphabet))
         self.index_to_char = dict((i, c) for i, c in enumerate(self.alphabet))
         self.n_chars = len(self.alphabet)
+        self.tokenizer = SelfiesTokenizer(self.alphabet, self.max_len) if self.language == 'selfies' else None
+        self.sequences = None  # selfies list encoded at once, see pass_selfies_list
 
         print(f"> Loaded alphabet. Using {self.language}. Max sequence length allowed is {self.max_len}")
 
@@ -114,6 +116,7 @@ class SimpleDataset(Dataset):
         self.n = self.df.shape[0]
         print('New dataset contains smiles and sample weights')
         self.input_type = 'smiles'
+        self.sequences = None
 
     def pass_selfies_list(self, selfies, weights):
         # pass smiles list to the model; a dataframe with unique column 'can' will be created 
@@ -121,6 +124,10 @@ class SimpleDataset(Dataset):
         self.n = self.df.shape[0]
         print('New dataset contains selfies and sample weights')
         self.input_type = 'selfies'
+        self.sequences = None
+        if self.language == 'selfies':  # rows of -1 : selfies that can't be encoded
+            self.sequences, lengths = self.tokenizer.encode(self.df.selfies)
+            self.sequences[lengths < 0] = -1
 
     def __len__(self):
         return self.n
@@ -136,22 +143,9 @@ class SimpleDataset(Dataset):
             - longest smiles string
         """
 
-        smiles_list = np.asanyarray(self.df.smiles)
-
-        selfies_list = np.asanyarray(self.df.selfies)
-
-        smiles_alphabet = list(OrderedSet(''.join(smiles_list)))
-        largest_smiles_len = len(max(smiles_list, key=len))
-        selfies_len = []
-
-        print(f'--> Building alphabets for {smiles_list.shape[0]} smiles and selfies in dataset...')
-        for individual_selfie in selfies_list:
-            selfies_len.append(len(individual_selfie) - len(individual_selfie.replace('[', '')))  # len of SELFIES
-        selfies_alphabet_pre = list(OrderedSet(''.join(selfies_list)[1:-1].split('][')))
-        selfies_alphabet = []
-        for selfies_element in selfies_alphabet_pre:
-            selfies_alphabet.append('[' + selfies_element + ']')
-        largest_selfies_len = max(selfies_len)
+        print(f'--> Building alphabets for {self.df.shape[0]} smiles and selfies in dataset...')
+        selfies_alphabet, largest_selfies_len, smiles_alphabet, largest_smiles_len = get_alphabets(self.df.smiles,
+                                                                                                  self.df.selfies)
 
         print('Finished parsing smiles and selfies alphabet. Saving to pickle file custom_alphabets.pickle')
         print('Longest selfies : ', largest_selfies_len)
@@ -171,29 +165,10 @@ class SimpleDataset(Dataset):
         """
         Go from a single selfies string to a list of integers
         """
-        # integer encode input smile
-        len_of_molecule = len(molecule) - len(molecule.replace('[', ''))
-        for _ in range(self.max_len - len_of_molecule):  # selfies padding
-            molecule += '[epsilon]'
-
-        selfies_char_list_pre = molecule[1:-1].split('][')
-        selfies_char_list = []
-        for selfies_element in selfies_char_list_pre:
-            selfies_char_list.append('[' + selfies_element + ']')
-
-        try:
-            integer_encoded = [self.char_to_index[char] for char in selfies_char_list]
-            if len(integer_encoded)> self.max_len:
-                valid_flag = 0
-                a=0
-            else:
-                a = np.array(integer_encoded)
-                valid_flag=1
-        except:
-            a = 0
-            valid_flag = 0  # no one hot encoding possible : ignoring molecule 
-
-        return a, valid_flag
+        a = self.tokenizer.encode_one(molecule)
+        if a is None:
+            return 0, 0  # no one hot encoding possible : ignoring molecule
+        return a.astype(np.int64), 1
 
     def __getitem__(self, idx):
         # Returns tuple 
@@ -210,59 +185,32 @@ class SimpleDataset(Dataset):
         w = row.weights
 
         # 1 - Graph building
-        graph = smiles_to_nx(smiles)
-
-        one_hot = {edge: torch.tensor(self.edge_map[label]) for edge, label in
-                   (nx.get_edge_attributes(graph, 'bond_type')).items()}
-        nx.set_edge_attributes(graph, name='one_hot', values=one_hot)
-
+        m = Chem.MolFromSmiles(smiles)
+        if m is None:
+            if self.debug:
+                print('!!!! Invalid input ', smiles, ' ignored')
+            return None, 0, 0
         try:
-            at_type = {a: oh_tensor(self.at_map[label], self.num_atom_types) for a, label in
-                       (nx.get_node_attributes(graph, 'atomic_num')).items()}
-            nx.set_node_attributes(graph, name='atomic_num', values=at_type)
-        except KeyError:
-            print('!!!! Atom type to one-hot error for input ', smiles, ' ignored')
-            return None, 0, 0, 0
-
-        at_charge = {a: oh_tensor(self.charges_map[label], self.num_charges) for a, label in
-                     (nx.get_node_attributes(graph, 'formal_charge')).items()}
-        nx.set_node_attributes(graph, name='formal_charge', values=at_charge)
-
-        hydrogens = {a: torch.tensor(self.chi_map[label], dtype=torch.float) for a, label in
-                     (nx.get_node_attributes(graph, 'num_explicit_hs')).items()}
-        nx.set_node_attributes(graph, name='num_explicit_hs', values=hydrogens)
-
-        aromatic = {a: torch.tensor(self.chi_map[label], dtype=torch.float) for a, label in
-                    (nx.get_node_attributes(graph, 'is_aromatic')).items()}
-        nx.set_node_attributes(graph, name='is_aromatic', values=aromatic)
-
-        at_chir = {a: torch.tensor(self.chi_map[label], dtype=torch.float) for a, label in
-                   (nx.get_node_attributes(graph, 'chiral_tag')).items()}
-        nx.set_node_attributes(graph, name='chiral_tag', values=at_chir)
-
-        # to dgl 
-        g_dgl = dgl.DGLGraph()
-        node_features = ['atomic_num', 'formal_charge', 'num_explicit_hs', 'is_aromatic', 'chiral_tag']
-        g_dgl.from_networkx(nx_graph=graph,
-                            node_attrs=node_features,
-                            edge_attrs=['one_hot'])
-
-        N = g_dgl.number_of_nodes()
-
-        g_dgl.ndata['h'] = torch.cat([g_dgl.ndata[f].view(N, -1) for f in node_features], dim=1)
+            g_dgl = self.featurizer.mol_to_dgl(m)
+        except KeyError as e:
+            print('!!!! One-hot error for input ', smiles, e, ' ignored')
+            return None, 0, 0
 
         # 2 - Smiles / selfies to integer indices array
         if self.language == 'selfies':  # model works with selfies
 
             if self.input_type == 'smiles':  # input to dataloader is smiles// get kekulesmiles selfie
-                m = Chem.MolFromSmiles(smiles)
                 Chem.Kekulize(m)
                 string_representation = encoder(Chem.MolToSmiles(m, kekuleSmiles=True))
 
             elif self.input_type == 'selfies':
                 string_representation = selfies
 
-            a, valid_flag = self.selfies_to_hot(string_representation)
+            if self.sequences is not None:
+                a = self.sequences[idx].astype(np.int64)
+                valid_flag = int(a[0] >= 0)
+            else:
+                a, valid_flag = self.selfies_to_hot(string_representation)
 
             if valid_flag == 0 :  # no one hot encoding for this selfie, ignore
                 print('!!! Selfie to one-hot failed with current alphabet:')
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming dataset for csv files too large to hold in memory (train_zinc.py --stream).
+
+The csv is read by byte ranges (blocks of whole lines). Each dataloader worker reads its own share of the blocks,
+in an order shuffled at each pass, parses the next block in a background thread while featurizing the current one,
+and shuffles molecules with a bounded buffer. The iterator runs over the requested number of passes, so one
+DataLoader (and its worker processes) serves the whole run.
+The first n_valid molecules of the file are held out as a fixed validation set.
+
+"""
+
+import io
+import threading
+import queue
+import itertools
+
+import numpy as np
+import pandas as pd
+from torch.utils.data import IterableDataset, DataLoader, get_worker_info
+
+from data_processing.rdkit_to_dgl import arrays_to_dgl
+from dataloaders.molDataset import collate_block
+
+
+class StreamingMolDataset(IterableDataset):
+    """
+    Iterable over (graph, sequence, props, targets) of the molecules of a csv, featurized like molDataset.
+    :param csv_path: csv with 'smiles', 'selfies' and props / targets columns
+    :param dataset: molDataset (without dataframe) holding the alphabet, maps, props and targets to use
+    :param n_valid: number of molecules at the start of the file held out for validation
+    :param block_bytes: size of the byte ranges read at once
+    :param shuffle_buffer: number of featurized molecules in the shuffle buffer (0 : no shuffling)
+    :param epochs: number of passes over the file, None for an infinite stream
+    """
+
+    def __init__(self, csv_path, dataset, n_valid=10000, block_bytes=1 << 22, shuffle_buffer=20000, epochs=1,
+                 seed=0):
+        self.csv_path = csv_path
+        self.dataset = dataset
+        self.block_bytes = block_bytes
+        self.shuffle_buffer = shuffle_buffer
+        self.epochs = epochs
+        self.seed = seed
+
+        with open(csv_path, 'rb') as f:
+            self.header = f.readline()
+            valid_lines = list(itertools.islice(f, n_valid))
+            self.data_start = f.tell()
+            f.seek(0, 2)
+            self.data_end = f.tell()
+        self.valid_df = self._parse(b''.join(valid_lines))
+        self.n_blocks = max(1, -(-(self.data_end - self.data_start) // block_bytes))
+
+    def _parse(self, data):
+        return pd.read_csv(io.BytesIO(self.header + data))
+
+    def read_block(self, f, b):
+        """ Dataframe of the lines starting in byte range of block b """
+        start = self.data_start + b * self.block_bytes
+        end = min(start + self.block_bytes, self.data_end)
+        if start > self.data_start:  # skip the line that started in the previous block
+            f.seek(start - 1)
+            f.readline()
+            start = f.tell()
+        if start >= end:
+            return None
+        f.seek(end - 1)
+        f.readline()
+        end = f.tell()
+        f.seek(start)
+        return self._parse(f.read(end - start))
+
+    def worker_blocks(self, epoch):
+        """ Blocks read by this worker at a given pass : shuffled order, interleaved between workers """
+        info = get_worker_info()
+        worker_id, n_workers = (info.id, info.num_workers) if info is not None else (0, 1)
+        order = np.random.RandomState(self.seed + epoch).permutation(self.n_blocks)
+        return order[worker_id::n_workers]
+
+    def _prefetch(self, blocks, q):
+        """ Background thread : reads and parses the next blocks """
+        with open(self.csv_path, 'rb') as f:
+            for b in blocks:
+                q.put(self.read_block(f, b))
+        q.put(StopIteration)
+
+    def molecules(self):
+        """ Featurized molecules, in block order """
+        epochs = itertools.count() if self.epochs is None else range(self.epochs)
+        for epoch in epochs:
+            q = queue.Queue(maxsize=2)
+            threading.Thread(target=self._prefetch, args=(self.worker_blocks(epoch), q), daemon=True).start()
+            while True:
+                df = q.get()
+                if df is StopIteration:
+                    break
+                if df is None:
+                    continue
+                sequences = self.dataset.encode_sequences(df)  # whole block at once
+                for i in range(df.shape[0]):
+                    item = self.dataset.featurize_row(df.iloc[i], graph_only=self.dataset.graph_only,
+                                                      sequence=None if sequences is None else sequences[i])
+                    if item is not None:
+                        yield item
+
+    def __iter__(self):
+        info = get_worker_info()
+        rng = np.random.RandomState(self.seed + (info.id if info is not None else 0))
+        buffer = []
+        for item in self.molecules():
+            if self.shuffle_buffer <= 0:  # no shuffling, molecules in block order
+                yield self.to_graph(item)
+                continue
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(item)
+                continue
+            i = rng.randint(len(buffer))
+            item, buffer[i] = buffer[i], item
+            yield self.to_graph(item)
+        rng.shuffle(buffer)
+        for item in buffer:
+            yield self.to_graph(item)
+
+    @staticmethod
+    def to_graph(item):
+        src, dst, edge_types, h, a, props, targets = item
+        return arrays_to_dgl(src, dst, edge_types, h), a, props, targets
+
+
+class StreamChunk:
+    """ The next n_batches batches of a running stream iterator, looks like a DataLoader to the training loop """
+
+    def __init__(self, stream, n_batches):
+        self.stream = stream
+        self.n_batches = n_batches
+        self.consumed = 0  # batches actually drawn, less than n_batches at the end of the stream
+
+    def __len__(self):
+        return self.n_batches
+
+    def __iter__(self):
+        for batch in itertools.islice(self.stream, self.n_batches):
+            self.consumed += 1
+            yield batch
+
+
+def get_stream_loaders(csv_path, dataset, batch_size, num_workers, n_valid=10000, shuffle_buffer=20000, epochs=1,
+                       block_bytes=1 << 22):
+    """
+    Returns the streaming train loader and the DataLoader of the held-out validation molecules
+    (the first n_valid of the csv)
+    """
+    stream = StreamingMolDataset(csv_path, dataset, n_valid=n_valid, block_bytes=block_bytes,
+                                 shuffle_buffer=shuffle_buffer, epochs=epochs)
+    train_loader = DataLoader(stream, batch_size=batch_size, num_workers=num_workers, collate_fn=collate_block)
+
+    dataset.pass_dataset(stream.valid_df, graph_only=dataset.graph_only)
+    valid_loader = DataLoader(dataset, shuffle=False, batch_size=batch_size, num_workers=num_workers,
+                              collate_fn=collate_block, drop_last=False)
+    return train_loader, valid_loader
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+3D conformers of the docked ligands : RDKit ETKDG embedding + MMFF minimization, with hydrogens, stored as mol blocks
+in a content-addressed cache (one file per molecule, named by the hash of its canonical smiles). A molecule is
+embedded once and reused for every docking of it (other exhaustiveness, target or campaign).
+
+Embed a list of smiles into the cache over all cores :
+python docking/conformers.py -i [smiles.txt] -j 8
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+from functools import partial
+from multiprocessing import Pool
+
+from rdkit import Chem
+from rdkit.Chem import AllChem
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+if __name__ == '__main__':
+    sys.path.append(os.path.join(script_dir, '..'))
+
+DEFAULT_PATH = os.path.join(script_dir, 'conformers')
+
+
+def embed_conformer(smiles, seed=42, max_iters=2000):
+    """ Mol block (with hydrogens) of an ETKDG conformer of smiles, minimized with MMFF (UFF if no MMFF params) """
+    m = Chem.MolFromSmiles(smiles)
+    if m is None:
+        raise ValueError(f'Could not parse smiles {smiles}')
+    m = Chem.AddHs(m)
+    params = AllChem.ETKDGv3()
+    params.randomSeed = seed
+    if AllChem.EmbedMolecule(m, params) != 0:
+        params.useRandomCoords = True  # fallback for molecules where the default embedding fails
+        if AllChem.EmbedMolecule(m, params) != 0:
+            raise ValueError(f'Could not embed {smiles}')
+    if AllChem.MMFFHasAllMoleculeParams(m):
+        AllChem.MMFFOptimizeMolecule(m, maxIters=max_iters)
+    else:
+        AllChem.UFFOptimizeMolecule(m, maxIters=max_iters)
+    m.SetProp('_Name', smiles)
+    return Chem.MolToMolBlock(m)
+
+
+class ConformerCache:
+    """ Directory of conformers keyed by canonical smiles, shared by processes (files are written atomically) """
+
+    def __init__(self, path=DEFAULT_PATH, seed=42):
+        self.path = path
+        self.seed = seed
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(smiles):
+        m = Chem.MolFromSmiles(smiles)
+        canonical = smiles if m is None else Chem.MolToSmiles(m)
+        return hashlib.sha1(canonical.encode()).hexdigest()
+
+    def file(self, smiles):
+        key = self.key(smiles)
+        return os.path.join(self.path, key[:2], key + '.mol')
+
+    def __contains__(self, smiles):
+        return os.path.exists(self.file(smiles))
+
+    def get(self, smiles, embed=True):
+        """ Mol block of smiles, embedded and added to the cache if missing (None if missing and not embed) """
+        path = self.file(smiles)
+        if os.path.exists(path):
+            with open(path) as f:
+                return f.read()
+        if not embed:
+            return None
+        molblock = embed_conformer(smiles, seed=self.seed)
+        self.put(smiles, molblock)
+        return molblock
+
+    def put(self, smiles, molblock):
+        path = self.file(smiles)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(molblock)
+        os.replace(tmp, path)
+
+    def embed_batch(self, smiles, n_jobs=None, chunk_size=4):
+        """
+        Embeds the smiles that are not in the cache over a pool of n_jobs processes (None : cpu count, 1 : serial).
+        Returns {smiles: error message} for the molecules that could not be embedded.
+        """
+        missing = [s for s in dict.fromkeys(smiles) if s not in self]
+        fn = partial(_embed_into_cache, path=self.path, seed=self.seed)
+        if n_jobs == 1 or len(missing) <= 1:
+            errors = [fn(s) for s in missing]
+        else:
+            with Pool(n_jobs) as pool:
+                errors = pool.map(fn, missing, chunksize=chunk_size)
+        return {s: err for s, err in zip(missing, errors) if err is not None}
+
+
+def _embed_into_cache(smiles, path, seed):
+    """ Embeds smiles into the cache at path, returns the error message or None """
+    try:
+        ConformerCache(path, seed).get(smiles)
+        return None
+    except Exception as err:
+        return f'{type(err).__name__}: {err}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', help="text file with one smiles per line", type=str)
+    parser.add_argument('-o', '--cache', help="conformer cache directory", type=str, default=DEFAULT_PATH)
+    parser.add_argument('-j', '--n_jobs', type=int, default=None)
+    args, _ = parser.parse_known_args()
+
+    with open(args.input) as f:
+        smiles = [l.split()[0] for l in f if l.strip()]
+    cache = ConformerCache(args.cache)
+    errors = cache.embed_batch(smiles, n_jobs=args.n_jobs)
+    for s, err in errors.items():
+        print(f'Failed : {s} ({err})')
+    print(f'{len(smiles) - len(errors)}/{len(smiles)} ligands in the conformer cache {args.cache}')
@@ -17,6 +17,9 @@ script_dir = os.path.dirname(os.path.realpath(__file__))
 if __name__ == '__main__':
     sys.path.append(os.path.join(script_dir, '..'))
 
+from docking.score_store import vina_version, settings_version
+from docking.prepare_ligand import embed_ligand, mol_to_pdbqt
+
 
 def soft_mkdir(path):
     if not os.path.exists(path):
@@ -41,6 +44,13 @@ def set_path(computer):
     return PYTHONSH, VINA
 
 
+def docking_version(vina, ligand_prep='mgltools', etkdg=False):
+    """
+    Version of the docking settings in the score store for the vina executable (see score_store.settings_version)
+    """
+    return settings_version(vina_version(vina), ligand_prep, etkdg)
+
+
 def prepare_receptor(target):
     # just run pythonsh prepare_receptor4.py -r drd3.pdb -o drd3.pdbqt -A hydrogens
     RECEPTOR_PATH = os.path.join(script_dir, f'data_docking/{target}.pdbqt')
@@ -48,10 +58,19 @@ def prepare_receptor(target):
 
 
 def dock(smile, unique_id, target='drd3', pythonsh=None, vina=None, parallel=True, exhaustiveness=16, mean=True,
-         load=False):
+         load=False, store=None, timeout=1200, raise_errors=False, ligand_prep='mgltools', conformers=None):
     """
     load if we want to check for possible existing score, we want a dict of results
+    store : ScoreStore (docking/score_store.py), scores already in the store for this target, exhaustiveness and vina
+    version are returned without docking, new ones are added to it
     mean = False : returns list of top 10 poses scores. 
+    timeout : time budget of the vina run in seconds (subprocess.TimeoutExpired when exceeded)
+    raise_errors : raise the errors of ligand preparation and docking instead of returning a score of 0
+    ligand_prep : 'mgltools' for the pythonsh prepare_ligand4.py subprocess, 'openbabel' to write the ligand pdbqt in
+    this process (docking/prepare_ligand.py, not validated against prepare_ligand4.py yet, see
+    docking/validate_ligand_prep.py). Scores of the two preparations are kept apart in the store.
+    conformers : ConformerCache (docking/conformers.py), the ligand conformer is read from it (embedded once if
+    missing) instead of embedding it with pybel make3D at each docking
     """
     if load:
         try:
@@ -67,6 +86,18 @@ def dock(smile, unique_id, target='drd3', pythonsh=None, vina=None, parallel=Tru
         global VINA
         vina = VINA
 
+    if not isinstance(smile, str):
+        # None (or -1) for molecules that could not be decoded : failure score, without reaching the store
+        if raise_errors:
+            raise ValueError(f'No smiles to dock : {smile}')
+        return 0 if mean else [0] * 10
+
+    if store is not None:
+        version = docking_version(vina, ligand_prep, etkdg=conformers is not None)
+        score = store.get(smile, target, exhaustiveness, version, mean=mean)
+        if score is not None:
+            return score
+
     # soft_mkdir('tmp') # tmp is always there and never removed
     tmp_path = os.path.join(script_dir, f'tmp/{unique_id}')
     soft_mkdir(tmp_path)
@@ -77,15 +108,18 @@ def dock(smile, unique_id, target='drd3', pythonsh=None, vina=None, parallel=Tru
     try:
         pass
         # PROCESS MOLECULE
-        mol = pybel.readstring("smi", smile)
-        mol.addh()
-        mol.make3D()
-        dump_mol2_path = os.path.join(tmp_path, 'ligand.mol2')
+        mol = embed_ligand(smile, conformers)
         dump_pdbqt_path = os.path.join(tmp_path, 'ligand.pdbqt')
-        mol.write('mol2', dump_mol2_path, overwrite=True)
-        prepare_ligand = os.path.join(script_dir, 'prepare_ligand4.py')
-        subprocess.run(f'{pythonsh} {prepare_ligand} -l {dump_mol2_path} -o {dump_pdbqt_path} -A hydrogens'.split(),
-                       timeout=100)
+        if ligand_prep == 'mgltools':
+            dump_mol2_path = os.path.join(tmp_path, 'ligand.mol2')
+            mol.write('mol2', dump_mol2_path, overwrite=True)
+            prepare_ligand = os.path.join(script_dir, 'prepare_ligand4.py')
+            subprocess.run(
+                f'{pythonsh} {prepare_ligand} -l {dump_mol2_path} -o {dump_pdbqt_path} -A hydrogens'.split(),
+                timeout=min(100, timeout))
+        else:
+            with open(dump_pdbqt_path, 'w') as f:
+                f.write(mol_to_pdbqt(mol))
 
         start = time()
         # DOCK
@@ -93,10 +127,10 @@ def dock(smile, unique_id, target='drd3', pythonsh=None, vina=None, parallel=Tru
               f' --config {CONF_PATH} --exhaustiveness {exhaustiveness} --log log.txt'
         if parallel:
             # print(cmd)
-            subprocess.run(cmd.split(), timeout=1200)
+            subprocess.run(cmd.split(), timeout=timeout)
         else:
             cmd += ' --cpu 1'
-            subprocess.run(cmd.split(), timeout=1200)
+            subprocess.run(cmd.split(), timeout=timeout)
         delta_t = time() - start
         print("Docking time :", delta_t)
 
@@ -106,9 +140,16 @@ def dock(smile, unique_id, target='drd3', pythonsh=None, vina=None, parallel=Tru
             values = [l.split() for l in slines]
             # In each split string, item with index 3 should be the kcal/mol energy.
             score = [float(v[3]) for v in values]
-            if mean:
-                score = np.mean(score)
+        if len(score) == 0:
+            raise ValueError(f'No docking pose in vina output for {smile}')
+        if store is not None and len(score) > 0:
+            store.put(smile, score, target, exhaustiveness, version)
+        if mean:
+            score = np.mean(score)
     except:
+        if raise_errors:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
         if mean:
             score = 0
         else:
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+In-process ligand preparation : smiles -> Vina-ready pdbqt with openbabel, in place of the MGLTools subprocess
+`pythonsh prepare_ligand4.py -A hydrogens`. Gasteiger charges and the torsion tree are left to openbabel's pdbqt
+writer : they are not yet checked against prepare_ligand4.py (nonpolar hydrogens merging, rotatable bonds, charges),
+so dock keeps MGLTools as its default preparation until docking/validate_ligand_prep.py has been run.
+
+Batch preparation of a list of smiles to a directory of pdbqt files :
+python docking/prepare_ligand.py -i [smiles.txt] -o [pdbqt_dir] -j 8
+
+Validation against prepare_ligand4.py : see docking/validate_ligand_prep.py
+"""
+
+import argparse
+import os
+import sys
+from functools import partial
+from multiprocessing import Pool
+
+try:
+    import pybel
+except:
+    import openbabel
+    from openbabel import pybel
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+if __name__ == '__main__':
+    sys.path.append(os.path.join(script_dir, '..'))
+
+
+def embed_ligand(smile, conformers=None):
+    """
+    3D pybel molecule with hydrogens, as docked (same steps as before the mol2 file given to MGLTools).
+    conformers : ConformerCache (docking/conformers.py) to read the RDKit conformer from, instead of pybel make3D
+    """
+    if conformers is not None:
+        return pybel.readstring("mol", conformers.get(smile))
+    mol = pybel.readstring("smi", smile)
+    mol.addh()
+    mol.make3D()
+    return mol
+
+
+def mol_to_pdbqt(mol):
+    """ pdbqt string of a 3D pybel molecule with hydrogens, gasteiger charges and openbabel's torsion tree """
+    if hasattr(mol, 'calccharges'):  # openbabel 3, gasteiger is also the default charge model of older versions
+        mol.calccharges('gasteiger')
+    return mol.write('pdbqt')
+
+
+def prepare_ligand(smile, pdbqt_path=None):
+    """ Vina-ready pdbqt string of a smiles, also written to pdbqt_path if given """
+    pdbqt = mol_to_pdbqt(embed_ligand(smile))
+    if pdbqt_path is not None:
+        with open(pdbqt_path, 'w') as f:
+            f.write(pdbqt)
+    return pdbqt
+
+
+def _prepare_one(task, out_dir=None):
+    """ (pdbqt string or None, error message or None) for task = (index, smiles) """
+    i, smile = task
+    try:
+        path = os.path.join(out_dir, f'{i}.pdbqt') if out_dir is not None else None
+        return prepare_ligand(smile, path), None
+    except Exception as err:
+        return None, f'{type(err).__name__}: {err}'
+
+
+def prepare_ligands(smiles, out_dir=None, n_jobs=None, chunk_size=4):
+    """
+    Prepares a list of ligands over a pool of n_jobs processes (None : cpu count, 1 : serial).
+    Returns the list of pdbqt strings (None for ligands that failed) and the list of error messages.
+    If out_dir is given, the pdbqt of ligand i is also written to out_dir/i.pdbqt
+    """
+    tasks = list(enumerate(smiles))
+    fn = partial(_prepare_one, out_dir=out_dir)
+    if n_jobs == 1:
+        results = [fn(t) for t in tasks]
+    else:
+        with Pool(n_jobs) as pool:
+            results = pool.map(fn, tasks, chunksize=chunk_size)
+    pdbqts, errors = map(list, zip(*results)) if results else ([], [])
+    return pdbqts, errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', help="text file with one smiles per line", type=str)
+    parser.add_argument('-o', '--out_dir', help="directory for the pdbqt files", type=str, default='ligands_pdbqt')
+    parser.add_argument('-j', '--n_jobs', type=int, default=None)
+    args, _ = parser.parse_known_args()
+
+    with open(args.input, 'r') as f:
+        smiles = [l.split()[0] for l in f if l.strip()]
+    os.makedirs(args.out_dir, exist_ok=True)
+    pdbqts, errors = prepare_ligands(smiles, out_dir=args.out_dir, n_jobs=args.n_jobs)
+    for s, err in zip(smiles, errors):
+        if err is not None:
+            print(f'Failed : {s} ({err})')
+    print(f'{sum(p is not None for p in pdbqts)}/{len(smiles)} ligands prepared in {args.out_dir}')
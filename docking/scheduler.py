@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Docking scheduler : ligands are handed out one at a time to free worker slots, so that a few slow ligands do not
+leave the other cores idle. Each result is appended to a csv as soon as it is done, failed dockings are retried and
+every vina run has a time budget.
+
+Two sources of ligands :
+- a list, docked by a local pool of n_workers processes (one node)
+- a DockingQueue shared by several processes or SLURM array tasks, each of them claiming the next ligand not taken
+  by the others (the queue is a SQLite file on the shared file system)
+"""
+
+import csv
+import hashlib
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+from functools import partial
+from multiprocessing import Pool
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+if __name__ == '__main__':
+    sys.path.append(os.path.join(script_dir, '..'))
+
+
+class DockingQueue:
+    """
+    Ligands of a docking batch, claimed one by one by any number of processes. The batch id is a hash of the ligand
+    list, so all the tasks of a job array can create the queue at once, and a new batch never reuses old claims.
+    Claims older than stale_after seconds that are not done (task killed) are handed out again.
+    """
+
+    def __init__(self, path, smiles, stale_after=3600, timeout=120, name=''):
+        self.path = path
+        self.stale_after = stale_after
+        # name : to tell apart batches with the same ligands (ex. screening and refinement)
+        self.batch = hashlib.sha1('\n'.join([name] + list(smiles)).encode()).hexdigest()
+        self.size = len(smiles)
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS queue (batch TEXT, idx INTEGER, smiles TEXT, claimed REAL, '
+                          'worker TEXT, done INTEGER, PRIMARY KEY (batch, idx))')
+        self.conn.execute('BEGIN IMMEDIATE')
+        self.conn.executemany('INSERT OR IGNORE INTO queue VALUES (?, ?, ?, NULL, NULL, 0)',
+                              [(self.batch, i, s) for i, s in enumerate(smiles)])
+        self.conn.execute('COMMIT')
+
+    def claim(self, worker):
+        """ (index, smiles) of the next free ligand, now claimed by worker, None when all ligands are taken """
+        self.conn.execute('BEGIN IMMEDIATE')
+        row = self.conn.execute('SELECT idx, smiles FROM queue WHERE batch=? AND done=0 AND '
+                                '(claimed IS NULL OR claimed < ?) ORDER BY idx LIMIT 1',
+                                (self.batch, time.time() - self.stale_after)).fetchone()
+        if row is not None:
+            self.conn.execute('UPDATE queue SET claimed=?, worker=? WHERE batch=? AND idx=?',
+                              (time.time(), str(worker), self.batch, row[0]))
+        self.conn.execute('COMMIT')
+        return row
+
+    def done(self, idx):
+        self.conn.execute('UPDATE queue SET done=1 WHERE batch=? AND idx=?', (self.batch, idx))
+
+    def remaining(self):
+        return self.conn.execute('SELECT COUNT(*) FROM queue WHERE batch=? AND done=0', (self.batch,)).fetchone()[0]
+
+
+class Progress:
+    """
+    Prints docked / total ligands, failures, throughput and remaining time every report_every seconds.
+    docked : ligands docked by this process without failure
+    seconds : total docking time of this process, failed attempts included (cpu time for single-cpu vina runs)
+    """
+
+    def __init__(self, total, report_every=60):
+        self.total = total
+        self.report_every = report_every
+        self.done = 0
+        self.docked = 0
+        self.failed = 0
+        self.retried = 0
+        self.seconds = 0.
+        self.start = self.last = time.perf_counter()
+
+    def update(self, failed, attempts, seconds=0.):
+        self.done += 1
+        self.docked += int(not failed)
+        self.failed += int(failed)
+        self.retried += attempts - 1
+        self.seconds += seconds
+        now = time.perf_counter()
+        if now - self.last >= self.report_every or self.done == self.total:
+            self.last = now
+            print(self.report(now))
+
+    def report(self, now=None):
+        elapsed = (now or time.perf_counter()) - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0
+        eta = (self.total - self.done) / rate if rate > 0 else float('inf')
+        return (f'{self.done}/{self.total} ligands docked ({self.failed} failed, {self.retried} retries), '
+                f'{60 * rate:.1f} ligands/min, elapsed {elapsed / 60:.1f} min, remaining ~{eta / 60:.1f} min')
+
+
+def dock_with_retries(task, dock_fn, retries=2, failed_score=0):
+    """
+    Runs dock_fn(smiles, unique_id) for task = (index, smiles, unique_id). dock_fn must raise on failure.
+    Failures are retried up to retries times, except time budget overruns which would only time out again.
+    Returns (index, smiles, score, attempts, error message or None, seconds spent)
+    """
+    idx, smiles, unique_id = task
+    error = None
+    start = time.perf_counter()
+    for attempt in range(1, retries + 2):
+        try:
+            return idx, smiles, dock_fn(smiles, unique_id), attempt, None, time.perf_counter() - start
+        except subprocess.TimeoutExpired as err:
+            return (idx, smiles, failed_score, attempt, f'time budget exceeded ({err.timeout} s)',
+                    time.perf_counter() - start)
+        except Exception as err:
+            error = f'{type(err).__name__}: {err}'
+    return idx, smiles, failed_score, retries + 1, error, time.perf_counter() - start
+
+
+def _write_result(writer, f, progress, result, fields):
+    idx, smiles, score, attempts, error, seconds = result
+    writer.writerow([smiles, score] + list(fields.values()))
+    f.flush()
+    if error is not None:
+        print(f'Docking failed for {smiles} after {attempts} attempt(s) : {error}')
+    progress.update(error is not None, attempts, seconds)
+
+
+def run_docking(dock_fn, out_path, smiles=None, queue=None, n_workers=1, worker_id=0, retries=2, failed_score=0,
+                report_every=60, header=True, fields=None):
+    """
+    Docks ligands and appends one row (smile, score) per ligand to out_path as soon as it is docked.
+    dock_fn(smiles, unique_id) : docking function that raises on failure, ex. partial(dock, raise_errors=True, ...)
+    smiles : list of smiles, docked by a pool of n_workers processes that each take the next ligand when free
+    queue : DockingQueue shared with other processes, whose ligands are claimed one by one by this process
+    fields : {column: value} of constant columns added to each row (ex. the exhaustiveness)
+    Failed ligands get failed_score. Returns the Progress of this call (ligands docked, failures, docking time).
+    """
+    assert (smiles is None) != (queue is None), 'give either a list of smiles or a queue'
+    fields = fields or {}
+    new_file = not os.path.exists(out_path)
+    with open(out_path, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if header and new_file:
+            writer.writerow(['smile', 'score'] + list(fields))
+            f.flush()
+
+        if smiles is not None:
+            progress = Progress(len(smiles), report_every)
+            tasks = [(i, s, f'{worker_id}_{i}') for i, s in enumerate(smiles)]
+            if n_workers <= 1:
+                for task in tasks:
+                    _write_result(writer, f, progress, dock_with_retries(task, dock_fn, retries, failed_score),
+                                  fields)
+            else:
+                with Pool(n_workers) as pool:
+                    # chunksize 1 : each free worker takes the next ligand
+                    for result in pool.imap_unordered(partial(dock_with_retries, dock_fn=dock_fn, retries=retries,
+                                                              failed_score=failed_score), tasks, chunksize=1):
+                        _write_result(writer, f, progress, result, fields)
+            return progress
+
+        progress = Progress(queue.size, report_every)
+        progress.done = queue.size - queue.remaining()
+        while True:
+            claimed = queue.claim(worker_id)
+            if claimed is None:
+                break
+            idx, s = claimed
+            _write_result(writer, f, progress, dock_with_retries((idx, s, f'{worker_id}_{idx}'), dock_fn, retries,
+                                                                 failed_score), fields)
+            queue.done(idx)
+        return progress
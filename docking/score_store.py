@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk store of docking scores, shared by all runs (CbAS, BO, initial scores) and all their processes.
+Scores are keyed by (canonical smiles, target, exhaustiveness, vina version) in a SQLite database, in WAL mode so
+that many processes can read while one writes.
+
+Import an existing pickled dict {smiles: score} of mean scores (ex. optim/250k_docking_scores.pickle) :
+python docking/score_store.py --import_pickle optim/250k_docking_scores.pickle --target drd3 -e 16 --vina [vina_path]
+
+The scores are stored with the ligand preparation they were computed with (--ligand_prep, --etkdg, see
+settings_version) and are only reused by dockings with the same settings : the CbAS docker reads the scores of
+'--etkdg' (MGLTools preparation of RDKit conformers).
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+
+import numpy as np
+from rdkit import Chem
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+if __name__ == '__main__':
+    sys.path.append(os.path.join(script_dir, '..'))
+
+DEFAULT_PATH = os.path.join(script_dir, 'docking_scores.db')
+
+_VINA_VERSIONS = {}
+
+
+def vina_version(vina):
+    """ Version string of the vina executable ('1.1.2'), from vina --version, else from its install path """
+    if vina not in _VINA_VERSIONS:
+        try:
+            out = subprocess.run([vina, '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 timeout=30).stdout.decode()
+        except (OSError, subprocess.SubprocessError):
+            out = ''
+        match = re.search(r'(\d+)\.(\d+)\.(\d+)', out) or re.search(r'vina_(\d+)_(\d+)_(\d+)', str(vina))
+        _VINA_VERSIONS[vina] = '.'.join(match.groups()) if match else 'unknown'
+    return _VINA_VERSIONS[vina]
+
+
+def settings_version(version, ligand_prep='mgltools', etkdg=False):
+    """
+    Version of the docking settings in the store ('1.1.2/openbabel/etkdg') : vina version, ligand preparation if not
+    MGLTools, and 'etkdg' for RDKit conformers (conformer cache) instead of pybel make3D
+    """
+    version = version if ligand_prep == 'mgltools' else f'{version}/{ligand_prep}'
+    return version + '/etkdg' if etkdg else version
+
+
+def canonical(smiles):
+    """ RDKit canonical smiles, the smiles itself if it can't be parsed """
+    m = Chem.MolFromSmiles(smiles)
+    return smiles if m is None else Chem.MolToSmiles(m)
+
+
+class ScoreStore:
+    """
+    Docking scores of molecules : the list of pose scores given by vina for each (canonical smiles, target,
+    exhaustiveness, vina version). Each process opens its own connection, so a store can be passed to pool workers.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, timeout=120):
+        self.path = path
+        self.timeout = timeout
+        self._conn = None
+        self._pid = None
+        conn = self.conn
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS scores (smiles TEXT, target TEXT, exhaustiveness INTEGER, '
+                         'vina TEXT, poses TEXT, PRIMARY KEY (smiles, target, exhaustiveness, vina))')
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=self.timeout)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._pid = os.getpid()
+        return self._conn
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'], state['_pid'] = None, None
+        return state
+
+    def get_many(self, smiles, target, exhaustiveness, vina, mean=True, canonize=True):
+        """
+        Known scores of a list of smiles : {smiles: score} for the smiles found in the store, with score the mean
+        over poses if mean, else the list of pose scores.
+        """
+        keys = {}
+        for s in smiles:
+            keys.setdefault(canonical(s) if canonize else s, []).append(s)
+        found = {}
+        key_list = list(keys)
+        for i in range(0, len(key_list), 500):
+            chunk = key_list[i:i + 500]
+            rows = self.conn.execute(
+                f'SELECT smiles, poses FROM scores WHERE target=? AND exhaustiveness=? AND vina=? '
+                f'AND smiles IN ({",".join("?" * len(chunk))})', [target, int(exhaustiveness), vina] + chunk)
+            for key, poses in rows:
+                poses = json.loads(poses)
+                for s in keys[key]:
+                    found[s] = float(np.mean(poses)) if mean else poses
+        return found
+
+    def get(self, smiles, target, exhaustiveness, vina, mean=True):
+        """ Score of one smiles, None if it has not been docked with these settings """
+        return self.get_many([smiles], target, exhaustiveness, vina, mean=mean).get(smiles)
+
+    def put_many(self, scores, target, exhaustiveness, vina, canonize=True):
+        """ Adds {smiles: pose scores (list, or one mean score)} to the store, in one transaction """
+        rows = []
+        for s, poses in scores.items():
+            poses = [float(p) for p in np.atleast_1d(poses)]
+            rows.append((canonical(s) if canonize else s, target, int(exhaustiveness), vina, json.dumps(poses)))
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?)', rows)
+
+    def put(self, smiles, poses, target, exhaustiveness, vina):
+        self.put_many({smiles: poses}, target, exhaustiveness, vina)
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM scores').fetchone()[0]
+
+
+if __name__ == '__main__':
+    import pickle
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--import_pickle', type=str, help="pickled dict {smiles: mean docking score}")
+    parser.add_argument('--db', type=str, default=DEFAULT_PATH, help="path to the score store")
+    parser.add_argument('--target', type=str, default='drd3')
+    parser.add_argument('-e', '--ex', type=int, default=16, help="exhaustiveness of the imported scores")
+    parser.add_argument('--vina', type=str, default='1.1.2', help="vina executable or version of the imported scores")
+    parser.add_argument('--ligand_prep', type=str, default='mgltools',
+                        help="ligand preparation of the imported scores : 'mgltools' or 'openbabel'")
+    parser.add_argument('--etkdg', action='store_true', help="imported scores were docked from RDKit conformers")
+    args, _ = parser.parse_known_args()
+
+    store = ScoreStore(args.db)
+    if args.import_pickle is not None:
+        with open(args.import_pickle, 'rb') as f:
+            scores = pickle.load(f)
+        version = args.vina if re.fullmatch(r'[\d.]+', args.vina) else vina_version(args.vina)
+        version = settings_version(version, args.ligand_prep, args.etkdg)
+        store.put_many(scores, args.target, args.ex, version)
+        print(f'>>> Imported {len(scores)} scores ({args.target}, exhaustiveness {args.ex}, vina {version})')
+    print(f'{len(store)} scores in {args.db}')
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Validation of the in-process ligand preparation (docking/prepare_ligand.py) against the MGLTools subprocess
+(pythonsh prepare_ligand4.py -A hydrogens), on the same 3D conformers.
+For each reference ligand : number of atoms, AutoDock atom types, number of active torsions, partial charges of the
+atoms matched by coordinates, and with --dock the vina scores of both pdbqt files.
+Run from repo root.
+
+usage :
+python docking/validate_ligand_prep.py -s [server] -i [smiles.txt] --dock
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+if __name__ == '__main__':
+    sys.path.append(os.path.join(script_dir, '..'))
+
+from docking.docking import set_path
+from docking.prepare_ligand import embed_ligand, mol_to_pdbqt
+
+REFERENCE_LIGANDS = ['CC(=O)Oc1ccccc1C(=O)O',
+                     'CN1C=NC2=C1C(=O)N(C(=O)N2C)C',
+                     'CC(C)Cc1ccc(cc1)C(C)C(=O)O',
+                     'CC(=O)Nc1ccc(O)cc1',
+                     'COc1ccc2[nH]cc(CCN(C)C)c2c1',
+                     'CN1CCC[C@H]1c1cccnc1',
+                     'O=C1NC(=O)C(N1)(c1ccccc1)c1ccccc1',
+                     'CC1(C)S[C@@H]2[C@H](NC(=O)Cc3ccccc3)C(=O)N2[C@H]1C(=O)O',
+                     'FC(F)(F)c1ccc(OC(CCNC)c2ccccc2)cc1',
+                     'NC(=N)NCCC[C@H](N)C(=O)O',
+                     'CC1C2CCC(C2)C1CN(CCO)C(=O)c1ccc(Cl)cc1',
+                     'O=CC=C(C1C2=NC=C(C=NC3=CC=CC=C3N=C2)C=C1F)NC=C']
+
+
+def parse_pdbqt(pdbqt):
+    """ Coordinates (n_atoms * 3), partial charges, AutoDock types and number of active torsions of a pdbqt """
+    coords, charges, types, torsions = [], [], [], 0
+    for line in pdbqt.splitlines():
+        if line.startswith('ATOM') or line.startswith('HETATM'):
+            coords.append([float(line[30:38]), float(line[38:46]), float(line[46:54])])
+            charges.append(float(line[70:76]))
+            types.append(line[77:79].strip())
+        elif line.startswith('TORSDOF'):
+            torsions = int(line.split()[1])
+    return np.array(coords), np.array(charges), types, torsions
+
+
+def compare(reference, candidate):
+    """ Differences of candidate pdbqt to reference pdbqt """
+    ref_coords, ref_charges, ref_types, ref_tors = parse_pdbqt(reference)
+    coords, charges, types, tors = parse_pdbqt(candidate)
+    same_atoms = len(ref_types) == len(types)
+    max_charge_diff = float('nan')
+    if same_atoms:
+        # atoms in the same order ? match them by coordinates (both files come from the same conformer)
+        dist = np.linalg.norm(ref_coords[:, None, :] - coords[None, :, :], axis=2)
+        match = dist.argmin(axis=1)
+        if dist[np.arange(len(match)), match].max() < 1e-2:
+            max_charge_diff = float(np.abs(ref_charges - charges[match]).max())
+    return {'atoms': (len(ref_types), len(types)),
+            'types_equal': Counter(ref_types) == Counter(types),
+            'torsions': (ref_tors, tors),
+            'max_charge_diff': max_charge_diff}
+
+
+def vina_score(vina, pdbqt_path, target, exhaustiveness):
+    """ Best vina score of a prepared ligand """
+    out_path = pdbqt_path[:-6] + '_out.pdbqt'
+    cmd = f'{vina} --receptor {os.path.join(script_dir, "data_docking", target + ".pdbqt")} --ligand {pdbqt_path}' \
+          f' --config {os.path.join(script_dir, "data_docking", target + "_conf.txt")}' \
+          f' --exhaustiveness {exhaustiveness} --out {out_path} --cpu 1'
+    subprocess.run(cmd.split(), stdout=subprocess.DEVNULL, timeout=1200)
+    with open(out_path) as f:
+        return min(float(l.split()[3]) for l in f if l.startswith('REMARK VINA RESULT'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--server', default='mac', help="Server to run on, for pythonsh / vina paths")
+    parser.add_argument('-i', '--input', default=None, help="text file with one smiles per line, default : built-in set")
+    parser.add_argument('--dock', action='store_true', help="also dock both preparations and compare scores")
+    parser.add_argument('--target', default='drd3')
+    parser.add_argument('-e', '--ex', type=int, default=8, help="exhaustiveness for --dock")
+    args, _ = parser.parse_known_args()
+
+    pythonsh, vina = set_path(args.server)
+    if args.input is not None:
+        with open(args.input) as f:
+            ligands = [l.split()[0] for l in f if l.strip()]
+    else:
+        ligands = REFERENCE_LIGANDS
+
+    t_mgl, t_ob, n_ok = 0., 0., 0
+    score_diffs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, smile in enumerate(ligands):
+            mol = embed_ligand(smile)
+            mol2_path = os.path.join(tmp, f'{i}.mol2')
+            mgl_path, ob_path = os.path.join(tmp, f'{i}_mgl.pdbqt'), os.path.join(tmp, f'{i}_ob.pdbqt')
+            mol.write('mol2', mol2_path, overwrite=True)
+
+            start = time.perf_counter()
+            subprocess.run(f'{pythonsh} {os.path.join(script_dir, "prepare_ligand4.py")} -l {mol2_path} '
+                           f'-o {mgl_path} -A hydrogens'.split(), stdout=subprocess.DEVNULL, timeout=100)
+            t_mgl += time.perf_counter() - start
+
+            start = time.perf_counter()
+            ob_pdbqt = mol_to_pdbqt(mol)
+            t_ob += time.perf_counter() - start
+            with open(ob_path, 'w') as f:
+                f.write(ob_pdbqt)
+
+            with open(mgl_path) as f:
+                diff = compare(f.read(), ob_pdbqt)
+            ok = (diff['atoms'][0] == diff['atoms'][1] and diff['types_equal']
+                  and diff['torsions'][0] == diff['torsions'][1] and diff['max_charge_diff'] < 0.01)
+            n_ok += ok
+            line = f"{'OK  ' if ok else 'DIFF'} {smile} : atoms {diff['atoms']}, torsions {diff['torsions']}, " \
+                   f"types equal {diff['types_equal']}, max charge diff {diff['max_charge_diff']:.3f}"
+            if args.dock:
+                s_mgl = vina_score(vina, mgl_path, args.target, args.ex)
+                s_ob = vina_score(vina, ob_path, args.target, args.ex)
+                score_diffs.append(s_ob - s_mgl)
+                line += f', vina {s_mgl:.2f} / {s_ob:.2f}'
+            print(line)
+
+    n = len(ligands)
+    print(f'>>> {n_ok}/{n} ligands with identical atoms, types, torsions and charges (< 0.01 e)')
+    print(f'prepare_ligand4.py subprocess : {t_mgl / n:.3f} s per ligand, in process : {t_ob / n:.3f} s per ligand')
+    if args.dock:
+        d = np.array(score_diffs)
+        print(f'vina score difference (in process - MGLTools) : mean {d.mean():.2f}, mean abs {np.abs(d).mean():.2f}, '
+              f'max abs {np.abs(d).max():.2f} kcal/mol')
@@ -90,15 +90,15 @@ if __name__ == '__main__':
 
         if args.vocab == 'smiles':
             print('>>> Decoding to smiles')
-            decoded = model.decode(torch.tensor(z, dtype=torch.float32).to(device))
-            smiles_out = model.probas_to_smiles(decoded)
+            decoded = model.decode_indices(torch.tensor(z, dtype=torch.float32).to(device))
+            smiles_out = model.indices_to_smiles(decoded)
             for s in smiles_out:
                 print(s)
 
         elif args.vocab == 'selfies':
             print('>>> Decoding to selfies')
-            decoded = model.decode(torch.tensor(z, dtype=torch.float32).to(device))
-            selfies = model.probas_to_smiles(decoded)
+            decoded = model.decode_indices(torch.tensor(z, dtype=torch.float32).to(device))
+            selfies = model.indices_to_smiles(decoded)
             smiles = [decoder(s) for s in selfies]
 
             for s in smiles:
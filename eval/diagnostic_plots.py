@@ -249,8 +249,8 @@ if __name__ == "__main__":
         plt.title('Random normal samples in PCA space')
 
         # Decode 
-        out = model.decode(r)
-        selfies = model.probas_to_smiles(out)
+        out = model.decode_indices(r)
+        selfies = model.indices_to_smiles(out)
         s = [decoder(se) for se in selfies]
 
         # Unique smiles 
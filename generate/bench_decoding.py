@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the decoding modes of a trained model : molecules decoded per second for a range of batch sizes.
+Run from repo root.
+
+usage :
+python generate/bench_decoding.py --name [name_of_the_model] -b 1 64 1024 --modes greedy greedy_stop indices beam
+
+Stochastic decoding vs greedy, in unique valid molecules per second (decoding + selfies decoding + RDKit) :
+python generate/bench_decoding.py --name [name_of_the_model] -b 1024 --modes indices sampled --temperature 1. --top_p 0.9 --unique
+
+"""
+import os
+import sys
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+if __name__ == "__main__":
+    sys.path.append(os.path.join(script_dir, '..'))
+
+import argparse
+import time
+
+import torch
+
+
+def greedy(model, z, args):
+    return model.decode(z)
+
+
+def greedy_stop(model, z, args):
+    return model.decode(z, stop_on_pad=True)
+
+
+def indices(model, z, args):
+    return model.decode_indices(z, stop_on_pad=True)
+
+
+def beam(model, z, args):
+    return model.decode_beam(z, k=args.beam_width)
+
+
+def sampled(model, z, args):
+    return model.decode_indices(z, stop_on_pad=True, temperature=args.temperature, top_k=args.top_k,
+                                top_p=args.top_p)
+
+
+MODES = {'greedy': greedy,
+         'greedy_stop': greedy_stop,
+         'indices': indices,
+         'beam': beam,
+         'sampled': sampled}
+INDICES_MODES = ('indices', 'sampled')
+
+
+def unique_valid(fn, model, z, args):
+    """ Decodes z with fn, returns the number of unique valid canonical smiles and the total wall time """
+    start = time.perf_counter()
+    with torch.no_grad():
+        out = fn(model, z, args)
+    smiles = set()
+    for s in decoder_indices(out, model.index_to_char):
+        m = Chem.MolFromSmiles(s)
+        if m is not None:
+            smiles.add(Chem.MolToSmiles(m))
+    return len(smiles), time.perf_counter() - start
+
+
+def time_mode(fn, model, z, args):
+    """ Returns best wall time over args.repeats runs of fn (after one warmup run) """
+    with torch.no_grad():
+        fn(model, z, args)
+        times = []
+        for _ in range(args.repeats):
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            fn(model, z, args)
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+    from rdkit import Chem
+    from model import model_from_json
+    from selfies import decoder_indices
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--name', help="Saved model directory, in /results/saved_models",
+                        default='inference_default')
+    parser.add_argument('-b', '--batch_sizes', type=int, nargs='+', default=[1, 16, 128, 1024])
+    parser.add_argument('--modes', nargs='+', default=list(MODES.keys()), choices=list(MODES.keys()))
+    parser.add_argument('-k', '--beam_width', type=int, default=3)
+    parser.add_argument('-t', '--temperature', type=float, default=1.)  # for sampled mode
+    parser.add_argument('--top_k', type=int, default=0)  # for sampled mode, 0 : no truncation
+    parser.add_argument('--top_p', type=float, default=1.)  # for sampled mode, 1 : no truncation
+    parser.add_argument('--unique', action='store_true',
+                        help="also report unique valid molecules per second for indices and sampled modes")
+    parser.add_argument('-r', '--repeats', type=int, default=3)
+    parser.add_argument('--cpu', action='store_true', help="run on cpu even if cuda is available")
+    args, _ = parser.parse_known_args()
+
+    device = 'cuda' if torch.cuda.is_available() and not args.cpu else 'cpu'
+    model = model_from_json(args.name)
+    model.to(device)
+    model.eval()
+
+    print(f'>>> Decoding benchmark on {device}, alphabet size {model.voc_size}, max_len {model.max_len}')
+    print(f"{'batch':>8} " + ' '.join(f'{m + " (mol/s)":>20}' for m in args.modes))
+    for batch_size in args.batch_sizes:
+        torch.manual_seed(0)
+        z = model.sample_z_prior(batch_size)
+        rates = [batch_size / time_mode(MODES[m], model, z, args) for m in args.modes]
+        print(f'{batch_size:>8} ' + ' '.join(f'{r:>20.1f}' for r in rates))
+
+        if 'greedy_stop' in args.modes:
+            # Early terminating decoding should reproduce the molecules of the full greedy unroll
+            with torch.no_grad():
+                full = torch.max(model.decode(z), dim=1)[1]
+                stopped = torch.max(model.decode(z, stop_on_pad=True), dim=1)[1]
+            full, stopped = (decoder_indices(x, model.index_to_char, PrintErrorMessage=False) for x in (full, stopped))
+            identical = sum(a == b for a, b in zip(full, stopped)) / batch_size
+            print(f'{"":>8} greedy_stop: {100 * identical:.2f}% molecules identical to greedy')
+
+        if args.unique:
+            for m in args.modes:
+                if m not in INDICES_MODES:
+                    continue
+                n_unique, wall = unique_valid(MODES[m], model, z, args)
+                print(f'{"":>8} {m}: {n_unique}/{batch_size} unique valid molecules, {n_unique / wall:.1f} per second')
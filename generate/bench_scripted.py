@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the TorchScript sampler against eager decoding (Model.decode_indices) on CPU :
+molecules decoded per second for batch sizes 1 to 4096. Checks that both return the same indices.
+Run from repo root.
+
+usage :
+python generate/bench_scripted.py --name [name_of_the_model] -b 1 16 256 4096
+
+"""
+import os
+import sys
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+if __name__ == "__main__":
+    sys.path.append(os.path.join(script_dir, '..'))
+
+import argparse
+import time
+
+import torch
+
+
+def best_time(fn, z, repeats):
+    """ Best wall time over repeats runs of fn(z), after one warmup run """
+    with torch.no_grad():
+        fn(z)
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn(z)
+            times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+    from model import model_from_json
+    from scripted_sampler import script_sampler
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--name', help="Saved model directory, in /results/saved_models",
+                        default='inference_default')
+    parser.add_argument('-b', '--batch_sizes', type=int, nargs='+', default=[1, 4, 16, 64, 256, 1024, 4096])
+    parser.add_argument('-r', '--repeats', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=0, help="torch cpu threads, 0 : torch default")
+    args, _ = parser.parse_known_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    model = model_from_json(args.name)
+    model.cpu()
+    model.eval()
+    sampler = script_sampler(model)
+
+    def eager(z):
+        return model.decode_indices(z, stop_on_pad=True)
+
+    print(f'>>> Eager vs TorchScript decoding on cpu, {torch.get_num_threads()} threads')
+    print(f"{'batch':>8} {'eager (mol/s)':>16} {'script (mol/s)':>16} {'speedup':>8} {'identical':>10}")
+    for batch_size in args.batch_sizes:
+        torch.manual_seed(0)
+        z = model.sample_z_prior(batch_size)
+        t_eager = best_time(eager, z, args.repeats)
+        t_script = best_time(sampler, z, args.repeats)
+        with torch.no_grad():
+            identical = torch.equal(eager(z), sampler(z))
+        print(f'{batch_size:>8} {batch_size / t_eager:>16.1f} {batch_size / t_script:>16.1f} '
+              f'{t_eager / t_script:>8.2f} {str(identical):>10}')
@@ -34,7 +34,7 @@ if __name__ == "__main__":
     from data_processing.rdkit_to_nx import smiles_to_nx
     from model import Model, model_from_json
     from utils import *
-    from selfies import decoder, encoder
+    from selfies import decoder, decoder_indices, encoder
     from data_processing.get_selfies import clean_smiles
 
     parser = argparse.ArgumentParser()
@@ -43,7 +43,12 @@ if __name__ == "__main__":
     parser.add_argument('-N', "--n_mols", help="Nbr to generate", type=int, default=10000)
     parser.add_argument('-v', '--vocab', default='selfies')  # vocab used by model
     parser.add_argument('-o', '--output_file', type=str, default='data/gen_2.txt')
-    parser.add_argument('-b', '--use_beam', action='store_true', help="use beam search (slow!)")
+    parser.add_argument('-b', '--use_beam', action='store_true', help="use beam search")
+    parser.add_argument('-k', '--beam_width', type=int, default=3, help="beam width when using beam search")
+    parser.add_argument('--scripted', action='store_true', help="decode with the TorchScript sampler")
+    parser.add_argument('--sampler_path', type=str, default=None,
+                        help="exported TorchScript sampler to load (see scripted_sampler.py), implies --scripted")
+    parser.add_argument('-j', '--n_jobs', type=int, default=1, help="processes decoding selfies")
     parser.add_argument('--qed', action='store_true', help="plot qed distrib")
     parser.add_argument('--reencode', action='store_true')
 
@@ -56,6 +61,14 @@ if __name__ == "__main__":
     model = model_from_json(args.name)
     model.to(device)
 
+    sampler = None
+    if args.sampler_path is not None:
+        sampler = torch.jit.load(args.sampler_path, map_location=device)
+    elif args.scripted:
+        from scripted_sampler import script_sampler
+        model.eval()
+        sampler = script_sampler(model)
+
     set_compounds = set()
     cpt = 0
     b = 0
@@ -72,28 +85,41 @@ if __name__ == "__main__":
         while b < 10 * n_batches and len(set_compounds) < args.n_mols:
             b += 1
             z = model.sample_z_prior(batch_size)
-            gen_seq = model.decode(z)
 
             # Sequence of ints to smiles 
             if not args.use_beam:
-                selfies = model.probas_to_smiles(gen_seq)
+                if sampler is not None:
+                    indices = sampler(z)
+                else:
+                    indices = model.decode_indices(z, stop_on_pad=True)
+                # decode and parse identical sequences only once, inverse maps them back to the batch rows
+                unique_indices, _, inverse = unique_rows(indices)
+                if args.vocab == 'selfies':
+                    smiles = decoder_indices(unique_indices, model.index_to_char, bilocal_ring_function=True,
+                                             n_jobs=args.n_jobs)
+                else:
+                    smiles = model.indices_to_smiles(unique_indices)
             else:
-                selfies = model.beam_out_to_smiles(gen_seq)
-
-            if args.vocab == 'selfies':
-                smiles = [decoder(s, bilocal_ring_function=True) for s in selfies]
+                beams = model.decode_beam(z, k=args.beam_width)
+                selfies = model.beam_out_to_smiles(beams)
+                inverse = np.arange(len(selfies))
+                smiles = selfies
+                if args.vocab == 'selfies':
+                    smiles = [decoder(s, bilocal_ring_function=True) for s in selfies]
 
             # print(selfies[:10])
             # print(smiles[:10])
 
-            mols = [Chem.MolFromSmiles(s) for s in smiles]
+            unique_mols = [Chem.MolFromSmiles(s) if isinstance(s, str) else None for s in smiles]  # -1 : not decoded
+            unique_can = [Chem.MolToSmiles(m) if m is not None else None for m in unique_mols]
+            mols = [unique_mols[j] for j in inverse]
             can_smile = list()
-            for i, m in enumerate(mols):
-                if m == None:
+            for j in inverse:
+                if unique_can[j] is None:
                     pass
                 else:
                     cpt += 1
-                    can_smile.append(Chem.MolToSmiles(m))
+                    can_smile.append(unique_can[j])
             list_all.extend(can_smile)
             set_can = set(can_smile)
             set_compounds = set_compounds.union(set_can)
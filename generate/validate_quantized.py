@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Validation of the dynamic int8 quantized decoder against the fp32 model, on cpu, on samples from the prior :
+token and sequence agreement of greedy decoding, validity and uniqueness rates, decoding speed.
+Run from repo root.
+
+usage :
+python generate/validate_quantized.py --name [name_of_the_model] -N 10000
+
+"""
+import os
+import sys
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+if __name__ == "__main__":
+    sys.path.append(os.path.join(script_dir, '..'))
+
+import argparse
+import time
+
+import torch
+from rdkit import Chem
+
+
+def decode_all(model, z, batch_size):
+    """ Greedy decoding of z by batches, returns indices and wall time """
+    indices = []
+    start = time.perf_counter()
+    for i in range(0, z.shape[0], batch_size):
+        indices.append(model.decode_indices(z[i:i + batch_size], stop_on_pad=True))
+    return torch.cat(indices), time.perf_counter() - start
+
+
+def valid_smiles(model, indices):
+    """ Canonical smiles of the decoded sequences, None for invalid ones """
+    smiles = []
+    for s in decoder_indices(indices, model.index_to_char):
+        m = Chem.MolFromSmiles(s)
+        smiles.append(Chem.MolToSmiles(m) if m is not None else None)
+    return smiles
+
+
+if __name__ == "__main__":
+    from model import model_from_json
+    from selfies import decoder_indices
+    from utils import disable_rdkit_logging
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--name', help="Saved model directory, in /results/saved_models",
+                        default='inference_default')
+    parser.add_argument('-N', '--n_mols', type=int, default=10000)
+    parser.add_argument('-b', '--batch_size', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=0, help="torch cpu threads, 0 : torch default")
+    args, _ = parser.parse_known_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    disable_rdkit_logging()
+
+    model = model_from_json(args.name)
+    model.cpu()
+    model.eval()
+    qmodel = model_from_json(args.name, quantized=True)
+
+    torch.manual_seed(0)
+    z = model.sample_z_prior(args.n_mols)
+    with torch.no_grad():
+        ref, t_ref = decode_all(model, z, args.batch_size)
+        q, t_q = decode_all(qmodel, z, args.batch_size)
+
+    # Agreement is measured up to the end of the fp32 sequence (padding included once)
+    pad = model.pad_index
+    if pad is not None:
+        ends = torch.where(ref == pad, torch.arange(ref.shape[1]).expand_as(ref), torch.full_like(ref, ref.shape[1] - 1))
+        mask = torch.arange(ref.shape[1]).unsqueeze(0) <= ends.min(dim=1, keepdim=True)[0]
+    else:
+        mask = torch.ones_like(ref, dtype=torch.bool)
+    token_agreement = ((ref == q) & mask).sum().item() / mask.sum().item()
+    seq_agreement = torch.all(ref == q, dim=1).float().mean().item()
+
+    ref_smiles, q_smiles = valid_smiles(model, ref), valid_smiles(qmodel, q)
+    print(f'>>> fp32 vs int8 dynamic quantized decoder, {args.n_mols} prior samples, {torch.get_num_threads()} threads')
+    print(f'token agreement : {100 * token_agreement:.2f}%')
+    print(f'sequence agreement : {100 * seq_agreement:.2f}%')
+    print(f'same molecule : {100 * sum(a == b for a, b in zip(ref_smiles, q_smiles)) / args.n_mols:.2f}%')
+    for label, smiles, t in (('fp32', ref_smiles, t_ref), ('int8', q_smiles, t_q)):
+        valid = [s for s in smiles if s is not None]
+        print(f'{label} : {100 * len(valid) / args.n_mols:.2f}% valid, {100 * len(set(valid)) / args.n_mols:.2f}% unique,'
+              f' {args.n_mols / t:.1f} mol/s')
+    print(f'speedup : {t_ref / t_q:.2f}')
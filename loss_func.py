@@ -15,17 +15,35 @@ import torch.nn.functional as F
 
 # ======================= Loss functions ====================================
 
-def VAELoss(out, indices, mu, logvar):
+def VAELoss(out, indices, mu, logvar, pad_index=None):
     """ 
     plain VAE loss. 
+    pad_index : if given, the reconstruction loss of each row stops at the first padding char after its last
+    non padding char, so that it does not depend on the padding columns the batch was trimmed to (utils.trim_padding)
     """
-    CE = F.cross_entropy(out, indices, reduction="sum")
+    if pad_index is None:
+        CE = F.cross_entropy(out, indices, reduction="sum")
+    else:
+        CE = F.cross_entropy(out, indices, reduction="none")
+        CE = torch.sum(CE[sequence_mask(indices, pad_index)])
     KL = -0.5 * torch.sum(1 + logvar - mu.pow(2) - logvar.exp())
 
     # returns zeros for multitask loss terms
     return CE, KL
 
 
+def sequence_mask(indices, pad_index):
+    """
+    (batch_size * seq_len) mask of the chars of each row up to the first padding char after its last non padding
+    char (padding chars read as ring lengths or branch sizes are kept), as kept by utils.trim_padding
+    """
+    seq_len = indices.shape[1]
+    not_pad = indices != pad_index
+    lengths = seq_len - torch.argmax(not_pad.flip(1).int(), dim=1)
+    lengths[~not_pad.any(dim=1)] = 0
+    return torch.arange(seq_len, device=indices.device).unsqueeze(0) <= lengths.unsqueeze(1)
+
+
 def weightedPropsLoss(p_target, p_pred, weights):
     """
     Weighted loss for chemical properties. N_properties = p_target.shape[1]. 
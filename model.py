@@ -16,7 +16,6 @@ https://docs.dgl.ai/tutorials/models/1_gnn/4_rgcn.html#sphx-glr-tutorials-models
 import os
 import sys
 import numpy as np
-from queue import PriorityQueue
 import json
 from rdkit import Chem
 import time
@@ -36,6 +35,7 @@ from dgl.nn.pytorch.conv import GATConv, RelGraphConv
 
 from utils import *
 from dgl_utils import send_graph_to_device
+from selfies import derivation_tables, derivation_ended
 
 import torch.jit as jit
 from torch.nn import Parameter
@@ -129,6 +129,8 @@ class MultiLSTM(nn.Module):
 
     def forward(self, x, h):
         """ Forward pass to 3-layer GRU. Output =  output, hidden state of layer 3 """
+        if x.dtype == torch.long:  # char indices, no lookup in the layernorm cells
+            x = F.one_hot(x, self.gru_1.input_size).float()
         x = x.view(x.shape[0], -1)  # batch_size *
         h_out = [0] * 3
 
@@ -162,6 +164,7 @@ class MultiGRU(nn.Module):
         self.drop = nn.Dropout(p)
 
         self.use_batchNorm = batchNorm
+        self.quantized = False  # see quantize
 
         self.gru_1 = nn.GRUCell(voc_size, self.h_size)
         self.gru_2 = nn.GRUCell(self.h_size, self.h_size)
@@ -178,20 +181,79 @@ class MultiGRU(nn.Module):
         return next(self.parameters()).device
 
     def forward(self, x, h):
-        """ Forward pass to 3-layer GRU. Output =  output, hidden state of layer 3 """
-        x = x.view(x.shape[0], -1)  # batch_size *
-        h_out = torch.zeros(h.size()).to(self.device)
-        x = h_out[0] = self.gru_1(x, h[0])
+        """
+        Forward pass to 3-layer GRU. Output =  output, hidden state of layer 3
+        x is either a batch of dense inputs (batch_size * voc_size) or a LongTensor of char indices (batch_size)
+        """
+        if x.dtype == torch.long and not self.quantized:
+            x = h_1 = self.gru_1_lookup(x, h[0])
+        else:
+            if x.dtype == torch.long:  # quantized cells have no weight_ih to look up
+                x = F.one_hot(x, self.gru_1.input_size).float()
+            x = x.view(x.shape[0], -1)  # batch_size *
+            x = h_1 = self.gru_1(x, h[0])
         if self.use_batchNorm:
             x = self.BN1(x)
-        x = h_out[1] = self.gru_2(x, h[1])
+        x = h_2 = self.gru_2(x, h[1])
         if self.use_batchNorm:
             x = self.BN2(x)
-        x = h_out[2] = self.gru_3(x, h[2])
+        x = h_3 = self.gru_3(x, h[2])
         if self.use_batchNorm:
             x = self.BN3(x)
         x = self.linear(x)
-        return x, h_out
+        return x, torch.stack((h_1, h_2, h_3))
+
+    def gru_1_lookup(self, indices, h):
+        """
+        Step of the first GRU cell for one-hot inputs given as char indices : the input matmul is replaced by a lookup
+        of the corresponding columns of weight_ih. Same result as self.gru_1(one_hot(indices), h)
+        """
+        gi = F.embedding(indices, self.gru_1.weight_ih.t()) + self.gru_1.bias_ih
+        gh = F.linear(h, self.gru_1.weight_hh, self.gru_1.bias_hh)
+        i_r, i_z, i_n = gi.chunk(3, 1)
+        h_r, h_z, h_n = gh.chunk(3, 1)
+        resetgate = torch.sigmoid(i_r + h_r)
+        inputgate = torch.sigmoid(i_z + h_z)
+        newgate = torch.tanh(i_n + resetgate * h_n)
+        return newgate + inputgate * (h - newgate)
+
+    @property
+    def can_run_sequence(self):
+        # Batch statistics are computed per step in training mode, which a whole sequence pass can't reproduce
+        return not (self.use_batchNorm and self.training) and not self.quantized
+
+    def forward_sequence(self, x, h):
+        """
+        Runs the 3 GRU layers over a whole known input sequence, in one fused multi-layer GRU call,
+        with the weights of the GRU cells. Same outputs as calling forward step by step.
+        x : batch_size * seq_len * voc_size
+        Output = output (batch_size * seq_len * voc_size), hidden state of the 3 layers at the last step
+        """
+        if self.use_batchNorm:  # eval mode, batchnorm is an affine transform applied between layers
+            h_out = []
+            for i, (gru, bn) in enumerate(((self.gru_1, self.BN1), (self.gru_2, self.BN2), (self.gru_3, self.BN3))):
+                weights = [gru.weight_ih, gru.weight_hh, gru.bias_ih, gru.bias_hh]
+                x, h_i = torch._VF.gru(x, h[i:i + 1].contiguous(), weights, True, 1, 0.0, self.training, False, True)
+                x = bn(x.transpose(1, 2)).transpose(1, 2)
+                h_out.append(h_i)
+            return self.linear(x), torch.cat(h_out, dim=0)
+
+        weights = []
+        for gru in (self.gru_1, self.gru_2, self.gru_3):
+            weights += [gru.weight_ih, gru.weight_hh, gru.bias_ih, gru.bias_hh]
+        x, h_out = torch._VF.gru(x, h.contiguous(), weights, True, 3, 0.0, self.training, False, True)
+        return self.linear(x), h_out
+
+    def quantize(self):
+        """
+        Dynamic int8 quantization of the GRU cells and linear layers, for cpu inference only.
+        Weights are quantized once, activations at each step. Returns the quantized decoder (in eval mode).
+        """
+        qconfig = torch.quantization.default_dynamic_qconfig
+        layers = ('dense_init', 'gru_1', 'gru_2', 'gru_3', 'linear')
+        decoder = torch.quantization.quantize_dynamic(self.cpu().eval(), {l: qconfig for l in layers})
+        decoder.quantized = True
+        return decoder
 
     def init_h(self, z):
         """ Initializes hidden state for 3 layers GRU with latent vector z """
@@ -379,12 +441,18 @@ class Model(nn.Module):
         # Returns predicted properties
         return self.MLP(z)
 
-    def decode(self, z, x_true=None, teacher_forced=0.0):
+    def decode(self, z, x_true=None, teacher_forced=0.0, stop_on_pad=False):
         """
             Unrolls decoder RNN to generate a batch of sequences, using teacher forcing
             Args:
                 z: (batch_size * latent_shape) : a sampled vector in latent space
-                x_true: (batch_size * sequence_length ) a batch of indices of sequences
+                x_true: (batch_size * sequence_length ) a batch of indices of sequences. If given, the decoder is
+                    unrolled over sequence_length steps (can be shorter than max_len, see utils.trim_padding)
+                stop_on_pad: inference only. Rows that emit the padding char once their selfies derivation has ended
+                    (see selfies.derivation_ended) are removed from the decoded batch, and decoding stops once all rows
+                    are finished. The logits of the step where a row finished are repeated over its remaining steps,
+                    so that the argmax is padding until the end of the sequence. Decodes to the same smiles as the
+                    full unroll.
             Outputs:
                 gen_seq : (batch_size * voc_size* seq_length) a batch of generated sequences (probas)
 
@@ -392,7 +460,7 @@ class Model(nn.Module):
         batch_size = z.shape[0]
         # ls= z.shape[1]
         # print('batch size is', batch_size, 'latent size is ', ls)
-        seq_length = self.max_len
+        seq_length = self.max_len if x_true is None else x_true.shape[1]
         # Create first input to RNN : start token is full of zeros
         start_token = self.rnn_in(z).view(batch_size, self.voc_size)
         # start_token = self.rnn_in(z).view(batch_size, 1, self.voc_size)
@@ -402,18 +470,47 @@ class Model(nn.Module):
 
         gen_seq = torch.zeros(batch_size, self.voc_size, seq_length).to(self.device)
 
+        if stop_on_pad and teacher_forced > 0.0:
+            raise ValueError('stop_on_pad decoding is for inference only, use teacher_forced=0')
+
+        if teacher_forced >= 1.0 and getattr(self.decoder, 'can_run_sequence', False):
+            # All inputs are known in advance : run the decoder over the whole sequence at once
+            inputs = F.one_hot(x_true[:, :-1], self.voc_size).float()
+            inputs = torch.cat((rnn_in.unsqueeze(1), inputs), dim=1)  # batch_size * seq_length * voc_size
+            out, _ = self.decoder.forward_sequence(inputs, h)
+            return out.transpose(1, 2)  # probas
+        pad = self.pad_index if stop_on_pad else None
+        active = torch.arange(batch_size, device=self.device)  # rows of gen_seq still being decoded
+        if pad is not None:
+            tables = derivation_tables(self.index_to_char)
+            tokens = torch.full((batch_size, seq_length), pad, dtype=torch.long, device=self.device)
+
         # tback = time.perf_counter()
 
         for step in range(seq_length):
             out, h = self.decoder(rnn_in, h)
-            gen_seq[:, :, step] = out
 
-            if teacher_forced > 0.0 and np.random.rand() < teacher_forced:  # proba of teacher forcing
-                indices = x_true[:, step]
+            if pad is not None:
+                gen_seq[active, :, step] = out
+                v, indices = torch.max(out, dim=1)
+                tokens[active, step] = indices
+                finished = self._finished_rows(indices == pad, tokens, active, step + 1, tables)
+                if finished.any():
+                    gen_seq[active[finished], :, step + 1:] = out[finished].unsqueeze(2)
+                    keep = torch.nonzero(~finished).squeeze(1)
+                    if keep.numel() == 0:
+                        break
+                    active, indices = active[keep], indices[keep]
+                    h = self._reorder_h(h, keep)
             else:
-                v, indices = torch.max(gen_seq[:, :, step], dim=1)  # get char indices with max probability
+                gen_seq[:, :, step] = out
+
+                if teacher_forced > 0.0 and np.random.rand() < teacher_forced:  # proba of teacher forcing
+                    indices = x_true[:, step]
+                else:
+                    v, indices = torch.max(gen_seq[:, :, step], dim=1)  # get char indices with max probability
             # Input to next step: either autoregressive or Teacher forced
-            rnn_in = F.one_hot(indices, self.voc_size).float()
+            rnn_in = indices
 
         # if torch.cuda.is_available():
         #   torch.cuda.synchronize()
@@ -421,6 +518,113 @@ class Model(nn.Module):
 
         return gen_seq  # probas
 
+    def sequence_logprob(self, z, x, lengths=None):
+        """
+            Log-likelihood of given sequences, log p(x|z) : x is teacher forced through the decoder in a single pass,
+            and the log-probabilities of its chars are gathered by index.
+            Args:
+                z: (batch_size * latent_shape) latent points
+                x: (batch_size * seq_length) LongTensor of char indices
+                lengths: (batch_size) if given, only the first lengths[i] chars of row i are scored
+            Outputs:
+                logprob_x : (batch_size) sequences log-likelihoods
+        """
+        out = self.decode(z, x, teacher_forced=1.0)
+        logprobs = F.log_softmax(out, dim=1)  # shape is (N, num_chars_in_alphbabet, sequence_len)
+        logprobs = logprobs.gather(1, x.unsqueeze(1)).squeeze(1)
+        if lengths is not None:
+            positions = torch.arange(x.shape[1], device=logprobs.device)
+            logprobs = logprobs.masked_fill(positions.unsqueeze(0) >= lengths.to(logprobs.device).unsqueeze(1), 0.)
+        return torch.sum(logprobs, dim=1)
+
+    @torch.no_grad()
+    def decode_indices(self, z, stop_on_pad=False, return_logprobs=False, temperature=0., top_k=0, top_p=1.):
+        """
+            Decoding that only keeps the decoded char indices : the (batch_size * voc_size * seq_length)
+            tensor of logits returned by decode is never built. Inference only.
+            Greedy by default, chars are sampled if temperature > 0.
+            Args:
+                z: (batch_size * latent_shape) : a sampled vector in latent space
+                stop_on_pad: early terminating decoding, see decode
+                return_logprobs: also return the sum of log-probabilities of the decoded chars
+                temperature: if > 0, chars are sampled from softmax(logits / temperature)
+                top_k: if > 0, sample only among the top_k most likely chars
+                top_p: if < 1, sample only among the smallest set of most likely chars with cumulated proba >= top_p
+            Outputs:
+                indices : (batch_size * seq_length) LongTensor of char indices
+                logprobs (if return_logprobs) : (batch_size) sequences log-probabilities. When sampling, these are
+                    the exact log-probabilities under the distribution the chars were drawn from (after temperature and
+                    truncation). With stop_on_pad, greedy or sampled, the padding after the char where a row finished
+                    has proba 1 : sequence_logprob(z, indices, decoded_lengths(indices)) scores the same chars.
+        """
+        batch_size = z.shape[0]
+        seq_length = self.max_len
+        rnn_in = self.rnn_in(z).view(batch_size, self.voc_size)
+        h = self.decoder.init_h(z)
+        sampling = temperature > 0
+
+        pad = self.pad_index if stop_on_pad else None
+        tables = derivation_tables(self.index_to_char) if pad is not None else None
+        indices = torch.full((batch_size, seq_length), pad if pad is not None else 0, dtype=torch.long,
+                             device=self.device)
+        logprobs = torch.zeros(batch_size, device=self.device)
+        active = torch.arange(batch_size, device=self.device)  # rows still being decoded
+
+        for step in range(seq_length):
+            out, h = self.decoder(rnn_in, h)
+            if sampling:
+                chars, step_logprobs = self.sample_chars(out, temperature, top_k, top_p)
+                logprobs[active] += step_logprobs
+            elif return_logprobs:
+                step_logprobs, chars = torch.max(F.log_softmax(out, dim=1), dim=1)
+                logprobs[active] += step_logprobs
+            else:
+                _, chars = torch.max(out, dim=1)
+            indices[active, step] = chars
+
+            if pad is not None:
+                finished = self._finished_rows(chars == pad, indices, active, step + 1, tables)
+                if finished.any():
+                    keep = torch.nonzero(~finished).squeeze(1)
+                    if keep.numel() == 0:
+                        break
+                    active, chars = active[keep], chars[keep]
+                    h = self._reorder_h(h, keep)
+            rnn_in = chars
+
+        if return_logprobs:
+            return indices, logprobs
+        return indices
+
+    @staticmethod
+    def sample_chars(logits, temperature=1., top_k=0, top_p=1.):
+        """
+        Samples one char per row of logits (batch_size * voc_size), with temperature, top-k and nucleus (top-p)
+        truncation. Returns the sampled chars and their log-probabilities under the truncated distribution.
+        """
+        logprobs = F.log_softmax(logits / temperature, dim=1)
+        if 0 < top_k < logprobs.shape[1]:
+            kth_best = torch.topk(logprobs, top_k, dim=1)[0][:, -1:]
+            logprobs = logprobs.masked_fill(logprobs < kth_best, float('-inf'))
+        if top_p < 1.:
+            sorted_logprobs, sorted_idx = torch.sort(logprobs, dim=1, descending=True)
+            sorted_probs = sorted_logprobs.exp()
+            # drop chars once the cumulated proba of the more likely ones reaches top_p (the best char is always kept)
+            drop = (torch.cumsum(sorted_probs, dim=1) - sorted_probs) >= top_p
+            drop = torch.zeros_like(logprobs).scatter(1, sorted_idx, drop.float()) > 0
+            logprobs = logprobs.masked_fill(drop, float('-inf'))
+        logprobs = F.log_softmax(logprobs, dim=1)  # renormalize after truncation
+        chars = torch.multinomial(logprobs.exp(), 1)
+        return chars.squeeze(1), logprobs.gather(1, chars).squeeze(1)
+
+    @property
+    def pad_index(self):
+        # Index of the selfies padding char, None if the alphabet has no padding char (smiles)
+        for idx, char in self.index_to_char.items():
+            if char == '[epsilon]':
+                return int(idx)
+        return None
+
     def probas_to_smiles(self, gen_seq):
         # Takes tensor of shape (N, voc_size, seq_len), returns list of corresponding smiles
         N, voc_size, seq_len = gen_seq.shape
@@ -457,66 +661,112 @@ class Model(nn.Module):
         return smiles
 
     def beam_out_to_smiles(self, indices):
-        """ Takes array of possibilities : (N, k_beam, sequences_length)  returned by decode_beam"""
+        """
+        Takes array of possibilities : (N, k_beam, sequences_length)  returned by decode_beam
+        Returns, for each molecule, the highest scoring beam that decodes to a valid molecule (or the top beam if none
+        of them is valid). Beams that the selfies decoder can't read (-1) are not valid.
+        """
         N, k_beam, length = indices.shape
+        beams = self.indices_to_smiles(indices.reshape(N * k_beam, length))
+        is_selfies = '[epsilon]' in self.index_to_char.values()
         smiles = []
         for i in range(N):
-            k, m = 0, None
-            while (k < 2 and m == None):
-                smi = ''.join([self.index_to_char[str(idx)] for idx in indices[i, k]])
-                smi = smi.rstrip()
-                m = Chem.MolFromSmiles(smi)
-                k += 1
+            candidates = beams[i * k_beam:(i + 1) * k_beam]
+            smi = candidates[0]
+            for c in candidates:
+                decoded = decoder(c) if is_selfies else c
+                m = Chem.MolFromSmiles(decoded) if isinstance(decoded, str) else None
+                if m is not None:
+                    smi = c
+                    break
             smiles.append(smi)
-            print(smi)
         return smiles
 
-    def decode_beam(self, z, k=3, cutoff_mols=None):
+    @staticmethod
+    def _finished_rows(emitted_pad, tokens, active, length, tables):
+        """
+        Mask of the active rows that emitted the padding char and whose selfies derivation has ended, given the
+        (batch_size * seq_length) tokens decoded so far, over length steps. The padding char is also read as a ring
+        length or branch size digit, these rows go on. tables : see selfies.derivation_tables, None to never stop.
+        """
+        finished = torch.zeros_like(emitted_pad)
+        if tables is None or not emitted_pad.any():
+            return finished
+        rows = torch.nonzero(emitted_pad).squeeze(1)
+        ended = [derivation_ended(row, *tables) for row in tokens[active[rows], :length].tolist()]
+        finished[rows] = torch.tensor(ended, dtype=torch.bool, device=emitted_pad.device)
+        return finished
+
+    def decoded_lengths(self, indices):
+        """
+        Number of chars decoded in each row of indices (batch_size * seq_length) by decode_indices(stop_on_pad=True) :
+        up to the padding char where the row finished, the padding after it is not decoded. seq_length for rows that
+        did not finish early.
+        """
+        tables = derivation_tables(self.index_to_char) if self.pad_index is not None else None
+        rows = indices.tolist()
+        lengths = [len(row) for row in rows]
+        if tables is not None:
+            for r, row in enumerate(rows):
+                for n in range(1, len(row)):
+                    if row[n - 1] == self.pad_index and derivation_ended(row[:n], *tables):
+                        lengths[r] = n
+                        break
+        return torch.tensor(lengths, dtype=torch.long, device=indices.device)
+
+    @staticmethod
+    def _reorder_h(h, idx):
+        """ Selects rows idx of the decoder hidden state (tensor or nested tuples of tensors), batch dim is -2 """
+        if torch.is_tensor(h):
+            return h.index_select(-2, idx)
+        return type(h)(Model._reorder_h(h_i, idx) for h_i in h)
+
+    def decode_beam(self, z, k=3, cutoff_mols=None, return_scores=False):
         """
         Input:
             z = torch.tensor type, (N_mols*l_size)
             k : beam param
-        Decodes a batch, molecule by molecule, using beam search of width k
+        Decodes the whole batch at once, using beam search of width k. At each step, the k best (beam, char) pairs
+        among the k * voc_size candidates are selected with a topk over the summed log-probabilities.
         Output:
-            a list of lists of k best sequences for each molecule.
+            array of shape (N_mols, k, max_len) with the k best sequences for each molecule, sorted by score.
+            if return_scores, also returns the (N_mols, k) array of sequences log-probabilities
         """
+        if cutoff_mols is not None:
+            z = z[:cutoff_mols]
         N = z.shape[0]
-        if cutoff_mols != None:
-            N = cutoff_mols
-            print(f'Decoding will stop after {N} mols')
-        sequences = []
-        for n in range(N):
-            print("decoding molecule n° ", n)
-            # Initialize rnn states and input
-            z_1mol = z[n].view(1, self.l_size)  # Reshape as a batch of size 1
-            start_token = self.rnn_in(z_1mol).view(1, self.voc_size, 1).to(self.device)
-            rnn_in = start_token
-            h = self.decoder.init_h(z_1mol)
-            topk = [BeamSearchNode(h, rnn_in, 0, [])]
-
-            for step in range(self.max_len):
-                next_nodes = PriorityQueue()
-                for candidate in topk:  # for each candidate sequence (among k)
-                    score = candidate.score
-                    seq = candidate.sequence
-                    # pass into decoder
-                    out, new_h = self.decoder(candidate.rnn_in, candidate.h)
-                    probas = F.softmax(out, dim=1)  # Shape N, voc_size
-                    for c in range(self.voc_size):
-                        new_seq = seq + [c]
-                        rnn_in = torch.zeros((1, 36))
-                        rnn_in[0, c] = 1
-                        s = score - probas[0, c]
-                        next_nodes.put((s.item(), BeamSearchNode(new_h, rnn_in.to(self.device), s.item(), new_seq)))
-                topk = []
-                for k_ in range(k):
-                    # get top k for next timestep !
-                    score, node = next_nodes.get()
-                    topk.append(node)
-                    # print("top sequence for next step :", node.sequence)
-
-            sequences.append([n.sequence for n in topk])  # list of lists
-        return np.array(sequences)
+        voc_size = self.voc_size
+
+        # Each molecule is replicated k times : beams of molecule n are rows n*k ... n*k + k-1
+        rows = torch.arange(N, device=self.device).repeat_interleave(k)
+        rnn_in = self.rnn_in(z).view(N, voc_size)[rows]
+        h = self._reorder_h(self.decoder.init_h(z), rows)
+
+        # Only the first beam is alive at step 0, otherwise the k beams would all pick the same chars
+        scores = torch.full((N, k), float('-inf'), device=self.device)
+        scores[:, 0] = 0
+        sequences = torch.zeros(N * k, self.max_len, dtype=torch.long, device=self.device)
+        offsets = (torch.arange(N, device=self.device) * k).unsqueeze(1)
+
+        for step in range(self.max_len):
+            out, h = self.decoder(rnn_in, h)
+            logprobs = F.log_softmax(out, dim=1)  # Shape N*k, voc_size
+            candidates = (scores.view(N * k, 1) + logprobs).view(N, k * voc_size)
+            scores, top_idx = torch.topk(candidates, k, dim=1)  # Shape N, k
+
+            # Parent beam of each selected candidate, and the char it appends
+            parents = (offsets + top_idx // voc_size).view(-1)
+            chars = (top_idx % voc_size).view(-1)
+
+            h = self._reorder_h(h, parents)
+            sequences = sequences[parents]
+            sequences[:, step] = chars
+            rnn_in = chars
+
+        sequences = sequences.view(N, k, self.max_len).cpu().numpy()
+        if return_scores:
+            return sequences, scores.cpu().numpy()
+        return sequences
 
     # ========================== Sampling functions ======================================
 
@@ -633,6 +883,18 @@ class Model(nn.Module):
         z_all = torch.cat(z_all, dim=0).numpy()
         return z_all
 
+    def quantize_decoder(self):
+        """
+        Replaces the decoder with its dynamic int8 quantized version (see MultiGRU.quantize).
+        CPU inference only : the model is moved to cpu and set to eval mode. Not for training.
+        """
+        if not hasattr(self.decoder, 'quantize'):
+            raise NotImplementedError('Quantization is only implemented for GRU decoders')
+        self.cpu()
+        self.eval()
+        self.decoder = self.decoder.quantize()
+        return self
+
     def load_permissive(self, state_dict):
         # Workaround to be able to load a model with not same size of affinity predictor... // load only compatible layers. 
         print('Careful, Using permissive load weights function')
@@ -660,25 +922,12 @@ class Model(nn.Module):
         self.load_state_dict(model_dict)
 
 
-class BeamSearchNode():
-    def __init__(self, h, rnn_in, score, sequence):
-        self.h = h
-        self.rnn_in = rnn_in
-        self.score = score
-        self.sequence = sequence
-        self.max_len = 60
-
-    def __lt__(self, other):  # For x < y
-        # Pour casser les cas d'égalité du score au hasard, on s'en fout un peu.
-        # Eventuellement affiner en regardant les caractères de la séquence (pénaliser les cycles ?)
-        return True
-
-
-def model_from_json(name='inference_default', load_weights=True, default_dir=True, weights_path=None):
+def model_from_json(name='inference_default', load_weights=True, default_dir=True, weights_path=None, quantized=False):
     """
     Load a model from the name of the experiment
     :param name:
     :param load_weights:
+    :param quantized: return a cpu inference model with a dynamic int8 quantized decoder
     :return:
     """
     dumper = ModelDumper()
@@ -699,6 +948,8 @@ def model_from_json(name='inference_default', load_weights=True, default_dir=Tru
 
         except:
             print('Weights could not be loaded by the util functions')
+    if quantized:
+        model.quantize_decoder()
     return model
 
 
@@ -39,6 +39,8 @@ if __name__ == '__main__':
     from data_processing.sascorer import calculateScore
     
     from docking.docking import dock, set_path
+    from docking.score_store import ScoreStore
+    from docking.conformers import ConformerCache
 
     parser = argparse.ArgumentParser()
 
@@ -187,35 +189,29 @@ if __name__ == '__main__':
         print(f'>>> Computing docking scores for {len(smiles_rdkit)} mols (!! time)')
         
         PYTHONSH, VINA = set_path(args.server)
+        store = ScoreStore() # unnormalized docking scores, shared with run_bo.py and cbas
+        conformers = ConformerCache() # 3D conformers, embedded once per molecule
         
         def dock_one(enum_tuple):
             """ Docks one smiles. Input = tuple from enumerate iterator"""
             identifier, smiles = enum_tuple
-            return dock(smiles, identifier, PYTHONSH, VINA, parallel=False, exhaustiveness = 16)
+            return dock(smiles, identifier, pythonsh=PYTHONSH, vina=VINA, parallel=False, exhaustiveness = 16,
+                        store=store, conformers=conformers)
+        
+        errors = conformers.embed_batch(smiles_rdkit)
+        print(f'>>> {len(smiles_rdkit) - len(errors)} conformers in {conformers.path}')
         
         
         pool = Pool()
         targets = pool.map(dock_one, enumerate(smiles_rdkit))
         pool.close()
         
-        raw_scores = targets
         targets = np.array(targets)
         targets = (targets -np.mean(targets)) /np.std(targets)
         
         print('>>> Saving docking scores to .txt file')
         np.savetxt(os.path.join(savedir, 'targets_docking.txt'), targets)
         print('done!')
-        
-        # Add to dict with docking scores 
-        docked = {}
-        for i,s in enumerate(smiles_rdkit):
-            
-            m=Chem.MolFromSmiles(s)
-            s= Chem.MolToSmiles(m, kekuleSmiles = True)
-            docked[s] = raw_scores[i] # unnormalized docking scores 
-                
-        with open('250k_docking_scores.pickle', 'wb') as f :
-            pickle.dump(docked, f)
-        print('Saved docking scores to pickle dict 250k_docking_scores.pickle' )
+        print(f'Docking scores are in the score store {store.path}')
         
         
\ No newline at end of file
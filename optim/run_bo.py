@@ -40,10 +40,12 @@ from model import model_from_json
 from dataloaders.molDataset import Loader
 from data_processing.comp_metrics import cycle_score, logP, qed
 from data_processing.sascorer import calculateScore
-from selfies import encoder,decoder
-from utils import soft_mkdir
+from selfies import encoder,decoder,decoder_indices
+from utils import soft_mkdir, unique_rows
 
 from docking.docking import dock, set_path
+from docking.score_store import ScoreStore
+from docking.conformers import ConformerCache
 
 from sparse_gp import SparseGP
 import scipy.stats as sps
@@ -128,16 +130,15 @@ else:
     y = -np.loadtxt(f'../../data/latent_features_and_targets/targets_{args.obj}.txt')
     PYTHONSH, VINA = set_path(args.server)
     
-    with open('250k_docking_scores.pickle', 'rb') as f :
-        docked = pickle.load(f)
+    # scores of molecules docked in previous runs (BO, CbAS, initial scores), new ones are added to it by dock
+    store = ScoreStore()
+    conformers = ConformerCache() # 3D conformers, embedded once per molecule
     
     def dock_one(enum_tuple):
         """ Docks one smiles. Input = tuple from enumerate iterator"""
         identifier, smiles = enum_tuple
-        if smiles in docked :
-            return docked[smiles]
-        else:
-            return dock(smiles, identifier, PYTHONSH, VINA, parallel=False, exhaustiveness = 16)
+        return dock(smiles, identifier, pythonsh=PYTHONSH, vina=VINA, parallel=False, exhaustiveness = 16,
+                    store=store, conformers=conformers)
     
 
 y = y.reshape((-1, 1))
@@ -202,18 +203,20 @@ while iteration < args.n_iters:
     # We decode the 50 smiles: 
     # Decode z into smiles
     with torch.no_grad():
-        gen_seq = model.decode(torch.FloatTensor(next_inputs).to(device))
-        smiles = model.probas_to_smiles(gen_seq)
-        valid_smiles_final = []
+        indices = model.decode_indices(torch.FloatTensor(next_inputs).to(device))
+        # decode and parse identical sequences only once, then fan back out to the batch positions
+        unique_indices, _, inverse = unique_rows(indices)
+        smiles = decoder_indices(unique_indices, model.index_to_char)
+        unique_valid_smiles = []
         for s in smiles :
-            s = decoder(s)
             m = Chem.MolFromSmiles(s)
             if m is None : 
-                valid_smiles_final.append(None)
+                unique_valid_smiles.append(None)
             else:
                 Chem.Kekulize(m)
                 s= Chem.MolToSmiles(m, kekuleSmiles = True)
-                valid_smiles_final.append(s)
+                unique_valid_smiles.append(s)
+        valid_smiles_final = [unique_valid_smiles[j] for j in inverse]
 
 
     new_features = next_inputs
@@ -276,6 +279,7 @@ while iteration < args.n_iters:
         
     elif args.obj == 'docking': # we want to minimize docking scores => no need to take (-score) as for other objectives 
         
+        conformers.embed_batch([s for s in valid_smiles_final if s is not None])
         pool = Pool()
         scores = pool.map(dock_one, enumerate(valid_smiles_final))
         pool.close()
@@ -285,16 +289,6 @@ while iteration < args.n_iters:
         targets_distrib = np.loadtxt(f'../../data/latent_features_and_targets/targets_docking.txt')
         scores = (raw_scores - np.mean(targets_distrib) ) / np.std(targets_distrib)
         
-        # add to known scores : 
-        for i in range(len(valid_smiles_final)):
-            m=Chem.MolFromSmiles(valid_smiles_final[i])
-            s= Chem.MolToSmiles(m, kekuleSmiles = True)
-            if s not in docked : 
-                docked[s] = raw_scores[i] # unnormalized docking scores 
-                
-        with open('250k_docking_scores.pickle', 'wb') as f :
-            pickle.dump(docked, f)
-        
         
         
     # Common to all objectives ; saving scores and smiles for this step 
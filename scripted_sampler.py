@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+TorchScript sampler : z -> token indices, with the whole decoding loop compiled.
+
+Built from a trained Model (GRU decoder), it only depends on torch once exported, so it can be loaded without
+dgl or rdkit :
+
+    sampler = torch.jit.load('sampler.pt')
+    indices = sampler(z)
+    selfies = sampler.indices_to_strings(indices)
+
+Export from repo root :
+python scripted_sampler.py --name [name_of_the_model] -o sampler.pt
+"""
+import os
+import sys
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+if __name__ == "__main__":
+    sys.path.append(script_dir)
+
+import argparse
+import copy
+from typing import List
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from selfies import derivation_tables, derivation_ended
+
+
+class ScriptedSampler(nn.Module):
+    """
+    Decoding part of a Model with a MultiGRU decoder, written to be compiled with torch.jit.script.
+    Same outputs as Model.decode_indices(z, stop_on_pad=True) in greedy mode. Inference only (eval mode, no dropout,
+    batchnorm folded into an affine transform).
+    """
+
+    def __init__(self, rnn_in, dense_init, gru_1, gru_2, gru_3, linear, bn_params, max_len, pad_index,
+                 index_to_char, tables=None):
+        super(ScriptedSampler, self).__init__()
+        self.rnn_in = rnn_in
+        self.dense_init = dense_init
+        self.gru_2 = gru_2
+        self.gru_3 = gru_3
+        self.linear = linear
+
+        # First cell : inputs are one-hot chars, the input matmul is a lookup of the columns of weight_ih
+        self.weight_ih_1 = nn.Parameter(gru_1.weight_ih.detach().clone())
+        self.lookup_ih_1 = nn.Parameter(gru_1.weight_ih.detach().t().contiguous())
+        self.bias_ih_1 = nn.Parameter(gru_1.bias_ih.detach().clone())
+        self.weight_hh_1 = nn.Parameter(gru_1.weight_hh.detach().clone())
+        self.bias_hh_1 = nn.Parameter(gru_1.bias_hh.detach().clone())
+
+        self.use_batchNorm = bn_params is not None
+        h_size = gru_2.hidden_size
+        if bn_params is None:
+            bn_params = [(torch.ones(h_size), torch.zeros(h_size))] * 3
+        bn_params = [(scale.to(self.weight_ih_1.device), shift.to(self.weight_ih_1.device)) for scale, shift in bn_params]
+        self.register_buffer('bn_scale', torch.stack([scale for scale, _ in bn_params]))
+        self.register_buffer('bn_shift', torch.stack([shift for _, shift in bn_params]))
+
+        self.h_size = h_size
+        self.voc_size = linear.out_features
+        self.max_len = max_len
+        # -1 : no early stopping. Rows stop once their selfies derivation has ended, see selfies.derivation_ended
+        self.pad_index = pad_index if pad_index is not None and tables is not None else -1
+        self.actions, self.digits = tables if tables is not None else ([[0]], [0])
+        self.index_to_char = index_to_char
+
+    @classmethod
+    def from_model(cls, model):
+        """ Copies the decoding layers of a trained Model (on the same device) """
+        decoder = model.decoder
+        if not hasattr(decoder, 'gru_1_lookup'):
+            raise NotImplementedError('Scripted sampling is only implemented for GRU decoders')
+        if decoder.quantized:
+            raise NotImplementedError('Scripted sampling of a quantized decoder is not implemented')
+        bn_params = None
+        if decoder.use_batchNorm:
+            bn_params = []
+            for bn in (decoder.BN1, decoder.BN2, decoder.BN3):
+                scale = bn.weight.detach() / torch.sqrt(bn.running_var + bn.eps)
+                bn_params.append((scale, bn.bias.detach() - bn.running_mean * scale))
+        index_to_char = [model.index_to_char[k] for k in sorted(model.index_to_char, key=int)]
+        layers = [copy.deepcopy(l) for l in (model.rnn_in, decoder.dense_init, decoder.gru_1, decoder.gru_2,
+                                             decoder.gru_3, decoder.linear)]
+        sampler = cls(*layers, bn_params, model.max_len, model.pad_index, index_to_char,
+                      derivation_tables(model.index_to_char))
+        return sampler.to(model.device).eval()
+
+    def gru_1(self, gi, h):
+        gh = F.linear(h, self.weight_hh_1, self.bias_hh_1)
+        i_r, i_z, i_n = gi.chunk(3, 1)
+        h_r, h_z, h_n = gh.chunk(3, 1)
+        resetgate = torch.sigmoid(i_r + h_r)
+        inputgate = torch.sigmoid(i_z + h_z)
+        newgate = torch.tanh(i_n + resetgate * h_n)
+        return newgate + inputgate * (h - newgate)
+
+    def bn(self, x, i: int):
+        if self.use_batchNorm:
+            return x * self.bn_scale[i] + self.bn_shift[i]
+        return x
+
+    def finished_rows(self, emitted_pad, indices, active, length: int):
+        """ Same as Model._finished_rows """
+        finished = torch.zeros_like(emitted_pad)
+        rows = torch.nonzero(emitted_pad).squeeze(1)
+        tokens: List[List[int]] = indices[active[rows], :length].tolist()
+        ended: List[bool] = []
+        for row in tokens:
+            ended.append(derivation_ended(row, self.actions, self.digits))
+        finished[rows] = torch.tensor(ended, dtype=torch.bool, device=emitted_pad.device)
+        return finished
+
+    def forward(self, z, temperature: float = 0.):
+        """
+        z : (batch_size * latent_size). Returns the (batch_size * max_len) LongTensor of decoded chars,
+        argmax decoding if temperature is 0, else chars sampled from softmax(logits / temperature).
+        Rows stop being decoded once they emit the padding char at the end of their selfies derivation.
+        """
+        batch_size = z.size(0)
+        h = self.dense_init(z).view(3, batch_size, self.h_size)
+        h1, h2, h3 = h[0], h[1], h[2]
+        gi = F.linear(self.rnn_in(z), self.weight_ih_1, self.bias_ih_1)
+
+        fill = self.pad_index if self.pad_index >= 0 else 0
+        indices = torch.full((batch_size, self.max_len), fill, dtype=torch.long, device=z.device)
+        active = torch.arange(batch_size, device=z.device)
+
+        for step in range(self.max_len):
+            h1 = self.gru_1(gi, h1)
+            h2 = self.gru_2(self.bn(h1, 0), h2)
+            h3 = self.gru_3(self.bn(h2, 1), h3)
+            out = self.linear(self.bn(h3, 2))
+            if temperature > 0:
+                chars = torch.multinomial(F.softmax(out / temperature, dim=1), 1).squeeze(1)
+            else:
+                chars = torch.argmax(out, dim=1)
+            indices[active, step] = chars
+
+            if self.pad_index >= 0:
+                finished = chars == self.pad_index
+                if bool(finished.any()):
+                    finished = self.finished_rows(finished, indices, active, step + 1)
+                if bool(finished.any()):
+                    keep = torch.nonzero(~finished).squeeze(1)
+                    if keep.numel() == 0:
+                        break
+                    active, chars = active[keep], chars[keep]
+                    h1, h2, h3 = h1[keep], h2[keep], h3[keep]
+            gi = F.embedding(chars, self.lookup_ih_1) + self.bias_ih_1
+        return indices
+
+    @torch.jit.export
+    def indices_to_strings(self, indices):
+        """ Same as Model.indices_to_smiles """
+        rows: List[List[int]] = indices.tolist()
+        strings: List[str] = []
+        for row in rows:
+            strings.append(''.join([self.index_to_char[i] for i in row]).rstrip())
+        return strings
+
+
+def script_sampler(model):
+    """ Compiled sampler for a trained Model """
+    return torch.jit.script(ScriptedSampler.from_model(model))
+
+
+if __name__ == "__main__":
+    from model import model_from_json
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--name', help="Saved model directory, in /results/saved_models",
+                        default='inference_default')
+    parser.add_argument('-o', '--output_file', type=str, default=None,
+                        help="defaults to results/saved_models/[name]/sampler.pt")
+    args, _ = parser.parse_known_args()
+
+    model = model_from_json(args.name)
+    model.cpu()
+    model.eval()
+    out = args.output_file
+    if out is None:
+        out = os.path.join(script_dir, 'results/saved_models', args.name, 'sampler.pt')
+    torch.jit.save(script_sampler(model), out)
+    print(f'>>> Saved scripted sampler to {out}')
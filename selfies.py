@@ -1,4 +1,9 @@
+import atexit
 import math
+import multiprocessing
+from collections import OrderedDict
+from functools import partial, lru_cache
+from typing import List
 
 
 def selfies_alphabet():
@@ -2079,12 +2084,196 @@ def __selfies_to_smiles_derive(selfies,smiles,N_restrict=True):
 
 
 
-def _selfies_to_smiles(selfies,N_restrict=True): # here we derive molecule by molecule
+# Table-driven derivation : the rules of __selfies_to_smiles_derive as precomputed (state, symbol) -> action
+# lookups, applied to the list of symbols of the selfies string. States 1-6 are the number of bonds the last atom
+# can still make, 0 the first atom of the molecule and 9991-9993 the first atom of a branch.
+# Gives the same smiles (and the same ValueErrors) as __selfies_to_smiles_derive, which is kept as the reference.
+
+_START_INDEX = dict((symbol, i) for i, symbol in enumerate(
+    ['[epsilon]', '[Ring1]', '[Ring2]', '[Branch1_1]', '[Branch1_2]', '[Branch1_3]', '[Branch2_1]', '[Branch2_2]',
+     '[Branch2_3]', '[F]', '[O]', '[=O]', '[N]', '[=N]', '[#N]', '[C]', '[=C]', '[#C]', '[S]', '[=S]']))
+
+# Atom rules : symbol -> (smiles symbol, next state), next state None ends the derivation
+_ATOM_RULES_START = {'[epsilon]': ('', 0), '[F]': ('[F]', 1), '[H]': ('[H]', 1), '[Cl]': ('[Cl]', 1),
+                     '[Br]': ('[Br]', 1), '[O]': ('[O]', 2), '[NHexpl]': ('[NHexpl]', 2), '[=O]': ('[O]', 2),
+                     '[N]': ('[N]', 3), '[=N]': ('[N]', 3), '[#N]': ('[N]', 3), '[C]': ('[C]', 4),
+                     '[=C]': ('[C]', 4), '[#C]': ('[C]', 4), '[C@expl]': ('[C@expl]', 4),
+                     '[C@@expl]': ('[C@@expl]', 4), '[C@Hexpl]': ('[C@Hexpl]', 3), '[C@@Hexpl]': ('[C@@Hexpl]', 3),
+                     '[S]': ('[S]', 6), '[=S]': ('[S]', 6)}
+_ATOM_RULES_SINGLE = {'[epsilon]': ('', None), '[F]': ('[F]', None), '[H]': ('[H]', None), '[Cl]': ('[Cl]', None),
+                      '[Br]': ('[Br]', None), '[O]': ('[O]', 1), '[NHexpl]': ('[NHexpl]', 1), '[=O]': ('[O]', None),
+                      '[N]': ('[N]', 2), '[=N]': ('[N]', 2), '[#N]': ('[N]', 2), '[C]': ('[C]', 3),
+                      '[=C]': ('[C]', 3), '[#C]': ('[C]', 3), '[C@expl]': ('[C@expl]', 3),
+                      '[C@@expl]': ('[C@@expl]', 3), '[C@Hexpl]': ('[C@Hexpl]', 2),
+                      '[C@@Hexpl]': ('[C@@Hexpl]', 2), '[S]': ('[S]', 5), '[=S]': ('[S]', 5)}
+_ATOM_RULES_DOUBLE = dict(_ATOM_RULES_SINGLE, **{'[=O]': ('[=O]', None), '[=N]': ('[=N]', 1), '[#N]': ('[=N]', 1),
+                                                 '[=C]': ('[=C]', 2), '[#C]': ('[=C]', 2), '[=S]': ('[=S]', 4)})
+_ATOM_RULES_TRIPLE = dict(_ATOM_RULES_DOUBLE, **{'[#N]': ('[#N]', None), '[#C]': ('[#C]', 1)})
+_ATOM_RULES = {0: _ATOM_RULES_START, 1: _ATOM_RULES_SINGLE, 2: _ATOM_RULES_DOUBLE, 3: _ATOM_RULES_TRIPLE,
+               4: _ATOM_RULES_TRIPLE, 5: _ATOM_RULES_TRIPLE, 6: _ATOM_RULES_TRIPLE, 9991: _ATOM_RULES_SINGLE,
+               9992: _ATOM_RULES_DOUBLE, 9993: _ATOM_RULES_TRIPLE}
+
+# [BranchK_J] in states 2-6 : J -> (state at the start of the branch, state after the branch)
+_BRANCH_RULES = {2: {1: (9991, 1), 2: (9991, 1), 3: (9991, 1)},
+                 3: {1: (9991, 2), 2: (9991, 2), 3: (9992, 1)},
+                 4: {1: (9992, 2), 2: (9991, 3), 3: (9993, 1)},
+                 5: {1: (9992, 3), 2: (9991, 4), 3: (9993, 2)},
+                 6: {1: (9992, 4), 2: (9991, 5), 3: (9993, 3)}}
+_BRANCH_SYMBOLS = ['[Branch%d_%d]' % (k, j) for k in (1, 2, 3) for j in (1, 2, 3)]
+
+# Actions : (kind, smiles symbol or ring bond, next state, number of symbols read for the ring / branch size,
+# state at the start of the branch)
+_ATOM, _RING, _BRANCH, _SKIP = 0, 1, 2, 3
+
+
+def _derive_action(state, symbol, N_restrict=True):
+    """ Action of the derivation rule of symbol in state """
+    rules = _ATOM_RULES[state]
+    if symbol in rules:
+        smiles_symbol, next_state = rules[symbol]
+        if not N_restrict and symbol in ('[N]', '[=N]', '[#N]'):
+            next_state = 4 if state >= 9991 else 6
+        return (_ATOM, smiles_symbol, next_state, 0, None)
+    if state == 0 and (symbol.find('Ring') >= 0 or symbol.find('Branch') >= 0):
+        return (_SKIP, '', 0, 1, None)  # ignore this symbol and the next one
+    if state == 1 and symbol.find('Branch') >= 0:
+        return (_SKIP, '', 1, 1, None)
+    if state >= 9991 and (symbol.find('Ring') >= 0 or symbol.find('Branch') >= 0):
+        return (_ATOM, '', state, 0, None)
+    if 1 <= state <= 6:
+        for k in (1, 2, 3):
+            if symbol.find('Ring%d]' % k) >= 0:
+                bond = symbol[5] if symbol[1:5] == 'Expl' else ''  # explicit bond information
+                return (_RING, bond, state - 1 if state > 1 else None, k, None)
+        if symbol in _BRANCH_SYMBOLS:
+            branch_state, next_state = _BRANCH_RULES[state][int(symbol[9])]
+            return (_BRANCH, '', next_state, int(symbol[7]), branch_state)
+    return (_ATOM, symbol, 6, 0, None)
+
+
+def _derive_table(N_restrict=True):
+    """ state -> {symbol: action} for the symbols of the grammar, other symbols go through _derive_action """
+    symbols = set(_START_INDEX) | set(_BRANCH_SYMBOLS) | set(selfies_alphabet())
+    symbols |= set('[Expl%sRing%d]' % (bond, k) for bond in '=#/\\-' for k in (1, 2, 3))
+    return dict((state, dict((symbol, _derive_action(state, symbol, N_restrict)) for symbol in symbols))
+                for state in _ATOM_RULES)
+
+
+_DERIVE_TABLES = {True: _derive_table(True), False: _derive_table(False)}
+
+
+def _split_selfies_symbols(selfies):
+    """
+    Symbols of a selfies string, read like _get_next_selfies_symbol does, and the message of the error it raises
+    when it reaches a malformed symbol (None if the string is well formed)
+    """
+    parts = selfies.split(']')
+    if parts[-1] == '' and all(p[:1] == '[' for p in parts[:-1]):
+        if parts[-2:-1] == ['[']:
+            parts.pop()  # the last 2 chars are not read
+        return [p + ']' for p in parts[:-1]], None
+    symbols, pos = [], 0
+    while len(selfies) - pos > 2:
+        if selfies[pos] != '[':
+            return symbols, '_get_next_selfies_symbol: Decoding Problem 1: ' + selfies[pos:]
+        end = selfies.find(']', pos)
+        if end == -1:
+            return symbols, '_get_next_selfies_symbol: Decoding Problem 2: ' + selfies[pos:]
+        symbols.append(selfies[pos:end + 1])
+        pos = end + 1
+    return symbols, None
+
+
+def _take_symbols(symbols, i, k, end, error):
+    """ The k symbols from position i ('' past the end of the string) and the next position """
+    if i + k > end and error is not None:
+        raise ValueError(error)
+    taken = symbols[i:min(i + k, end)]
+    if len(taken) < k:
+        taken += [''] * (k - len(taken))
+    return taken, min(i + k, end)
+
+
+def _symbols_number(symbols):
+    """ Integer encoded by symbols of the start alphabet (ring lengths, branch sizes), None if one is not in it """
+    digits = [_START_INDEX.get(symbol) for symbol in symbols]
+    if None in digits:
+        return None
+    if len(digits) == 1:
+        return digits[0] + 1
+    if len(digits) == 2:
+        return (digits[0] + 1) * 20 + digits[1]
+    return (digits[0] + 1) * 400 + digits[1] * 20 + digits[2]
+
+
+def _derive_symbols(symbols, i, end, error, state, N_restrict, out):
+    """
+    Derives symbols[i:end] from state, appending smiles symbols to out. error : message raised when reading past end
+    (malformed end of the string), None if the string ends at end.
+    """
+    table = _DERIVE_TABLES[N_restrict]
+    if i >= end and error is None:
+        return
+    while True:
+        if i >= end:
+            raise ValueError(error)
+        symbol = symbols[i]
+        i += 1
+        action = table[state].get(symbol)
+        if action is None:
+            action = _derive_action(state, symbol, N_restrict)
+        kind, smiles_symbol, state, k, branch_state = action
+
+        if kind == _ATOM:
+            out.append(smiles_symbol)
+        elif kind == _RING:
+            ring_symbols, i = _take_symbols(symbols, i, k, end, error)
+            ring_num = _symbols_number(ring_symbols)
+            ring_num = 5 if ring_num is None else ring_num + (k == 1)
+            out.append(smiles_symbol + '%' + str(ring_num).zfill(4))
+        elif kind == _BRANCH:
+            size_symbols, i = _take_symbols(symbols, i, k, end, error)
+            branch_num = _symbols_number(size_symbols) or 1
+            if i + branch_num > end and error is not None:
+                raise ValueError(error)
+            branch, branch_end = [], min(i + branch_num, end)
+            if branch_end > i and symbols[branch_end - 1] == '[]':
+                _derive_symbols(symbols, i, branch_end - 1, None, branch_state, N_restrict, branch)  # last 2 chars
+            else:
+                _derive_symbols(symbols, i, branch_end, None, branch_state, N_restrict, branch)
+            i = branch_end
+            branch = ''.join(branch)
+            if len(branch) == 0:
+                return  # an empty branch ends the derivation
+            out.append('(' + branch + ')')
+        else:
+            _, i = _take_symbols(symbols, i, k, end, error)
+
+        if state is None or (i >= end and error is None):
+            return
+
+
+def _selfies_to_smiles_table(selfies, N_restrict=True):
+    """ Derivation of one molecule with the rule tables, same output as __selfies_to_smiles_derive(selfies, 'X0') """
+    if selfies.find('X') >= 0 or selfies.find('Z!') >= 0:
+        # X is the non-terminal symbol of the string rewriting derivation, symbols containing it are only decoded
+        # by the reference implementation
+        return __selfies_to_smiles_derive(selfies, 'X0', N_restrict)
+    symbols, error = _split_selfies_symbols(selfies)
+    out = []
+    _derive_symbols(symbols, 0, len(symbols), error, 0, N_restrict, out)
+    return ''.join(out)
+
+
+def _selfies_to_smiles(selfies,N_restrict=True,table_driven=True): # here we derive molecule by molecule
     all_selfies=selfies.split('.') # the dot symbol characterizes the start of a new, independent molecule
     all_selfies_new=''
 
     for current_smiles in all_selfies:
-        all_selfies_new=all_selfies_new+'.'+__selfies_to_smiles_derive(current_smiles,'X0',N_restrict) # derive the current selfies string in __selfies_to_smiles_derive (this is a recursive function, and X0 is the starting state of the derivation)
+        if table_driven: # rule tables, same output as the string rewriting derivation below
+            all_selfies_new=all_selfies_new+'.'+_selfies_to_smiles_table(current_smiles,N_restrict)
+        else:
+            all_selfies_new=all_selfies_new+'.'+__selfies_to_smiles_derive(current_smiles,'X0',N_restrict) # derive the current selfies string in __selfies_to_smiles_derive (this is a recursive function, and X0 is the starting state of the derivation)
             
     return all_selfies_new[1:] 
 
@@ -2624,11 +2813,11 @@ def encoder(smiles,PrintErrorMessage=True): # encodes SMILES -> SELFIES
 
 
 
-def decoder(selfies,N_restrict=True,bilocal_ring_function=True,PrintErrorMessage=True): # decodes SELFIES -> SMILES
+def decoder(selfies,N_restrict=True,bilocal_ring_function=True,PrintErrorMessage=True,table_driven=True): # decodes SELFIES -> SMILES
     smiles=-1
     if selfies!=-1:
         try:
-            presmiles1=_selfies_to_smiles(selfies,N_restrict)     # Runs Grammar Rules
+            presmiles1=_selfies_to_smiles(selfies,N_restrict,table_driven)     # Runs Grammar Rules
             smiles=_insert_rings_to_smiles(presmiles1,N_restrict,bilocal_ring_function)       # Inserts Rings
         except  ValueError as err:
             if PrintErrorMessage:
@@ -2638,3 +2827,319 @@ def decoder(selfies,N_restrict=True,bilocal_ring_function=True,PrintErrorMessage
     
     return smiles
     
+
+
+# Decoding from token indices : rows of alphabet indices are mapped to their symbols and go straight to the rule
+# tables, without building the selfies string and splitting it again. Same output as decoder(''.join(symbols)).
+
+def _index_symbols(index_to_char):
+    """ List of the symbols of index_to_char by index (json-loaded dicts have str keys) """
+    chars = dict((int(idx), char) for idx, char in index_to_char.items())
+    return [chars.get(idx) for idx in range(max(chars) + 1)]
+
+
+def _table_symbol(symbol):
+    """ True if symbol is read as one symbol by _split_selfies_symbols and can go through the rule tables """
+    return (symbol is not None and len(symbol) > 2 and symbol[0] == '[' and symbol.find('[', 1) < 0
+            and symbol.find(']') == len(symbol) - 1 and symbol.find('X') < 0 and symbol.find('Z!') < 0
+            and symbol.find('.') < 0)
+
+
+def _decode_index_rows(rows, symbols, pad_index, N_restrict=True, bilocal_ring_function=True):
+    """ (smiles, error message) for each row of indices, (-1, message) when decoding fails """
+    table_symbols = all(_table_symbol(symbol) for symbol in symbols if symbol is not None)
+    results = []
+    for row in rows:
+        end = len(row)
+        if pad_index is not None:
+            # the derivation stops at the first padding char read as an atom. Trailing padding chars are dropped,
+            # except the 3 after the last symbol that may be read as a ring length or branch size
+            while end > 0 and row[end - 1] == pad_index:
+                end -= 1
+            end = min(end + 3, len(row))
+        row_symbols = [symbols[idx] for idx in row[:end]]
+        try:
+            if table_symbols:
+                out = []
+                _derive_symbols(row_symbols, 0, len(row_symbols), None, 0, N_restrict, out)
+                presmiles = ''.join(out)
+            else:
+                presmiles = _selfies_to_smiles(''.join(row_symbols), N_restrict)
+            results.append((_insert_rings_to_smiles(presmiles, N_restrict, bilocal_ring_function), None))
+        except ValueError as err:
+            results.append((-1, str(err)))
+    return results
+
+
+def decoder_indices(indices, index_to_char, N_restrict=True, bilocal_ring_function=True, PrintErrorMessage=True,
+                    n_jobs=1, chunk_size=1000, cache=None):
+    """
+    Decodes a (N, seq_len) array / tensor / list of lists of alphabet indices into a list of N smiles, with
+    index_to_char the alphabet of the model. Same smiles as decoder on the selfies strings of the rows (-1 where
+    decoding fails), without building the strings. Distinct rows are decoded once, in chunks of chunk_size over
+    n_jobs processes (see decode_batch). cache : LRUCache keyed by row, only shared by calls with the same alphabet.
+    """
+    if hasattr(indices, 'cpu'):
+        indices = indices.cpu()
+    if hasattr(indices, 'tolist'):
+        indices = indices.tolist()
+    symbols = _index_symbols(index_to_char)
+    pad_index = symbols.index('[epsilon]') if '[epsilon]' in symbols else None
+    fn = partial(_decode_index_rows, symbols=symbols, pad_index=pad_index, N_restrict=N_restrict,
+                 bilocal_ring_function=bilocal_ring_function)
+    smiles, errors = _run_batch(fn, [tuple(row) for row in indices], n_jobs, chunk_size, cache, True)
+    if PrintErrorMessage:
+        for err in errors:
+            if err is not None:
+                print(err)
+                print('Could not decode selfies string. Please contact authors.')
+    return smiles
+
+
+# Early stopping of the decoding from token indices : decoders emit the padding char at the end of a molecule, but it
+# is also digit 0 of ring lengths and branch sizes, and an empty atom in the first state. A row can only stop once its
+# derivation has ended, i.e. when the symbols that would follow do not change its smiles.
+
+_STATES = [0, 1, 2, 3, 4, 5, 6, 9991, 9992, 9993]
+
+
+@lru_cache(maxsize=8)
+def _derivation_tables(symbols, N_restrict):
+    if not all(_table_symbol(symbol) for symbol in symbols if symbol is not None):
+        return None
+    actions = []
+    for state in _STATES:
+        for symbol in symbols:
+            kind, smiles_symbol, next_state, k, branch_state = _derive_action(state, symbol or '[]', N_restrict)
+            appends = kind == _RING or (kind == _ATOM and smiles_symbol != '')
+            actions.append([kind, -1 if next_state is None else _STATES.index(next_state), k,
+                            -1 if branch_state is None else _STATES.index(branch_state), int(appends)])
+    digits = [_START_INDEX.get(symbol, -1) for symbol in symbols]
+    return actions, digits
+
+
+def derivation_tables(index_to_char, N_restrict=True):
+    """
+    Rule tables of the alphabet index_to_char for derivation_ended : (actions, digits), with
+    actions[state position in _STATES * alphabet size + index] = [kind, next state position (-1 : end of the
+    derivation), number of symbols read, branch state position, 1 if the action appends to the smiles] and digits the
+    start alphabet digit of each index (-1 if not in it). None if some symbols do not go through the rule tables.
+    """
+    return _derivation_tables(tuple(_index_symbols(index_to_char)), N_restrict)
+
+
+def derivation_ended(row: List[int], actions: List[List[int]], digits: List[int]) -> bool:
+    """
+    True if the derivation of the token indices of row ends within row : the smiles does not depend on the symbols
+    that would follow. False if more symbols may be read. Same reading as _derive_symbols, without recursion so that
+    it can be compiled by TorchScript (see scripted_sampler.py).
+    """
+    n_symbols = len(digits)
+    n = len(row)
+    # derivation levels : the molecule, then the branches being derived. end -1 : the molecule is not bounded
+    states: List[int] = [0]
+    ends: List[int] = [-1]
+    appended: List[int] = [0]
+    i = 0
+    result = 0  # 1 : ended, 2 : needs more symbols
+    while result == 0:
+        end = ends[-1]
+        level_done = end >= 0 and i >= end
+        if not level_done:
+            if i >= n:
+                result = 2
+                break
+            action = actions[states[-1] * n_symbols + row[i]]
+            i += 1
+            kind = action[0]
+            states[-1] = action[1]
+            if action[4] == 1:
+                appended[-1] = 1
+            if kind != 0:  # not _ATOM (TorchScript does not read module globals)
+                # ring length, branch size or skipped symbols, cut at the end of the branch
+                k = action[2]
+                stop = i + k
+                if end >= 0 and stop > end:
+                    stop = end
+                if stop > n:
+                    result = 2
+                    break
+                if kind == 2:  # _BRANCH
+                    branch_num = 1
+                    if stop - i == k:
+                        number = 0
+                        for j in range(i, stop):
+                            digit = digits[row[j]]
+                            if digit < 0:
+                                number = -1
+                                break
+                            number = number * 20 + digit + int(j == i)  # first digit + 1, as _symbols_number
+                        if number >= 0:
+                            branch_num = number
+                    branch_end = stop + branch_num
+                    if end >= 0 and branch_end > end:
+                        branch_end = end
+                    states.append(action[3])
+                    ends.append(branch_end)
+                    appended.append(0)
+                    i = stop
+                    continue
+                i = stop
+            level_done = action[1] < 0 or (end >= 0 and i >= end)
+        if level_done:
+            # the level returns, an empty branch also ends the level that contains it
+            while result == 0:
+                if len(states) == 1:
+                    result = 1
+                    break
+                states.pop()
+                branch_appended = appended.pop()
+                i = ends.pop()
+                if branch_appended == 1:
+                    appended[-1] = 1
+                    break
+    return result == 1
+
+
+# Batch encoding / decoding : a persistent process pool, shared by all the calls of the process, and optional LRU
+# caches of the results. Failed items give -1, as encoder / decoder, and their error message.
+
+_POOL = None
+_POOL_SIZE = 0
+
+
+def get_pool(n_jobs=None):
+    """ Persistent multiprocessing pool of n_jobs processes (None : cpu count), created on first use """
+    global _POOL, _POOL_SIZE
+    n_jobs = n_jobs or multiprocessing.cpu_count()
+    if _POOL is None or _POOL_SIZE != n_jobs:
+        close_pool()
+        _POOL, _POOL_SIZE = multiprocessing.Pool(n_jobs), n_jobs
+    return _POOL
+
+
+def close_pool():
+    """ Terminates the persistent pool (also done at exit) """
+    global _POOL, _POOL_SIZE
+    if _POOL is not None:
+        _POOL.terminate()
+        _POOL.join()
+    _POOL, _POOL_SIZE = None, 0
+
+
+class LRUCache:
+    """ Bounded cache of batch results keyed by input string, least recently used items are dropped first """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key):
+        self.items.move_to_end(key)
+        self.hits += 1
+        return self.items[key]
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def clear(self):
+        self.items.clear()
+        self.hits = self.misses = 0
+
+
+def _encode_chunk(smiles_list):
+    """ (selfies, error message) for each smiles, (-1, message) when encoding fails """
+    results = []
+    for smiles in smiles_list:
+        try:
+            preselfies = _reconfigure_smiles_numbers2(_reconfigure_smiles_numbers1(_make_brackets_around_atoms(smiles)))
+            results.append((_smiles_to_selfies(preselfies), None))
+        except ValueError as err:  # as encoder
+            results.append((-1, '%s: %s' % (type(err).__name__, err)))
+    return results
+
+
+def _decode_chunk(selfies_list, N_restrict=True, bilocal_ring_function=True):
+    """ (smiles, error message) for each selfies, (-1, message) when decoding fails """
+    results = []
+    for selfies in selfies_list:
+        if selfies == -1:  # failed encoding, as decoder
+            results.append((-1, None))
+            continue
+        try:
+            presmiles = _selfies_to_smiles(selfies, N_restrict)
+            results.append((_insert_rings_to_smiles(presmiles, N_restrict, bilocal_ring_function), None))
+        except ValueError as err:  # as decoder
+            results.append((-1, '%s: %s' % (type(err).__name__, err)))
+    return results
+
+
+def _run_batch(fn, items, n_jobs, chunk_size, cache, return_errors):
+    """
+    Applies fn (list of inputs -> list of (output, error)) to the distinct items that are not in cache, in chunks of
+    chunk_size over the persistent pool if n_jobs != 1. Returns the outputs in the order of items (and the errors).
+    """
+    todo = []
+    seen = set()
+    for item in items:
+        if item not in seen and (cache is None or item not in cache):
+            seen.add(item)
+            todo.append(item)
+    if cache is not None:
+        cache.misses += len(todo)
+
+    if n_jobs == 1 or len(todo) <= chunk_size:
+        computed = fn(todo)
+    else:
+        chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+        computed = [r for chunk in get_pool(n_jobs).map(fn, chunks) for r in chunk]
+    results = dict(zip(todo, computed))
+
+    outputs, errors = [], []
+    for item in items:
+        if item in results:
+            out, err = results[item]
+        else:
+            out, err = cache.get(item)
+        outputs.append(out)
+        errors.append(err)
+    if cache is not None:
+        for item, result in results.items():
+            cache.put(item, result)
+    if return_errors:
+        return outputs, errors
+    return outputs
+
+
+def encode_batch(smiles_list, n_jobs=None, chunk_size=500, cache=None, return_errors=False):
+    """
+    Encodes a list of smiles to selfies, in the same order (-1 where encoding fails). Distinct smiles are encoded
+    once, in chunks of chunk_size over a persistent pool of n_jobs processes (None : cpu count, 1 : serial).
+    cache : LRUCache of previous results, updated with the new ones.
+    return_errors : also return the error message of each item (None if encoded).
+    """
+    return _run_batch(_encode_chunk, list(smiles_list), n_jobs, chunk_size, cache, return_errors)
+
+
+def decode_batch(selfies_list, N_restrict=True, bilocal_ring_function=True, n_jobs=None, chunk_size=500, cache=None,
+                 return_errors=False):
+    """
+    Decodes a list of selfies to smiles, in the same order (-1 where decoding fails). Same arguments as encode_batch.
+    A cache must only be shared by calls with the same N_restrict and bilocal_ring_function.
+    """
+    fn = partial(_decode_chunk, N_restrict=N_restrict, bilocal_ring_function=bilocal_ring_function)
+    return _run_batch(fn, list(selfies_list), n_jobs, chunk_size, cache, return_errors)
+
+
+atexit.register(close_pool)
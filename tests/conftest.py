@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# the modules of the repo are imported from its root, as in the scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+
+@pytest.fixture(scope='module')
+def model():
+    """ Randomly initialized inference model (moses selfies alphabet) """
+    pytest.importorskip('torch')
+    pytest.importorskip('dgl')
+    pytest.importorskip('rdkit')
+    import torch
+    from model import model_from_json
+    torch.manual_seed(0)
+    model = model_from_json('inference_default', load_weights=False)
+    return model.eval()
@@ -0,0 +1,106 @@
+"""
+Early terminating decoding (stop_on_pad) gives the molecules of the full greedy unroll
+"""
+import json
+import os
+import random
+
+import pytest
+
+from selfies import encoder, decoder_indices, derivation_tables, derivation_ended, _split_selfies_symbols
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+
+# branches, rings, and padding chars read as branch sizes
+SMILES = ['CC(=O)N', 'C1=CC=CC=C1', 'CC(C)(C)C1=CC=C(O)C=C1', 'O=C1CCCN1', 'CC1=CC(=O)C=CC1=O', 'OC(=O)C1CC1',
+          'CN1C=NC2=C1C(=O)N(C)C(=O)N2C']
+
+
+def moses_alphabet():
+    with open(os.path.join(script_dir, '..', 'map_files', 'moses_alphabets.json')) as f:
+        alphabet = json.load(f)['selfies_alphabet']
+    return dict(enumerate(alphabet)), alphabet.index('[epsilon]')
+
+
+def stop_length(row, pad, tables):
+    """ Length of row when decoding stops early : at the first padding char where the derivation has ended """
+    for n in range(1, len(row) + 1):
+        if row[n - 1] == pad and derivation_ended(row[:n], *tables):
+            return n
+    return len(row)
+
+
+def test_molecules_stop_after_last_symbol():
+    index_to_char, pad = moses_alphabet()
+    char_to_index = {c: i for i, c in index_to_char.items()}
+    tables = derivation_tables(index_to_char)
+    for smiles in SMILES:
+        symbols, _ = _split_selfies_symbols(encoder(smiles))
+        row = [char_to_index[s] for s in symbols] + [pad] * 10
+        # [Branch1_3][epsilon] : the padding char is a branch size, not the end of the molecule
+        assert stop_length(row, pad, tables) == len(symbols) + 1
+
+
+def test_stopped_rows_decode_as_full_rows():
+    index_to_char, pad = moses_alphabet()
+    tables = derivation_tables(index_to_char)
+    rng = random.Random(0)
+    weights = [3. if 'Branch' in c or 'Ring' in c else 1. for c in index_to_char.values()]
+    weights[pad] = 8.
+    n_stopped = 0
+    for _ in range(500):
+        row = rng.choices(range(len(index_to_char)), weights, k=54)
+        n = stop_length(row, pad, tables)
+        if n == len(row):
+            continue
+        n_stopped += 1
+        stopped = row[:n] + [pad] * (len(row) - n)
+        full = decoder_indices([stopped, row], index_to_char, PrintErrorMessage=False)
+        assert full[0] == full[1]
+    assert n_stopped > 0
+
+
+def test_decode_stop_on_pad(model):
+    import torch
+    z = model.sample_z_prior(256)
+    with torch.no_grad():
+        full = torch.max(model.decode(z), dim=1)[1]
+        stopped = torch.max(model.decode(z, stop_on_pad=True), dim=1)[1]
+    assert decoder_indices(stopped, model.index_to_char) == decoder_indices(full, model.index_to_char)
+
+
+def test_decode_indices_stop_on_pad(model):
+    z = model.sample_z_prior(256)
+    full = model.decode_indices(z)
+    stopped = model.decode_indices(z, stop_on_pad=True)
+    assert decoder_indices(stopped, model.index_to_char) == decoder_indices(full, model.index_to_char)
+
+
+def test_scripted_sampler(model):
+    import torch
+    from scripted_sampler import script_sampler
+    z = model.sample_z_prior(256)
+    with torch.no_grad():
+        scripted = script_sampler(model)(z)
+    assert torch.equal(scripted, model.decode_indices(z, stop_on_pad=True))
+
+
+@pytest.mark.parametrize('temperature', [0., 1.])
+def test_logprobs_over_decoded_lengths(model, temperature):
+    # importance weights of the CbAS sampler : the prior is scored over the chars the search model decoded
+    import torch
+    torch.manual_seed(0)
+    z = model.sample_z_prior(64)
+    indices, logprobs = model.decode_indices(z, stop_on_pad=True, return_logprobs=True, temperature=temperature)
+    with torch.no_grad():
+        scored = model.sequence_logprob(z, indices, model.decoded_lengths(indices))
+    assert torch.allclose(scored, logprobs, atol=1e-3)
+
+
+def test_beams_that_fail_to_decode(model, monkeypatch):
+    # beams the selfies decoder can't read (-1) are skipped, the top beam is kept if no beam is valid
+    import torch
+    torch.manual_seed(0)
+    beams = model.decode_beam(model.sample_z_prior(4), k=3)
+    monkeypatch.setattr('model.decoder', lambda selfies: -1)
+    assert model.beam_out_to_smiles(beams) == model.indices_to_smiles(beams[:, 0])
@@ -0,0 +1,66 @@
+"""
+The direct RDKit -> DGL featurizer gives the graphs of the networkx path (smiles_to_nx, one-hot maps, from_networkx)
+"""
+import os
+import pickle
+
+import pytest
+
+np = pytest.importorskip('numpy')
+torch = pytest.importorskip('torch')
+nx = pytest.importorskip('networkx')
+pytest.importorskip('dgl')
+pytest.importorskip('rdkit')
+
+from data_processing.rdkit_to_dgl import GraphFeaturizer
+from data_processing.rdkit_to_nx import smiles_to_nx
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+
+SMILES = ['CC(=O)N', 'c1ccccc1', 'CC(C)(C)c1ccc(O)cc1', 'O=C1CCCN1', 'Cn1cnc2c1c(=O)n(C)c(=O)n2C',
+          'C[C@@H](N)C(=O)O', 'C[C@H]1CC[C@@H](C)CC1', 'FC(F)(F)c1ccc(Cl)cc1', 'C#Cc1ccccc1Br', 'C[NH+](C)CC(=O)[O-]',
+          'O=S(=O)(N)c1ccccc1', 'CC(C)NCC(O)COc1cccc2ccccc12', 'C']
+
+
+@pytest.fixture(scope='module')
+def maps():
+    with open(os.path.join(script_dir, '..', 'map_files', 'edges_and_nodes_map.pickle'), 'rb') as f:
+        return [pickle.load(f) for _ in range(4)]  # edge_map, at_map, chi_map, charges_map
+
+
+def networkx_graph(smiles, maps):
+    """ src, dst, edge types and node features of the networkx path the datasets used before GraphFeaturizer """
+    edge_map, at_map, chi_map, charges_map = maps
+    graph = smiles_to_nx(smiles)
+    h = []
+    for _, atom in sorted(graph.nodes(data=True)):
+        at_type, charge = np.zeros(len(at_map), dtype=np.float32), np.zeros(len(charges_map), dtype=np.float32)
+        at_type[at_map[atom['atomic_num']]] = 1.
+        charge[charges_map[atom['formal_charge']]] = 1.
+        h.append(np.concatenate((at_type, charge, [chi_map[atom['num_explicit_hs']], chi_map[atom['is_aromatic']],
+                                                   chi_map[atom['chiral_tag']]])))
+    edges = list(graph.to_directed().edges(data=True))  # edge order of DGLGraph.from_networkx
+    src = np.array([u for u, _, _ in edges], dtype=np.int64)
+    dst = np.array([v for _, v, _ in edges], dtype=np.int64)
+    edge_types = np.array([edge_map[e['bond_type']] for _, _, e in edges], dtype=np.int64)
+    return src, dst, edge_types, np.array(h, dtype=np.float32).reshape(-1, len(at_map) + len(charges_map) + 3)
+
+
+def test_same_graphs_as_networkx(maps):
+    featurizer = GraphFeaturizer(*maps)
+    for smiles in SMILES:
+        src, dst, edge_types, h = networkx_graph(smiles, maps)
+        g = featurizer.smiles_to_dgl(smiles)
+        g_src, g_dst = g.all_edges(order='eid')
+        assert g.number_of_nodes() == h.shape[0]
+        assert np.array_equal(g_src.numpy(), src) and np.array_equal(g_dst.numpy(), dst), smiles
+        assert np.array_equal(g.edata['one_hot'].numpy(), edge_types), smiles
+        assert g.ndata['h'].dtype == torch.float32
+        assert np.array_equal(g.ndata['h'].numpy(), h), smiles
+
+
+def test_unknown_features_raise(maps):
+    featurizer = GraphFeaturizer(*maps)
+    with pytest.raises(KeyError):
+        featurizer.smiles_to_dgl('[U]')
+    assert featurizer.smiles_to_dgl('not a smiles') is None
@@ -0,0 +1,33 @@
+"""
+Graph shards give the molecules of the dataset, and chunks where all molecules are skipped write no shard
+"""
+import pytest
+
+pd = pytest.importorskip('pandas')
+torch = pytest.importorskip('torch')
+pytest.importorskip('dgl')
+pytest.importorskip('rdkit')
+
+from dataloaders.graph_shards import GraphShards, list_shards, write_shard
+from data_processing.prepare_shards import prepare
+
+# the second chunk of 2 molecules only has invalid smiles
+SMILES = ['CC(=O)N', 'c1ccccc1', 'C1CC', 'CC(C', 'O=C1CCCN1', 'CCO']
+
+
+def test_empty_shard(tmp_path):
+    assert not write_shard([], str(tmp_path / 'shard_0000'), {})
+    assert not (tmp_path / 'shard_0000').exists()
+
+
+def test_prepare_skips_empty_shards(tmp_path):
+    csv_path = tmp_path / 'mols.csv'
+    pd.DataFrame({'smiles': SMILES}).to_csv(csv_path, index=False)
+    out_dir = str(tmp_path / 'shards')
+    prepare(str(csv_path), out_dir, 'selfies', 'moses_alphabets.json', props=[], targets=[], shard_size=2, procs=1,
+            redo_selfies=True)
+    shard_dirs = list_shards(out_dir)
+    assert len(shard_dirs) == 2
+    shards = GraphShards(shard_dirs)
+    assert len(shards) == 4
+    assert [shards.get(i)[3].shape[0] for i in range(len(shards))] == [4, 6, 6, 3]  # heavy atoms
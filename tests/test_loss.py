@@ -0,0 +1,42 @@
+"""
+The reconstruction loss of a batch trimmed to its longest sequence (utils.trim_padding) is the untrimmed loss
+"""
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from selfies import encoder, _split_selfies_symbols
+from loss_func import VAELoss
+from utils import trim_padding
+
+# short molecules, so that trimming drops many padding columns
+SMILES = ['CC(=O)N', 'C1=CC=CC=C1', 'O=C1CCCN1', 'CCO', 'C']
+
+
+def encode(smiles, model):
+    char_to_index = {c: int(i) for i, c in model.index_to_char.items()}  # keys are strings in params.json
+    rows = []
+    for s in smiles:
+        symbols, _ = _split_selfies_symbols(encoder(s))
+        rows.append([char_to_index[c] for c in symbols] + [model.pad_index] * (model.max_len - len(symbols)))
+    return torch.tensor(rows, dtype=torch.long)
+
+
+def reconstruction_loss(model, z, x, pad_index):
+    with torch.no_grad():
+        out = model.decode(z, x, teacher_forced=1.0)
+    mu = logvar = torch.zeros_like(z)
+    return VAELoss(out, x, mu, logvar, pad_index=pad_index)[0]
+
+
+@pytest.mark.parametrize('batch', [[0, 1, 2, 3, 4], [3, 4], [4]])
+def test_trimmed_loss(model, batch):
+    x = encode([SMILES[i] for i in batch], model)
+    trimmed = trim_padding(x, model.pad_index)
+    assert trimmed.shape[1] < x.shape[1]
+    torch.manual_seed(0)
+    z = model.sample_z_prior(len(batch))
+    full = reconstruction_loss(model, z, x, model.pad_index)
+    # any number of padding columns kept after the longest sequence
+    for width in (trimmed.shape[1], trimmed.shape[1] + 1, x.shape[1] // 2):
+        assert torch.allclose(reconstruction_loss(model, z, x[:, :width], model.pad_index), full, rtol=1e-5)
@@ -0,0 +1,54 @@
+"""
+The table-driven derivation and the decoding from token indices give the smiles of the reference decoder
+"""
+import json
+import os
+import random
+
+import pytest
+
+from selfies import encoder, decoder, decoder_indices, selfies_alphabet
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+
+SMILES = ['CC(=O)N', 'C1=CC=CC=C1', 'CC(C)(C)C1=CC=C(O)C=C1', 'O=C1CCCN1', 'CN1C=NC2=C1C(=O)N(C)C(=O)N2C',
+          'C[C@@H](N)C(=O)O', 'C[C@H]1CC[C@@H](C)CC1', 'FC(F)(F)C1=CC=C(Cl)C=C1', 'C#CC1=CC=CC=C1Br', 'CSCC=O',
+          'C1CC2CCC1CC2', 'O=S(=O)(N)C1=CC=CC=C1', 'CC(C)NCC(O)COC1=CC=CC2=CC=CC=C21']
+
+
+def alphabet(name='moses_alphabets.json'):
+    with open(os.path.join(script_dir, '..', 'map_files', name)) as f:
+        return json.load(f)['selfies_alphabet']
+
+
+def random_rows(symbols, n, length, seed=0):
+    rng = random.Random(seed)
+    weights = [3. if 'Branch' in s or 'Ring' in s else 1. for s in symbols]
+    weights[symbols.index('[epsilon]')] = 6.
+    return [rng.choices(range(len(symbols)), weights, k=rng.randint(0, length)) for _ in range(n)]
+
+
+@pytest.mark.parametrize('N_restrict', [True, False])
+def test_table_driven_molecules(N_restrict):
+    for smiles in SMILES:
+        selfies = encoder(smiles)
+        assert decoder(selfies, N_restrict, table_driven=True) == decoder(selfies, N_restrict, table_driven=False)
+
+
+@pytest.mark.parametrize('N_restrict', [True, False])
+def test_table_driven_random_strings(N_restrict):
+    symbols = list(dict.fromkeys(alphabet() + selfies_alphabet()))
+    for row in random_rows(symbols, 2000, 30):
+        selfies = ''.join(symbols[i] for i in row)
+        assert decoder(selfies, N_restrict, PrintErrorMessage=False, table_driven=True) == \
+            decoder(selfies, N_restrict, PrintErrorMessage=False, table_driven=False), selfies
+
+
+def test_decoder_indices():
+    symbols = alphabet()
+    index_to_char = {str(i): s for i, s in enumerate(symbols)}  # json-loaded alphabets have str keys
+    pad = symbols.index('[epsilon]')
+    rows = [row + [pad] * (40 - len(row)) for row in random_rows(symbols, 2000, 40, seed=1)]
+    expected = [decoder(''.join(symbols[i] for i in row), PrintErrorMessage=False) for row in rows]
+    assert decoder_indices(rows, index_to_char, PrintErrorMessage=False) == expected
+    assert decoder_indices(rows, index_to_char, PrintErrorMessage=False, n_jobs=2, chunk_size=300) == expected
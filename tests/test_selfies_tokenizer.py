@@ -0,0 +1,62 @@
+"""
+The bulk encoder gives the encoding of a plain per-token lookup in the alphabet
+"""
+import json
+import os
+import random
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('pandas')
+
+from data_processing.selfies_tokenizer import SelfiesTokenizer, tokenize
+from selfies import encoder
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+
+SMILES = ['CC(=O)N', 'C1=CC=CC=C1', 'CC(C)(C)C1=CC=C(O)C=C1', 'O=C1CCCN1', 'CN1C=NC2=C1C(=O)N(C)C(=O)N2C']
+
+
+def reference_encode(tokenizer, selfies):
+    """ Row of indices and length by a dict lookup per token, None and -1 for rows that can't be encoded """
+    tokens = tokenize(selfies)
+    if ''.join(tokens) != selfies or len(tokens) > tokenizer.max_len:
+        return None, -1
+    if any(t not in tokenizer.char_to_index for t in tokens):
+        return None, -1
+    row = [tokenizer.char_to_index[t] for t in tokens]
+    return row + [tokenizer.pad_index] * (tokenizer.max_len - len(row)), len(tokens)
+
+
+@pytest.fixture(scope='module')
+def tokenizer():
+    with open(os.path.join(script_dir, '..', 'map_files', 'moses_alphabets.json')) as f:
+        return SelfiesTokenizer(json.load(f)['selfies_alphabet'], max_len=54)
+
+
+def check(tokenizer, rows):
+    indices, lengths = tokenizer.encode(rows)
+    for selfies, row, length in zip(rows, indices, lengths):
+        ref_row, ref_length = reference_encode(tokenizer, selfies)
+        assert length == ref_length, selfies
+        if ref_row is not None:
+            assert row.tolist() == ref_row
+
+
+def test_neighbouring_rows(tokenizer):
+    # a token ends at its own ']', invalid rows do not invalidate their neighbours
+    indices, lengths = tokenizer.encode(['[C][O]', 'C', '[C]', '[N][X]', '[O]', '[C', '][O]', ''])
+    assert lengths.tolist() == [2, -1, 1, -1, 1, -1, -1, 0]
+    assert indices[0, :2].tolist() == [tokenizer.char_to_index['[C]'], tokenizer.char_to_index['[O]']]
+
+
+def test_same_encoding_as_lookup(tokenizer):
+    valid = [encoder(s) for s in SMILES]
+    invalid = ['C', '[C]C', '[C][Xx]', '[C', '][C]', '[[C]', '[C]]', '[C]' * 60, '']
+    rng = random.Random(0)
+    rows = [rng.choice(valid + invalid) for _ in range(2000)]
+    check(tokenizer, rows)
+    # rows split across chunks
+    for a, b in zip(tokenizer.encode(rows, chunk_size=7), tokenizer.encode(rows)):
+        assert np.array_equal(a, b)
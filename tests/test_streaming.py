@@ -0,0 +1,49 @@
+"""
+The streaming dataset yields every molecule of the csv but the held-out ones, with or without a shuffle buffer
+"""
+import os
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('torch')
+pytest.importorskip('dgl')
+pytest.importorskip('rdkit')
+
+from rdkit import Chem
+
+from dataloaders.molDataset import molDataset
+from dataloaders.streaming import StreamingMolDataset
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+
+SMILES = ['CC(=O)N', 'c1ccccc1', 'CC(C)(C)c1ccc(O)cc1', 'O=C1CCCN1', 'Cn1cnc2c1c(=O)n(C)c(=O)n2C',
+          'C[C@@H](N)C(=O)O', 'FC(F)(F)c1ccc(Cl)cc1', 'C#Cc1ccccc1Br', 'O=S(=O)(N)c1ccccc1', 'CCO', 'CCN', 'C']
+N_VALID = 2
+
+
+@pytest.fixture(scope='module')
+def csv_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp('stream') / 'mols.csv'
+    pd.DataFrame({'smiles': SMILES}).to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def dataset():
+    return molDataset(None, os.path.join(script_dir, '..', 'map_files'), 'selfies', build_alphabet=False,
+                      alphabet_name='moses_alphabets.json', props=[], targets=[], graph_only=True)
+
+
+def n_atoms(stream):
+    return [graph.num_nodes() for graph, _, _, _ in stream]
+
+
+@pytest.mark.parametrize('shuffle_buffer', [0, 4, 100])
+def test_stream_yields_all_molecules(csv_path, dataset, shuffle_buffer):
+    stream = StreamingMolDataset(csv_path, dataset, n_valid=N_VALID, block_bytes=32, shuffle_buffer=shuffle_buffer,
+                                 epochs=2)
+    in_order = StreamingMolDataset(csv_path, dataset, n_valid=N_VALID, block_bytes=1 << 22, shuffle_buffer=0)
+    assert len(in_order.valid_df) == N_VALID
+    assert n_atoms(in_order) == [Chem.MolFromSmiles(s).GetNumAtoms() for s in SMILES[N_VALID:]]
+    assert sorted(n_atoms(stream)) == sorted(2 * n_atoms(in_order))
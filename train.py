@@ -34,7 +34,7 @@ script_dir = os.path.dirname(os.path.realpath(__file__))
 if __name__=='__main__':
     sys.path.append(script_dir)
 
-from utils import ModelDumper, disable_rdkit_logging, setup, log_reconstruction
+from utils import ModelDumper, disable_rdkit_logging, setup, log_reconstruction, trim_padding
 from dgl_utils import send_graph_to_device
 from model import Model
 from loss_func import VAELoss, weightedPropsLoss, affsRegLoss, affsClassifLoss
@@ -46,6 +46,8 @@ if __name__ == "__main__":
 
     parser.add_argument('--name', type=str, default='default') # model name in results/saved_models/
     parser.add_argument('--train', help="path to training dataframe", type=str, default='data/moses_train.csv')
+    parser.add_argument('--shards', help="precomputed graph shards dir (data_processing/prepare_shards.py), "
+                                         "used instead of --train", type=str, default=None)
     parser.add_argument("--cutoff", help="Max number of molecules to use. Set to -1 for all in csv", type=int, default=-1)
     
     # Alphabets params 
@@ -104,6 +106,7 @@ if __name__ == "__main__":
     parser.add_argument('--bin_affs', action='store_true')  # Binned discretized affs or true values
     
     parser.add_argument('--processes', type=int, default=20)  # num workers
+    parser.add_argument('--bucket', action='store_true')  # length bucketed batches, decoded up to their longest sequence
 
     # =======
 
@@ -145,9 +148,11 @@ if __name__ == "__main__":
                      alphabet_name = args.alphabet_name, 
                      n_mols=args.cutoff,
                      num_workers=args.processes,
+                     bucket_by_length=args.bucket,
                      batch_size=args.batch_size,
                      props=properties,
-                     targets=targets)
+                     targets=targets,
+                     shards_path=args.shards)
 
     train_loader, _, test_loader = loaders.get_data()
 
@@ -177,6 +182,9 @@ if __name__ == "__main__":
     dumper.dump()
 
     model = Model(**params).to(device)
+    pad_index = loaders.dataset.char_to_index.get('[epsilon]', 0)  # smiles are padded with zeros
+    # trimmed batches : the loss of each row stops at its end token, whatever the padding of the batch
+    loss_pad_index = pad_index if args.bucket else None
 
     load_model = args.load_model
     load_path = f'results/saved_models/{args.load_name}/params.json'
@@ -211,6 +219,8 @@ if __name__ == "__main__":
 
             total_steps += 1  # count training steps
 
+            if args.bucket:  # unroll the decoder only up to the longest sequence of the batch
+                smiles = trim_padding(smiles, pad_index)
             smiles = smiles.to(device)
             graph = send_graph_to_device(graph, device)
             if use_props:
@@ -222,7 +232,7 @@ if __name__ == "__main__":
             mu, logv, _, out_smi, out_p, out_a = model(graph, smiles, tf=tf_proba)
 
             # Compute loss terms : change according to multitask setting
-            rec, kl = VAELoss(out_smi, smiles, mu, logv)
+            rec, kl = VAELoss(out_smi, smiles, mu, logv, pad_index=loss_pad_index)
 
             if not use_affs and not use_props:  # VAE only
                 pmse, amse = torch.tensor(0), torch.tensor(0)
@@ -316,7 +326,7 @@ if __name__ == "__main__":
 
                 # Compute loss : change according to multitask
 
-                rec, kl = VAELoss(out_smi, smiles, mu, logv)
+                rec, kl = VAELoss(out_smi, smiles, mu, logv, pad_index=loss_pad_index)
                 if not use_affs and not use_props:  # VAE only
                     pmse, amse = torch.tensor(0), torch.tensor(0)
                 elif use_props and not use_affs:
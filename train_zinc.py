@@ -22,6 +22,7 @@ import sys, os
 import torch
 import numpy as np
 import csv 
+import itertools
 
 import pandas as pd
 import torch.utils.data
@@ -36,11 +37,13 @@ script_dir = os.path.dirname(os.path.realpath(__file__))
 if __name__ == '__main__':
     sys.path.append(script_dir)
 
-from utils import ModelDumper, disable_rdkit_logging, setup, log_reconstruction
+from utils import ModelDumper, disable_rdkit_logging, setup, log_reconstruction, trim_padding
 from dgl_utils import send_graph_to_device
 from model import Model
 from loss_func import VAELoss, weightedPropsLoss, affsRegLoss, affsClassifLoss
 from dataloaders.molDataset import molDataset, Loader
+from dataloaders.graph_shards import list_shards
+from dataloaders.streaming import get_stream_loaders, StreamChunk
 
 from selfies import decoder
 
@@ -54,6 +57,13 @@ if __name__ == "__main__":
     parser.add_argument('--train', help="path to training dataframe", type=str, default='data/shuffled_whole_zinc.csv')
     parser.add_argument("--chunk_size", help="Nbr of molecules loaded simultaneously in memory (csv chunk)", type=int,
                         default=10000)
+    parser.add_argument('--shards', help="precomputed graph shards dir (data_processing/prepare_shards.py), "
+                                         "iterated on instead of csv chunks", type=str, default=None)
+    parser.add_argument('--stream', action='store_true', help="stream the csv with persistent workers "
+                                                              "instead of loading it by chunks")
+    parser.add_argument('--n_valid', type=int, default=10000)  # --stream : held-out validation molecules
+    parser.add_argument('--shuffle_buffer', type=int, default=20000)  # --stream : molecules in the shuffle buffer
+    parser.add_argument('--stream_epochs', type=int, default=1)  # --stream : passes over the csv
 
     # Alphabets params 
     parser.add_argument('--decode', type=str, default='selfies')  # language used : 'smiles' or 'selfies'
@@ -112,6 +122,7 @@ if __name__ == "__main__":
     # Other : 
     parser.add_argument('--gpu_id', type=int, default=0)  # run model on cuda:{id} if multiple gpus on server
     parser.add_argument('--processes', type=int, default=20)  # num workers
+    parser.add_argument('--bucket', action='store_true')  # length bucketed batches, decoded up to their longest sequence
 
     # =======
 
@@ -153,6 +164,7 @@ if __name__ == "__main__":
                      alphabet_name=args.alphabet_name,
                      n_mols=-1,
                      num_workers=args.processes,
+                     bucket_by_length=args.bucket,
                      batch_size=args.batch_size,
                      props=properties,
                      targets=targets,
@@ -184,6 +196,9 @@ if __name__ == "__main__":
     dumper.dump()
 
     model = Model(**params).to(device)
+    pad_index = loaders.dataset.char_to_index.get('[epsilon]', 0)  # smiles are padded with zeros
+    # trimmed batches : the loss of each row stops at its end token, whatever the padding of the batch
+    loss_pad_index = pad_index if args.bucket else None
 
     load_model = args.load_model
     load_path = f'results/saved_models/{args.load_name}/params.json'
@@ -213,11 +228,30 @@ if __name__ == "__main__":
     tf_proba = args.tf_init
     start = time() # get training start time 
 
-    for epoch, chunk in enumerate(pd.read_csv(os.path.join(script_dir, args.train), chunksize=args.chunk_size)):
+    if args.stream:
+        # one loader for the whole run, chunks are chunk_size molecules of the stream
+        stream_loader, valid_loader = get_stream_loaders(os.path.join(script_dir, args.train), loaders.dataset,
+                                                         batch_size=args.batch_size, num_workers=args.processes,
+                                                         n_valid=args.n_valid, shuffle_buffer=args.shuffle_buffer,
+                                                         epochs=args.stream_epochs)
+        stream = iter(stream_loader)
+        chunks = itertools.count()
+    elif args.shards is not None:
+        chunks = list_shards(os.path.join(script_dir, args.shards))
+    else:
+        chunks = pd.read_csv(os.path.join(script_dir, args.train), chunksize=args.chunk_size)
+
+    for epoch, chunk in enumerate(chunks):
 
-        # give csv chunk to loader 
-        loaders.dataset.pass_dataset(chunk, graph_only=False)
-        train_loader, _, test_loader = loaders.get_data()
+        # give csv chunk (or graph shard) to loader 
+        if args.stream:
+            train_loader, test_loader = StreamChunk(stream, args.chunk_size // args.batch_size), valid_loader
+        else:
+            if args.shards is not None:
+                loaders.dataset.pass_shards([chunk], graph_only=False)
+            else:
+                loaders.dataset.pass_dataset(chunk, graph_only=False)
+            train_loader, _, test_loader = loaders.get_data()
 
         model.train()
         epoch_train_rec, epoch_train_kl, epoch_train_pmse, epoch_train_amse = 0, 0, 0, 0
@@ -226,6 +260,8 @@ if __name__ == "__main__":
 
             total_steps += 1  # count training steps
 
+            if args.bucket:  # unroll the decoder only up to the longest sequence of the batch
+                smiles = trim_padding(smiles, pad_index)
             smiles = smiles.to(device)
             graph = send_graph_to_device(graph, device)
             if use_props:
@@ -235,7 +271,7 @@ if __name__ == "__main__":
             mu, logv, _, out_smi, out_p, _ = model(graph, smiles, tf=tf_proba, mean_only = False) # stochastic sampling 
 
             # Compute loss terms : change according to multitask setting
-            rec, kl = VAELoss(out_smi, smiles, mu, logv)
+            rec, kl = VAELoss(out_smi, smiles, mu, logv, pad_index=loss_pad_index)
 
             if not use_props:  # VAE only
                 pmse = torch.tensor(0)
@@ -307,8 +343,7 @@ if __name__ == "__main__":
                 
                 with torch.no_grad():
                     samples_z = model.sample_z_prior(n_mols=200)
-                    gen_seq = model.decode(samples_z)
-                    _, sample_indices = torch.max(gen_seq, dim=1)
+                    sample_indices = model.decode_indices(samples_z, stop_on_pad=True)
                     batch_selfies = model.indices_to_smiles(sample_indices)
                     smiles = [decoder(s) for s in batch_selfies]
                 
@@ -321,6 +356,9 @@ if __name__ == "__main__":
             epoch_train_kl += kl.item()
             epoch_train_pmse += pmse.item()
 
+        if args.stream and train_loader.consumed == 0:  # end of the stream
+            break
+
         # Validation pass : No teacher forcing for decoding (sampling mode)
         model.eval()
         val_rec, val_kl, val_amse, val_pmse = 0, 0, 0, 0
@@ -337,7 +375,7 @@ if __name__ == "__main__":
 
                 # Compute loss : change according to multitask
 
-                rec, kl = VAELoss(out_smi, smiles, mu, logv)
+                rec, kl = VAELoss(out_smi, smiles, mu, logv, pad_index=loss_pad_index)
                 if not use_props:  # VAE only
                     pmse = torch.tensor(0)
                 elif use_props :
@@ -280,3 +280,30 @@ def log_smiles_from_indices(true_idces, out_idces, idx_to_char):
 def i2s(idces, idx_to_char):
     # list of indices to sequence of characters (=smiles)
     return ''.join([idx_to_char[idx] for idx in idces])
+
+
+def unique_rows(indices):
+    """
+    Unique rows of a (N, seq_len) tensor or array of token indices, in order of first occurrence.
+    Used to decode and parse each distinct sequence of a batch only once.
+    Returns the unique rows (n_unique * seq_len) numpy array, the positions of their first occurrence in indices,
+    and for each of the N rows the index of its unique row (unique[inverse] == indices)
+    """
+    if torch.is_tensor(indices):
+        indices = indices.cpu().numpy()
+    _, first, inverse = np.unique(indices, axis=0, return_index=True, return_inverse=True)
+    # np.unique sorts the rows, restore the order of first occurrence
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return indices[first[order]], first[order], rank[inverse.reshape(-1)]
+
+
+def trim_padding(indices, pad_index):
+    """
+    Drops the trailing columns of a (batch_size * seq_len) tensor of padded char indices that are padding in all rows.
+    The first padding char after the longest sequence is kept, as it is the end token the decoder learns to emit.
+    """
+    used = torch.nonzero((indices != pad_index).any(dim=0))
+    length = 1 if used.numel() == 0 else int(used.max()) + 2
+    return indices[:, :min(length, indices.shape[1])]